@@ -0,0 +1,101 @@
+# bench_embeddings.py
+# Accuracy vs. speed of the embedding backends on airlines_policy.md.
+#
+# Every numbered question in the policy ("1. Can I receive an invoice ...?") becomes a query. For
+# each backend we time chunk encoding and single-query latency, and measure
+#   hit@k     - the chunk holding the question's answer is in the top k
+#   recall@k  - overlap of the top k with the full-precision torch top k
+#
+#   python bench_embeddings.py --backends torch torch-int8 onnx onnx-int8 --threads 4
+import argparse
+import json
+import re
+import statistics
+import time
+
+import numpy as np
+
+from chunking import chunk_document
+from embedding_backends import BACKENDS, load_embedder
+from resources import EMBEDDING_MODEL
+
+def load_queries(chunks: list) -> list:
+    """(question, index of the chunk that contains it) for every numbered Q&A item."""
+    queries = []
+    for i, chunk in enumerate(chunks):
+        for match in re.finditer(r"^\d{1,3}\.\s+(.+?\?)", chunk["text"], re.M):
+            queries.append((match.group(1), i))
+    return queries
+
+def top_k(chunk_vectors: np.ndarray, query_vectors: np.ndarray, k: int) -> np.ndarray:
+    chunk_vectors = chunk_vectors / np.linalg.norm(chunk_vectors, axis=1, keepdims=True)
+    query_vectors = query_vectors / np.linalg.norm(query_vectors, axis=1, keepdims=True)
+    return np.argsort(-(query_vectors @ chunk_vectors.T), axis=1)[:, :k]
+
+def run_backend(model_name: str, backend: str, texts: list, questions: list, threads: int, batch_size: int, runs: int) -> dict:
+    start = time.perf_counter()
+    model = load_embedder(model_name, backend, threads)
+    load_s = time.perf_counter() - start
+    model.encode(texts[:batch_size], batch_size=batch_size)  # warm up kernels and caches
+
+    encode_times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        chunk_vectors = model.encode(texts, batch_size=batch_size)
+        encode_times.append(time.perf_counter() - start)
+    query_latencies = []
+    for question in questions:
+        start = time.perf_counter()
+        model.encode([question])
+        query_latencies.append((time.perf_counter() - start) * 1000)
+    query_vectors = model.encode(questions, batch_size=batch_size)
+
+    encode_s = statistics.median(encode_times)
+    return {
+        "backend": backend,
+        "load_s": round(load_s, 2),
+        "chunks_per_sec": round(len(texts) / encode_s, 1),
+        "query_p50_ms": round(statistics.median(query_latencies), 2),
+        "query_p99_ms": round(sorted(query_latencies)[int(0.99 * (len(query_latencies) - 1))], 2),
+        "_chunk_vectors": np.asarray(chunk_vectors),
+        "_query_vectors": np.asarray(query_vectors),
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--file", default="airlines_policy.md")
+    parser.add_argument("--model", default=EMBEDDING_MODEL, help="Model name or local path")
+    parser.add_argument("--backends", nargs="+", default=list(BACKENDS), choices=BACKENDS)
+    parser.add_argument("--threads", type=int, default=None, help="Inference threads (default: library default)")
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--topk", type=int, default=3)
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    with open(args.file, "r", encoding="utf-8") as f:
+        chunks = chunk_document(f.read())
+    texts = [c["text"] for c in chunks]
+    queries = load_queries(chunks)
+    questions = [q for q, _ in queries]
+    answers = np.array([i for _, i in queries])
+    print(f"📄 {len(texts)} chunks, {len(questions)} questions from {args.file}\n")
+
+    results, reference = [], None
+    for backend in args.backends:
+        try:
+            result = run_backend(args.model, backend, texts, questions, args.threads, args.batch_size, args.runs)
+        except Exception as e:
+            print(f"❌ {backend}: {e}")
+            continue
+        hits = top_k(result.pop("_chunk_vectors"), result.pop("_query_vectors"), args.topk)
+        if reference is None:
+            # Recall is measured against the first backend that ran, normally full-precision torch
+            reference = hits
+        result[f"hit@{args.topk}"] = round(float(np.mean([a in row for a, row in zip(answers, hits)])), 4)
+        result[f"recall@{args.topk}"] = round(float(np.mean(
+            [len(set(row) & set(ref)) / args.topk for row, ref in zip(hits, reference)])), 4)
+        results.append(result)
+        print(f"⚙️ {backend:10s} {result['chunks_per_sec']:8.1f} chunks/s  query p50 {result['query_p50_ms']:6.2f} ms  "
+              f"hit@{args.topk} {result[f'hit@{args.topk}']:.3f}  recall@{args.topk} {result[f'recall@{args.topk}']:.3f}")
+
+    print(json.dumps(results, indent=2))
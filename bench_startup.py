@@ -0,0 +1,54 @@
+# bench_startup.py
+# Measures cold-start cost: how long a fresh interpreter takes to import each entry point, and
+# (optionally) how long the first embedding request takes once the model loads lazily.
+#
+#   python bench_startup.py --runs 5
+#   python bench_startup.py --modules rag_api --first-encode
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+IMPORT_SNIPPET = """
+import json, time
+start = time.perf_counter()
+import {module}
+imported = time.perf_counter() - start
+result = {{"import_s": imported}}
+if {first_encode}:
+    import resources
+    start = time.perf_counter()
+    resources.get_embedder().encode(["first request"])
+    result["first_encode_s"] = time.perf_counter() - start
+    start = time.perf_counter()
+    resources.get_embedder().encode(["second request"])
+    result["warm_encode_s"] = time.perf_counter() - start
+print(json.dumps(result))
+"""
+
+def measure(module: str, runs: int, first_encode: bool) -> dict:
+    samples = []
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, "-c", IMPORT_SNIPPET.format(module=module, first_encode=first_encode)],
+                             capture_output=True, text=True, check=True)
+        samples.append(json.loads(out.stdout.strip().splitlines()[-1]))
+    summary = {"module": module, "runs": runs}
+    for key in samples[0]:
+        values = [s[key] for s in samples]
+        summary[key] = {"median": round(statistics.median(values), 3), "min": round(min(values), 3), "max": round(max(values), 3)}
+    return summary
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--modules", nargs="+", default=["rag_api", "minimal_rag_chroma", "main"])
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--first-encode", action="store_true", help="Also time the lazy model load on the first encode")
+    args = parser.parse_args()
+
+    for module in args.modules:
+        result = measure(module, args.runs, args.first_encode)
+        print(f"⏱️ {module}: import {result['import_s']['median']:.3f}s (median of {args.runs})"
+              + (f", first encode {result['first_encode_s']['median']:.3f}s, warm encode {result['warm_encode_s']['median']:.3f}s"
+                 if args.first_encode else ""))
+        print(json.dumps(result))
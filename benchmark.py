@@ -0,0 +1,335 @@
+# benchmark.py
+# Offline throughput baseline, no Google account or LLM API key needed.
+#
+# Gmail is replaced by fake_gmail (in-memory mailbox filled with synthetic MIME emails, with
+# optional per-call latency and quota errors) and the LLM by mock_llm_server running in-process.
+# Everything else is the real code: rag_api's /index, /query and /process-inbox (called through
+# ASGI, no network) and main.py's workflow. All state (Chroma, ledger, caches) lives in a fresh
+# temporary working directory, so runs are comparable.
+#
+#   python benchmark.py --emails 200 --output baseline.json
+#   python benchmark.py --emails 200 --gmail-latency-ms 50 --quota-error-rate 0.01 --compare baseline.json
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+
+PHASES = ("index", "query", "main", "rag_api")
+QUERY_PREFIXES = ("", "", "Hi, ", "Quick question: ", "Hello team, ")
+
+def log(message: str):
+    # Progress goes to stderr; stdout carries the JSON report
+    print(message, file=sys.stderr, flush=True)
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p * len(values)))] if values else None
+
+def latency_summary(latencies: list, seconds: float, unit: str) -> dict:
+    return {
+        unit: len(latencies),
+        f"{unit}_per_sec": round(len(latencies) / seconds, 2) if seconds > 0 else None,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 2) if latencies else None,
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2) if latencies else None,
+    }
+
+def load_questions(text: str) -> list:
+    """Every numbered question in the policy ("1. Can I receive an invoice ...?")."""
+    return [m.group(1) for m in re.finditer(r"^\d{1,3}\.\s+(.+?\?)", text, re.M)]
+
+def stage_latencies() -> dict:
+    import metrics
+    return {name: values for name, values in metrics.snapshot().items() if values}
+
+@contextlib.contextmanager
+def quiet(enabled: bool):
+    """Silences the per-email print()s of the workflows (they would dominate the output)."""
+    if not enabled:
+        yield
+        return
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+# --- Phases ---
+async def bench_index(client, policy_path: str, collection: str) -> dict:
+    from resources import EMBEDDING_MODEL, warmup
+
+    start = time.perf_counter()
+    warmup(EMBEDDING_MODEL)
+    warmup_s = time.perf_counter() - start
+
+    with open(policy_path, "rb") as f:
+        content = f.read()
+    runs = {}
+    # The first upload embeds every chunk; the second finds them all unchanged
+    for run in ("cold", "unchanged"):
+        start = time.perf_counter()
+        response = await client.post("/index", data={"collection": collection},
+                                     files={"file": (os.path.basename(policy_path), content)})
+        response.raise_for_status()
+        seconds = time.perf_counter() - start
+        result = response.json()
+        runs[run] = {"seconds": round(seconds, 3), "chunks_embedded": result["chunks_embedded"],
+                     "chunks_per_sec": round(result["chunks_indexed"] / seconds, 1)}
+    return {"file": os.path.basename(policy_path), "bytes": len(content), "chunks": result["chunks_indexed"],
+            "warmup_seconds": round(warmup_s, 3), **runs, "stages": stage_latencies()}
+
+async def bench_query(client, collection: str, questions: list, count: int, concurrency: int,
+                      modes: list, seed: int) -> dict:
+    import metrics
+    import rag_api
+
+    rng = random.Random(seed)
+    report = {}
+    for mode in modes:
+        metrics.reset()
+        queries = [rng.choice(QUERY_PREFIXES) + rng.choice(questions) for _ in range(count)]
+        semaphore = asyncio.Semaphore(concurrency)
+        latencies = []
+
+        async def one(query: str):
+            async with semaphore:
+                start = time.perf_counter()
+                response = await client.post("/query", json={"query": query, "collection": collection, "mode": mode})
+                response.raise_for_status()
+                latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one(q) for q in queries))
+        report[mode] = {**latency_summary(latencies, time.perf_counter() - start, "queries"), "stages": stage_latencies()}
+    report["query_embedder"] = rag_api.query_embedder.stats()
+    return report
+
+# Workflow outcomes that count as a handled email (a reply went out or a human was asked to)
+HANDLED_OUTCOMES = ("sent", "escalated", "success")
+
+def bench_main(service_factory, count: int, questions: list, args) -> dict:
+    import main
+    from fake_gmail import populate_mailbox
+
+    service = service_factory()
+    populate_mailbox(service.mailbox, count, questions, seed=args.seed, max_body_chars=args.max_body_chars,
+                     max_nesting=args.max_nesting)
+    latencies, outcomes = [], {}
+    start = time.perf_counter()
+    # main.py handles one email per run; keep going until the inbox is empty (or too many runs failed)
+    for _ in range(count * 3):
+        if not service.mailbox.unread_ids():
+            break
+        run_start = time.perf_counter()
+        try:
+            final_state = main.run_once()
+        except Exception as e:
+            outcome = type(e).__name__
+        else:
+            outcome = "error" if final_state.get("error") else "sent" if final_state.get("status") else "escalated"
+        # Throughput and latency only count emails the workflow handled; failures are reported separately
+        if outcome in HANDLED_OUTCOMES:
+            latencies.append(time.perf_counter() - run_start)
+        outcomes[outcome] = outcomes.get(outcome, 0) + 1
+    seconds = time.perf_counter() - start
+    failed = sum(n for outcome, n in outcomes.items() if outcome not in HANDLED_OUTCOMES)
+    return {**latency_summary(latencies, seconds, "emails"), "failed": failed, "seconds": round(seconds, 3), "outcomes": outcomes,
+            "sent": len(service.mailbox.sent), "gmail": service.stats(), "stages": stage_latencies()}
+
+async def bench_rag_api(client, service_factory, count: int, questions: list, args) -> dict:
+    import rag_api
+    from fake_gmail import populate_mailbox
+    from llm_client import get_llm_stats
+
+    service = service_factory()
+    populate_mailbox(service.mailbox, count, questions, seed=args.seed + 1, max_body_chars=args.max_body_chars,
+                     max_nesting=args.max_nesting)
+    report = {}
+    start = time.perf_counter()
+    try:
+        response = await client.post("/process-inbox", json={"max_messages": count, "concurrency": args.concurrency})
+        response.raise_for_status()
+        report["counts"] = response.json()["counts"]
+    except Exception as e:
+        # e.g. a throttled messages.list: the drain has no retry of its own
+        report["error"] = f"{type(e).__name__}: {e}"
+    seconds = time.perf_counter() - start
+
+    # Workflows wait for their own sends; this only catches replies still in the queue after an error
+    send_queue = rag_api.get_send_queue()
+    drain_start = time.perf_counter()
+    while time.perf_counter() - drain_start < args.send_timeout:
+        stats = send_queue.stats()
+        if not stats["queue_depth"] and not stats["in_flight"]:
+            break
+        await asyncio.sleep(0.05)
+    counts = report.get("counts", {})
+    handled = sum(n for status, n in counts.items() if status in HANDLED_OUTCOMES)
+    report.update({
+        "emails": handled,
+        "emails_per_sec": round(handled / seconds, 2) if seconds > 0 else None,
+        "failed": counts.get("failed", 0),
+        "skipped": counts.get("skipped", 0),
+        "seconds": round(seconds, 3),
+        "send_drain_seconds": round(time.perf_counter() - drain_start, 3),
+        "sent": len(service.mailbox.sent),
+        "send_queue": send_queue.stats(),
+        "semantic_cache": rag_api.response_cache.stats(),
+        "llm": get_llm_stats(),
+        "gmail": service.stats(),
+        "stages": stage_latencies(),
+    })
+    return report
+
+# --- Comparison ---
+HEADLINE_SUFFIXES = ("emails_per_sec", "queries_per_sec", "chunks_per_sec", "p50_ms", "p99_ms")
+
+def flatten(report: dict, prefix: str = "") -> dict:
+    flat = {}
+    for key, value in report.items():
+        path = f"{prefix}.{key}" if prefix else key
+        if isinstance(value, dict):
+            if key != "stages":
+                flat.update(flatten(value, path))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[path] = value
+    return flat
+
+def compare(old: dict, new: dict) -> list:
+    """Headline numbers (throughput and latency percentiles) of both runs, with the relative change."""
+    old_flat, new_flat = flatten(old), flatten(new)
+    rows = []
+    for path, value in new_flat.items():
+        if not path.endswith(HEADLINE_SUFFIXES) or path.startswith("meta.") or path not in old_flat:
+            continue
+        before = old_flat[path]
+        change = round((value - before) / before * 100, 1) if before else None
+        rows.append({"metric": path, "before": before, "after": value, "change_pct": change})
+    return rows
+
+# --- Main ---
+async def run(args) -> dict:
+    import httpx
+    import gmail
+    import metrics
+    from fake_gmail import FakeGmailService
+
+    random.seed(args.seed)  # the placeholder LLM backend validates at random
+    services = []
+
+    def service_factory():
+        service = FakeGmailService(latency=args.gmail_latency_ms / 1000, quota_error_rate=args.quota_error_rate,
+                                   seed=args.seed + len(services))
+        services.append(service)
+        return service
+
+    # One mailbox per phase; the Gmail helpers (and the send queue) always see the current one
+    gmail.get_gmail_service = lambda scopes=gmail.SCOPES: services[-1]
+    service_factory()
+
+    with open(args.policy, encoding="utf-8") as f:
+        questions = load_questions(f.read())
+    if not questions:
+        raise SystemExit(f"No numbered questions found in {args.policy}")
+
+    import rag_api
+    report = {"meta": {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": platform.python_version(),
+        "platform": platform.platform(), "cpus": os.cpu_count(), "workdir": os.getcwd(),
+        "args": {k: v for k, v in vars(args).items() if k not in ("output", "compare", "workdir")},
+    }}
+    transport = httpx.ASGITransport(app=rag_api.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as client:
+        for phase in args.phases:
+            metrics.reset()
+            log(f"⏱️ Phase {phase}...")
+            start = time.perf_counter()
+            with quiet(not args.verbose):
+                if phase == "index":
+                    report["index"] = await bench_index(client, args.policy, args.collection)
+                elif phase == "query":
+                    report["query"] = await bench_query(client, args.collection, questions, args.queries,
+                                                        args.query_concurrency, args.modes, args.seed)
+                elif phase == "main":
+                    report["main_workflow"] = bench_main(service_factory, args.main_emails, questions, args)
+                elif phase == "rag_api":
+                    report["rag_api_workflow"] = await bench_rag_api(client, service_factory, args.emails, questions, args)
+            log(f"   done in {time.perf_counter() - start:.1f}s")
+    return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline throughput baseline for indexing, querying and the email workflows")
+    parser.add_argument("--phases", nargs="+", choices=PHASES, default=list(PHASES))
+    parser.add_argument("--policy", default="airlines_policy.md", help="Document to index and take questions from")
+    parser.add_argument("--collection", default="airlines_policy")
+    parser.add_argument("--queries", type=int, default=200, help="/query requests per mode")
+    parser.add_argument("--query-concurrency", type=int, default=8)
+    parser.add_argument("--modes", nargs="+", choices=["dense", "keyword", "hybrid"], default=["dense", "hybrid", "keyword"])
+    parser.add_argument("--emails", type=int, default=100, help="Emails drained through rag_api's /process-inbox")
+    parser.add_argument("--concurrency", type=int, default=8, help="Concurrent rag_api workflows")
+    parser.add_argument("--main-emails", type=int, default=20, help="Emails run one by one through main.py's workflow")
+    parser.add_argument("--max-body-chars", type=int, default=4000, help="Upper bound of the synthetic email body size")
+    parser.add_argument("--max-nesting", type=int, default=3, help="Upper bound of extra multipart levels per email")
+    parser.add_argument("--gmail-latency-ms", type=float, default=0.0, help="Simulated Gmail round-trip time")
+    parser.add_argument("--quota-error-rate", type=float, default=0.0, help="Share of Gmail calls failing with 429")
+    parser.add_argument("--llm", choices=["mock", "placeholder"], default="mock",
+                        help="mock: in-process mock_llm_server over HTTP; placeholder: no LLM round trips at all")
+    parser.add_argument("--llm-latency-ms", type=float, default=50.0)
+    parser.add_argument("--llm-fail-rate", type=float, default=0.2, help="Share of mock drafts that fail validation")
+    parser.add_argument("--send-timeout", type=float, default=60.0, help="Seconds to wait for the send queue to empty")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workdir", help="Where Chroma, the ledger and the caches are created (default: a new temp dir)")
+    parser.add_argument("--output", help="Write the JSON report here as well")
+    parser.add_argument("--compare", help="Earlier JSON report to compare the headline numbers with")
+    parser.add_argument("--verbose", action="store_true", help="Keep the workflows' own output")
+    args = parser.parse_args()
+
+    args.policy = os.path.abspath(args.policy)
+    output = os.path.abspath(args.output) if args.output else None
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    # The stores use paths relative to the working directory, so a fresh one isolates the run
+    workdir = args.workdir or tempfile.mkdtemp(prefix="email-agent-bench-")
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)
+    os.environ["POLICY_COLLECTION"] = args.collection
+    os.environ["MESSAGE_LEDGER_DB"] = os.path.join(workdir, "message_ledger.sqlite3")
+    os.environ["KEYWORD_INDEX_DB"] = os.path.join(workdir, "keyword_index.sqlite3")
+
+    server = None
+    if args.llm == "mock":
+        import llm_client
+        from mock_llm_server import serve
+
+        server = serve(port=0, latency_ms=args.llm_latency_ms, fail_rate=args.llm_fail_rate)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        host, port = server.server_address[:2]
+        llm_client.set_backend(llm_client.OpenAICompatibleBackend(base_url=f"http://{host}:{port}/v1", api_key="benchmark"))
+    else:
+        os.environ["LLM_BACKEND"] = "placeholder"
+
+    try:
+        report = asyncio.run(run(args))
+    finally:
+        if server is not None:
+            server.shutdown()
+
+    if baseline is not None:
+        report["comparison"] = compare(baseline, report)
+        for row in report["comparison"]:
+            change = "n/a" if row["change_pct"] is None else f"{row['change_pct']:+.1f}%"
+            log(f"   {row['metric']}: {row['before']} -> {row['after']} ({change})")
+    text = json.dumps(report, indent=2)
+    if output:
+        with open(output, "w", encoding="utf-8") as f:
+            f.write(text)
+        log(f"📊 Report written to {output}")
+    print(text)
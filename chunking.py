@@ -0,0 +1,167 @@
+# chunking.py
+# Structure-aware, token-aware chunker shared by minimal_rag_chroma.py and rag_api.py.
+#
+# Markdown headings and numbered Q&A items ("1. Can I ...?") are kept together; small items in
+# the same section are packed into one chunk up to a token budget, and only text that is larger
+# than the budget is split (at sentence boundaries, with overlap).
+import re
+from typing import Iterable, Iterator, List, Optional
+
+# all-MiniLM-L6-v2 truncates its input at 256 word pieces, so anything beyond that is never embedded
+CHUNK_TOKENS = 200
+CHUNK_OVERLAP = 30
+# A section without headings or numbered items is cut into blocks of about this size, so streaming
+# a huge unstructured document never holds more than one block in memory
+MAX_BLOCK_CHARS = 50_000
+
+_HEADING_RE = re.compile(r"^(#{1,6})\s+(.+?)\s*#*\s*$")
+_QA_RE = re.compile(r"^(\d{1,3})\.\s+\S")
+_SENTENCE_RE = re.compile(r"(?<=[.!?])\s+|\n+")
+_WORDISH_RE = re.compile(r"\w+|[^\w\s]")
+
+_encoding = None
+_encoding_loaded = False
+
+def _get_encoding():
+    # tiktoken is optional (see requirements.txt) and may need to download its BPE file on first use
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        _encoding_loaded = True
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            _encoding = None
+    return _encoding
+
+def count_tokens(text: str) -> int:
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    # Rough fallback: words and punctuation marks are about one token each
+    return len(_WORDISH_RE.findall(text))
+
+# --- Structure parsing ---
+def _iter_blocks(lines: Iterable[str], max_block_chars: int = MAX_BLOCK_CHARS) -> Iterator[dict]:
+    """Splits lines into blocks at headings and at the start of numbered Q&A items."""
+    headings = []
+    current = {"headings": [], "qa_number": None, "lines": [], "chars": 0}
+
+    def close() -> Optional[dict]:
+        body = "\n".join(current["lines"]).strip()
+        if body:
+            return {"headings": current["headings"], "qa_number": current["qa_number"], "text": body}
+        return None
+
+    for line in lines:
+        heading = _HEADING_RE.match(line)
+        if heading:
+            block = close()
+            if block:
+                yield block
+            level = len(heading.group(1))
+            headings = [h for h in headings if h[0] < level] + [(level, heading.group(2))]
+            current = {"headings": [h[1] for h in headings], "qa_number": None, "lines": [], "chars": 0}
+            continue
+        qa = _QA_RE.match(line)
+        if qa or current["chars"] > max_block_chars:
+            block = close()
+            if block:
+                yield block
+            current = {"headings": current["headings"], "qa_number": int(qa.group(1)) if qa else current["qa_number"],
+                       "lines": [], "chars": 0}
+        current["lines"].append(line)
+        current["chars"] += len(line) + 1
+    block = close()
+    if block:
+        yield block
+
+def _split_long(text: str, max_tokens: int, overlap_tokens: int) -> List[str]:
+    """Packs sentences into pieces of at most max_tokens, repeating ~overlap_tokens between pieces."""
+    sentences = []
+    for sentence in _SENTENCE_RE.split(text):
+        sentence = sentence.strip()
+        if not sentence:
+            continue
+        tokens = count_tokens(sentence)
+        if tokens <= max_tokens:
+            sentences.append((sentence, tokens))
+            continue
+        # A single run-on "sentence" over budget: fall back to word windows
+        words = sentence.split()
+        step = max(1, len(words) * max_tokens // tokens)
+        for start in range(0, len(words), step):
+            piece = " ".join(words[start:start + step])
+            sentences.append((piece, count_tokens(piece)))
+
+    pieces, current, current_tokens = [], [], 0
+    for sentence, tokens in sentences:
+        if current and current_tokens + tokens > max_tokens:
+            pieces.append(" ".join(s for s, _ in current))
+            # Carry the tail of the previous piece over as overlap
+            carried, carried_tokens = [], 0
+            for s, t in reversed(current):
+                if carried_tokens + t > overlap_tokens:
+                    break
+                carried.insert(0, (s, t))
+                carried_tokens += t
+            current, current_tokens = carried, carried_tokens
+        current.append((sentence, tokens))
+        current_tokens += tokens
+    if current:
+        pieces.append(" ".join(s for s, _ in current))
+    return pieces
+
+# --- Public API ---
+def iter_chunks(lines: Iterable[str], max_tokens: int = CHUNK_TOKENS, overlap_tokens: int = CHUNK_OVERLAP) -> Iterator[dict]:
+    """Yields {"text": ..., "metadata": {...}} chunks from a stream of lines.
+
+    Metadata holds the top-level `section`, the full `heading_path` and, for Q&A content, the
+    `qa_start`/`qa_end` item numbers covered by the chunk. Keys without a value are left out,
+    because Chroma does not accept None metadata values. Only the current block is held in
+    memory, so the input can be a generator over an arbitrarily large file.
+    """
+    pending: Optional[dict] = None
+
+    def make(chunk: dict) -> dict:
+        metadata = {}
+        if chunk["headings"]:
+            metadata["section"] = chunk["headings"][0]
+            metadata["heading_path"] = " > ".join(chunk["headings"])
+        if chunk["qa"]:
+            metadata["qa_start"], metadata["qa_end"] = min(chunk["qa"]), max(chunk["qa"])
+        prefix = f"{metadata['heading_path']}\n" if chunk["headings"] else ""
+        return {"text": prefix + "\n".join(chunk["parts"]), "metadata": metadata}
+
+    for block in _iter_blocks(lines):
+        prefix_tokens = count_tokens(" > ".join(block["headings"])) if block["headings"] else 0
+        budget = max(16, max_tokens - prefix_tokens)
+        qa = [block["qa_number"]] if block["qa_number"] is not None else []
+        tokens = count_tokens(block["text"])
+
+        if tokens > budget:
+            if pending:
+                yield make(pending)
+                pending = None
+            for piece in _split_long(block["text"], budget, overlap_tokens):
+                yield make({"headings": block["headings"], "qa": qa, "parts": [piece]})
+            continue
+
+        # Pack small blocks of the same section together
+        if pending and (pending["headings"] != block["headings"] or pending["tokens"] + tokens > budget):
+            yield make(pending)
+            pending = None
+        if pending is None:
+            pending = {"headings": block["headings"], "qa": [], "parts": [], "tokens": 0}
+        pending["parts"].append(block["text"])
+        pending["qa"].extend(qa)
+        pending["tokens"] += tokens
+    if pending:
+        yield make(pending)
+
+def chunk_document(text: str, max_tokens: int = CHUNK_TOKENS, overlap_tokens: int = CHUNK_OVERLAP) -> List[dict]:
+    """Returns [{"text": ..., "metadata": {...}}] chunks of a whole document (see iter_chunks)."""
+    return list(iter_chunks(text.splitlines(), max_tokens, overlap_tokens))
+
+def chunk_text(text: str, max_tokens: int = CHUNK_TOKENS, overlap_tokens: int = CHUNK_OVERLAP) -> List[str]:
+    return [chunk["text"] for chunk in chunk_document(text, max_tokens, overlap_tokens)]
@@ -0,0 +1,97 @@
+# document_loader.py
+# File loading shared by the CLI and the API. Kept free of model/Chroma imports so it is cheap
+# to import in process-pool workers.
+import os
+import time
+from typing import Iterator, List, Optional
+
+from chunking import MAX_BLOCK_CHARS
+
+SUPPORTED_EXTENSIONS = (".pdf", ".md", ".txt")
+
+def iter_file_text(file_path: str) -> Iterator[str]:
+    """Yields a document's text piece by piece: one page at a time for PDFs, the whole file otherwise."""
+    ext = os.path.splitext(file_path)[1].lower()
+
+    if ext == ".pdf":
+        import fitz  # PyMuPDF
+        with fitz.open(file_path) as doc:
+            for page in doc:
+                yield page.get_text()
+
+    elif ext in [".md", ".txt"]:
+        with open(file_path, "r", encoding="utf-8") as f:
+            yield f.read()
+
+    else:
+        raise ValueError(f"Unsupported file type: {ext}")
+
+def iter_text_lines(text: str) -> Iterator[str]:
+    """The lines of an extracted page, each at most MAX_BLOCK_CHARS long."""
+    for line in text.splitlines():
+        for start in range(0, max(len(line), 1), MAX_BLOCK_CHARS):
+            yield line[start:start + MAX_BLOCK_CHARS]
+
+def iter_file_lines(file_path: str) -> Iterator[str]:
+    """Yields a document's lines (without line endings) while reading it: a PDF one page at a time,
+    a text file one line at a time. Lines longer than MAX_BLOCK_CHARS come out in pieces of that size,
+    so a file without newlines is not read in one go; a PDF still holds one page's text at a time."""
+    ext = os.path.splitext(file_path)[1].lower()
+
+    if ext == ".pdf":
+        for page_text in iter_file_text(file_path):
+            yield from iter_text_lines(page_text)
+
+    elif ext in [".md", ".txt"]:
+        with open(file_path, "r", encoding="utf-8") as f:
+            while True:
+                # Capped read: a huge line arrives in several pieces instead of all at once
+                line = f.readline(MAX_BLOCK_CHARS)
+                if not line:
+                    break
+                yield line.rstrip("\r\n")
+
+    else:
+        raise ValueError(f"Unsupported file type: {ext}")
+
+def file_to_text(file_path: str) -> str:
+    # Join once at the end instead of growing a string page by page
+    return "\n".join(iter_file_text(file_path))
+
+def find_documents(root: str) -> List[str]:
+    """All supported files below root, in a stable order."""
+    paths = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for name in sorted(filenames):
+            if os.path.splitext(name)[1].lower() in SUPPORTED_EXTENSIONS:
+                paths.append(os.path.join(dirpath, name))
+    return paths
+
+def source_name(file_path: str, root: Optional[str] = None) -> str:
+    """Collection-wide source key of a file: its path relative to the documents root (default: the
+    current directory), with forward slashes. --index, --index-dir and the watcher run from the same
+    root give a file the same key; /index uses its uploads folder as the root, so a document indexed
+    from the repo folder gets the same key either way. Keys never expose absolute local paths."""
+    path = os.path.abspath(file_path)
+    try:
+        relative = os.path.relpath(path, os.path.abspath(root or os.getcwd()))
+    except ValueError:  # another drive on Windows
+        relative = os.path.basename(path)
+    return relative.replace(os.sep, "/")
+
+# --- Process-pool extraction (--index-dir) ---
+PDF_PAGES_PER_TASK = 16
+
+def pdf_page_count(file_path: str) -> int:
+    import fitz  # PyMuPDF
+    with fitz.open(file_path) as doc:
+        return doc.page_count
+
+def extract_pages(file_path: str, start: int = 0, end: Optional[int] = None):
+    """Process-pool task: (texts of PDF pages start..end-1, seconds). end=None reads to the last page."""
+    import fitz  # PyMuPDF
+    began = time.perf_counter()
+    with fitz.open(file_path) as doc:
+        texts = [doc[i].get_text() for i in range(start, doc.page_count if end is None else end)]
+    return texts, time.perf_counter() - began
@@ -0,0 +1,60 @@
+# embedding_backends.py
+# CPU inference backends for the sentence-transformers embedding model, selected with
+# EMBEDDING_BACKEND (and EMBEDDING_THREADS for the thread count):
+#   torch       full-precision PyTorch (default)
+#   torch-int8  PyTorch with dynamic int8 quantization of the Linear layers, no extra dependencies
+#   onnx        ONNX Runtime, fp32 (pip install "sentence-transformers[onnx]")
+#   onnx-int8   ONNX Runtime with the model's pre-quantized int8 export (EMBEDDING_ONNX_FILE)
+# Every backend must produce vectors of the collection's dimensionality; run bench_embeddings.py
+# to compare speed and top-k recall before switching.
+import os
+from typing import Optional
+
+EMBEDDING_DIM = 384  # all-MiniLM-L6-v2, and every vector already stored in Chroma
+BACKENDS = ("torch", "torch-int8", "onnx", "onnx-int8")
+DEFAULT_ONNX_INT8_FILE = "onnx/model_quint8_avx2.onnx"
+
+def configured_backend() -> str:
+    backend = os.getenv("EMBEDDING_BACKEND", "torch").lower()
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown EMBEDDING_BACKEND {backend!r}, expected one of {', '.join(BACKENDS)}")
+    return backend
+
+def configured_threads() -> Optional[int]:
+    threads = os.getenv("EMBEDDING_THREADS")
+    return int(threads) if threads else None
+
+def cache_model_key(model_name: str, backend: str) -> str:
+    """Embedding-cache namespace: fp32 backends agree to ~1e-6 and share vectors, int8 ones get their own."""
+    return model_name if backend in ("torch", "onnx") else f"{model_name}@{backend}"
+
+def load_embedder(model_name: str, backend: str = "torch", threads: Optional[int] = None,
+                  expected_dim: Optional[int] = EMBEDDING_DIM):
+    from sentence_transformers import SentenceTransformer
+
+    if backend in ("torch", "torch-int8"):
+        import torch
+        if threads:
+            torch.set_num_threads(threads)
+        model = SentenceTransformer(model_name, device="cpu")
+        if backend == "torch-int8":
+            model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    elif backend in ("onnx", "onnx-int8"):
+        import onnxruntime
+        options = onnxruntime.SessionOptions()
+        if threads:
+            options.intra_op_num_threads = threads
+            options.inter_op_num_threads = 1
+        model_kwargs = {"provider": "CPUExecutionProvider", "session_options": options}
+        if backend == "onnx-int8":
+            model_kwargs["file_name"] = os.getenv("EMBEDDING_ONNX_FILE", DEFAULT_ONNX_INT8_FILE)
+        model = SentenceTransformer(model_name, device="cpu", backend="onnx", model_kwargs=model_kwargs)
+    else:
+        raise ValueError(f"Unknown embedding backend {backend!r}, expected one of {', '.join(BACKENDS)}")
+
+    # Renamed to get_embedding_dimension() in newer sentence-transformers releases
+    get_dim = getattr(model, "get_embedding_dimension", None) or model.get_sentence_embedding_dimension
+    dim = get_dim()
+    if expected_dim is not None and dim != expected_dim:
+        raise ValueError(f"{model_name} ({backend}) produces {dim}-dim vectors, but the collections hold {expected_dim}-dim ones")
+    return model
@@ -0,0 +1,74 @@
+# embedding_cache.py
+# Persistent embedding cache keyed by (model, content hash), so unchanged text is never re-embedded.
+import hashlib
+import sqlite3
+import threading
+from array import array
+from typing import Dict, List
+
+import numpy as np
+
+EMBEDDING_CACHE_DB = "embedding_cache.sqlite3"
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+class EmbeddingCache:
+    def __init__(self, path: str = EMBEDDING_CACHE_DB):
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS embeddings (
+                    model TEXT NOT NULL,
+                    hash TEXT NOT NULL,
+                    vector BLOB NOT NULL,
+                    PRIMARY KEY (model, hash)
+                ) WITHOUT ROWID"""
+            )
+
+    def get_many(self, model: str, hashes: List[str]) -> Dict[str, list]:
+        found = {}
+        # Stay well below SQLite's bound-parameter limit
+        for start in range(0, len(hashes), 500):
+            part = hashes[start:start + 500]
+            placeholders = ",".join("?" * len(part))
+            with self._lock:
+                rows = self._conn.execute(
+                    f"SELECT hash, vector FROM embeddings WHERE model = ? AND hash IN ({placeholders})", [model, *part]
+                ).fetchall()
+            for h, blob in rows:
+                found[h] = array("f", blob).tolist()
+        return found
+
+    def put_many(self, model: str, vectors: Dict[str, list]):
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, hash, vector) VALUES (?, ?, ?)",
+                [(model, h, array("f", vector).tobytes()) for h, vector in vectors.items()],
+            )
+
+class CachedEmbedder:
+    """Wraps a SentenceTransformer-like embedder; encode() only runs the model on cache misses."""
+
+    def __init__(self, embedder, model_name: str, cache: EmbeddingCache):
+        self.embedder = embedder
+        self.model_name = model_name
+        self.cache = cache
+        self.hits = 0
+        self.misses = 0
+
+    def encode(self, texts: List[str], batch_size: int = 32, **kwargs) -> np.ndarray:
+        hashes = [content_hash(t) for t in texts]
+        cached = self.cache.get_many(self.model_name, list(set(hashes)))
+        missing = {h: t for h, t in zip(hashes, texts) if h not in cached}
+        if missing:
+            vectors = self.embedder.encode(list(missing.values()), batch_size=batch_size, **kwargs).tolist()
+            fresh = dict(zip(missing.keys(), vectors))
+            self.cache.put_many(self.model_name, fresh)
+            cached.update(fresh)
+        self.misses += len(missing)
+        self.hits += len(texts) - len(missing)
+        return np.asarray([cached[h] for h in hashes], dtype=np.float32)
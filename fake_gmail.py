@@ -0,0 +1,316 @@
+# fake_gmail.py
+# In-memory stand-in for the googleapiclient Gmail service, so the sync engine and the
+# agent workflows can be exercised offline without a Google account. Optional per-call latency
+# and quota errors, plus a synthetic MIME message generator, make it usable for benchmarks too.
+import base64
+import itertools
+import json
+import random
+import threading
+import time
+from typing import List, Optional, Sequence
+
+import httplib2
+from googleapiclient.errors import HttpError
+
+def _http_error(status: int, message: str, reason: Optional[str] = None) -> HttpError:
+    error = {"code": status, "message": message}
+    if reason:
+        error["errors"] = [{"reason": reason, "message": message}]
+    return HttpError(httplib2.Response({"status": status}), json.dumps({"error": error}).encode())
+
+class _Faults:
+    """Simulated network round-trip time and per-user rate limiting."""
+
+    def __init__(self, latency: float = 0.0, quota_error_rate: float = 0.0, seed: Optional[int] = None):
+        self.latency = latency
+        self.quota_error_rate = quota_error_rate
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.counts = {"round_trips": 0, "calls": 0, "quota_errors": 0}
+
+    def round_trip(self):
+        with self._lock:
+            self.counts["round_trips"] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def check_quota(self):
+        with self._lock:
+            self.counts["calls"] += 1
+            throttled = self.quota_error_rate and self._rng.random() < self.quota_error_rate
+            if throttled:
+                self.counts["quota_errors"] += 1
+        if throttled:
+            raise _http_error(429, "User-rate limit exceeded.", "rateLimitExceeded")
+
+class _Request:
+    """Mimics googleapiclient's HttpRequest: nothing happens until execute()."""
+
+    def __init__(self, fn, faults: Optional[_Faults] = None):
+        self._fn = fn
+        self._faults = faults
+
+    def _run(self):
+        if self._faults is not None:
+            self._faults.check_quota()
+        return self._fn()
+
+    def execute(self, num_retries: int = 0):
+        if self._faults is not None:
+            self._faults.round_trip()
+        return self._run()
+
+class _Batch:
+    def __init__(self, callback=None, faults: Optional[_Faults] = None):
+        self._callback = callback
+        self._faults = faults
+        self._requests = []
+
+    def add(self, request, callback=None, request_id=None):
+        self._requests.append((request, callback or self._callback, request_id or str(len(self._requests))))
+
+    def execute(self):
+        # One HTTP round trip for the whole batch; each inner call can still be throttled on its own
+        if self._faults is not None:
+            self._faults.round_trip()
+        for request, callback, request_id in self._requests:
+            try:
+                response, exception = request._run(), None
+            except HttpError as e:
+                response, exception = None, e
+            if callback:
+                callback(request_id, response, exception)
+
+class FakeMailbox:
+    def __init__(self, email_address: str = "agent@example.com"):
+        self.email_address = email_address
+        self.messages = {}
+        self.history = []          # [(history_id, record)]
+        self.sent = []
+        self._history_id = 1000
+        self._min_history_id = 1000
+        self._ids = itertools.count(1)
+
+    def _next_history_id(self) -> int:
+        self._history_id += 1
+        return self._history_id
+
+    def add_message(self, subject: str = "Hello", sender: str = "customer@example.com", body: str = "",
+                    labels=("INBOX", "UNREAD"), payload: Optional[dict] = None) -> str:
+        """Delivers a message. Pass a ready-made MIME payload to test nested structures."""
+        msg_id = f"{next(self._ids):016x}"
+        if payload is None:
+            payload = {
+                "mimeType": "text/plain",
+                "headers": [{"name": "Subject", "value": subject}, {"name": "From", "value": sender}],
+                "body": {"data": base64.urlsafe_b64encode(body.encode()).decode(), "size": len(body)},
+            }
+        history_id = self._next_history_id()
+        self.messages[msg_id] = {
+            "id": msg_id, "threadId": msg_id, "labelIds": list(labels),
+            "historyId": str(history_id), "payload": payload,
+        }
+        self.history.append((history_id, {
+            "id": str(history_id),
+            "messagesAdded": [{"message": {"id": msg_id, "threadId": msg_id, "labelIds": list(labels)}}],
+        }))
+        return msg_id
+
+    def expire_history(self):
+        """Drops all history records, like Gmail does after about a week."""
+        self._min_history_id = self._history_id
+        self.history = []
+
+    def modify(self, msg_id: str, body: dict):
+        if msg_id not in self.messages:
+            raise _http_error(404, "Requested entity was not found.")
+        labels = self.messages[msg_id]["labelIds"]
+        removed = [label for label in body.get("removeLabelIds", []) if label in labels]
+        added = [label for label in body.get("addLabelIds", []) if label not in labels]
+        for label in removed:
+            labels.remove(label)
+        labels.extend(added)
+        history_id = self._next_history_id()
+        self.messages[msg_id]["historyId"] = str(history_id)
+        record = {"id": str(history_id)}
+        message = {"id": msg_id, "threadId": msg_id, "labelIds": list(labels)}
+        if removed:
+            record["labelsRemoved"] = [{"message": message, "labelIds": removed}]
+        if added:
+            record["labelsAdded"] = [{"message": message, "labelIds": added}]
+        if removed or added:
+            self.history.append((history_id, record))
+        return {"id": msg_id, "labelIds": list(labels)}
+
+    def unread_ids(self) -> List[str]:
+        # Gmail lists newest first
+        return [m for m, msg in reversed(self.messages.items()) if "UNREAD" in msg["labelIds"]]
+
+class _Messages:
+    def __init__(self, mailbox: FakeMailbox, faults: Optional[_Faults] = None):
+        self.mailbox = mailbox
+        self.faults = faults
+
+    def list(self, userId="me", maxResults=100, labelIds=None, q=None, pageToken=None, **kwargs):
+        def run():
+            ids = [m for m, msg in reversed(self.mailbox.messages.items())
+                   if all(label in msg["labelIds"] for label in (labelIds or []))
+                   and (q != "is:unread" or "UNREAD" in msg["labelIds"])]
+            start = int(pageToken or 0)
+            page = ids[start:start + maxResults]
+            result = {"messages": [{"id": m, "threadId": m} for m in page], "resultSizeEstimate": len(ids)}
+            if start + maxResults < len(ids):
+                result["nextPageToken"] = str(start + maxResults)
+            return result if page else {"resultSizeEstimate": 0}
+        return _Request(run, self.faults)
+
+    def get(self, userId="me", id=None, format="full", **kwargs):
+        def run():
+            if id not in self.mailbox.messages:
+                raise _http_error(404, "Requested entity was not found.")
+            return json.loads(json.dumps(self.mailbox.messages[id]))
+        return _Request(run, self.faults)
+
+    def modify(self, userId="me", id=None, body=None):
+        return _Request(lambda: self.mailbox.modify(id, body or {}), self.faults)
+
+    def batchModify(self, userId="me", body=None):
+        def run():
+            for msg_id in body.get("ids", []):
+                self.mailbox.modify(msg_id, body)
+            return {}
+        return _Request(run, self.faults)
+
+    def send(self, userId="me", body=None):
+        def run():
+            self.mailbox.sent.append(body)
+            return {"id": f"sent{len(self.mailbox.sent)}", "labelIds": ["SENT"]}
+        return _Request(run, self.faults)
+
+_HISTORY_KEYS = {"messageAdded": "messagesAdded", "messageDeleted": "messagesDeleted",
+                 "labelAdded": "labelsAdded", "labelRemoved": "labelsRemoved"}
+
+class _History:
+    def __init__(self, mailbox: FakeMailbox, faults: Optional[_Faults] = None):
+        self.mailbox = mailbox
+        self.faults = faults
+
+    def list(self, userId="me", startHistoryId=None, historyTypes=None, labelId=None,
+             maxResults=100, pageToken=None, **kwargs):
+        def run():
+            start_id = int(startHistoryId)
+            if start_id < self.mailbox._min_history_id:
+                raise _http_error(404, "Requested entity was not found.")
+            records = [r for h, r in self.mailbox.history if h > start_id]
+            if historyTypes:
+                keys = {_HISTORY_KEYS[t] for t in historyTypes}
+                records = [{k: v for k, v in r.items() if k == "id" or k in keys} for r in records]
+                records = [r for r in records if len(r) > 1]
+            if labelId:
+                # A message that just lost the label still counts, like the UNREAD/INBOX removals Gmail reports
+                records = [r for r in records
+                           if any(labelId in change["message"]["labelIds"] or labelId in change.get("labelIds", [])
+                                  for key, changes in r.items() if key != "id" for change in changes)]
+            offset = int(pageToken or 0)
+            result = {"history": records[offset:offset + maxResults], "historyId": str(self.mailbox._history_id)}
+            if offset + maxResults < len(records):
+                result["nextPageToken"] = str(offset + maxResults)
+            return result
+        return _Request(run, self.faults)
+
+class _Users:
+    def __init__(self, mailbox: FakeMailbox, faults: Optional[_Faults] = None):
+        self.mailbox = mailbox
+        self.faults = faults
+
+    def messages(self):
+        return _Messages(self.mailbox, self.faults)
+
+    def history(self):
+        return _History(self.mailbox, self.faults)
+
+    def getProfile(self, userId="me"):
+        return _Request(lambda: {
+            "emailAddress": self.mailbox.email_address,
+            "messagesTotal": len(self.mailbox.messages),
+            "historyId": str(self.mailbox._history_id),
+        }, self.faults)
+
+class FakeGmailService:
+    """Drop-in for build("gmail", "v1", ...) backed by a FakeMailbox.
+
+    latency is added once per HTTP round trip (a batch counts as one), and each API call fails
+    with a 429 rateLimitExceeded error with probability quota_error_rate.
+    """
+
+    def __init__(self, mailbox: Optional[FakeMailbox] = None, latency: float = 0.0,
+                 quota_error_rate: float = 0.0, seed: Optional[int] = None):
+        self.mailbox = mailbox or FakeMailbox()
+        self.faults = _Faults(latency, quota_error_rate, seed)
+
+    def users(self):
+        return _Users(self.mailbox, self.faults)
+
+    def new_batch_http_request(self, callback=None):
+        return _Batch(callback, self.faults)
+
+    def stats(self) -> dict:
+        return dict(self.faults.counts)
+
+# --- Synthetic messages ---
+_FILLER_WORDS = ("booking", "flight", "ticket", "please", "thanks", "regarding", "yesterday", "reference",
+                 "confirmation", "luggage", "seat", "refund", "travel", "airport", "connection", "help",
+                 "would", "like", "could", "you", "the", "my", "and", "for", "about", "with", "when")
+
+def _b64(text: str) -> str:
+    return base64.urlsafe_b64encode(text.encode()).decode()
+
+def _leaf(mime_type: str, text: str) -> dict:
+    return {"mimeType": mime_type, "headers": [{"name": "Content-Type", "value": f'{mime_type}; charset="utf-8"'}],
+            "body": {"data": _b64(text), "size": len(text)}}
+
+def synthetic_payload(subject: str, sender: str, body: str, html: bool = False,
+                      nesting: int = 0, attachments: int = 0) -> dict:
+    """A Gmail API payload around body: optional HTML alternative, `nesting` extra multipart/mixed
+    levels and `attachments` attachment parts (referenced by attachmentId, like Gmail does)."""
+    if html:
+        html_body = "<html><body>" + "".join(f"<p>{line}</p>" for line in body.split("\n") if line) + "</body></html>"
+        part = {"mimeType": "multipart/alternative", "parts": [_leaf("text/plain", body), _leaf("text/html", html_body)]}
+    else:
+        part = _leaf("text/plain", body)
+    for _ in range(nesting):
+        part = {"mimeType": "multipart/mixed", "parts": [part]}
+    if attachments:
+        if part["mimeType"] != "multipart/mixed":
+            part = {"mimeType": "multipart/mixed", "parts": [part]}
+        part["parts"].extend({
+            "mimeType": "application/pdf", "filename": f"attachment-{i + 1}.pdf",
+            "headers": [{"name": "Content-Disposition", "value": f'attachment; filename="attachment-{i + 1}.pdf"'}],
+            "body": {"attachmentId": f"att{i + 1}", "size": 250_000},
+        } for i in range(attachments))
+    part["headers"] = part.get("headers", []) + [{"name": "Subject", "value": subject}, {"name": "From", "value": sender}]
+    return part
+
+def populate_mailbox(mailbox: FakeMailbox, count: int, questions: Sequence[str], seed: int = 0,
+                     max_body_chars: int = 4000, max_nesting: int = 3) -> List[str]:
+    """Delivers count synthetic customer emails, each asking one of `questions`.
+
+    Body size (the question plus filler text and a quoted earlier message), HTML vs plain text,
+    MIME nesting depth and attachments vary per message. Returns the message IDs.
+    """
+    rng = random.Random(seed)
+    ids = []
+    for i in range(count):
+        question = rng.choice(questions)
+        name = f"Customer{i}"
+        filler = " ".join(rng.choice(_FILLER_WORDS) for _ in range(rng.randint(0, max(0, max_body_chars) // 6)))
+        body = f"Hello,\n\n{question}\n\n{filler}\n\nThanks, {name}"
+        if rng.random() < 0.3:
+            body += "\n\nOn Monday, support wrote:\n" + "\n".join("> " + line for line in filler[:500].split(". "))
+        payload = synthetic_payload(
+            subject=question[:60], sender=f"{name} <customer{i}@example.com>", body=body,
+            html=rng.random() < 0.5, nesting=rng.randint(0, max_nesting), attachments=rng.choice((0, 0, 0, 1, 2)),
+        )
+        ids.append(mailbox.add_message(payload=payload))
+    return ids
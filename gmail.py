@@ -1,148 +1,266 @@
-# main.py
-import os
-import base64
-import re
-from typing import TypedDict, Optional
-from bs4 import BeautifulSoup
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
-from langgraph.graph import StateGraph
-
-# ---------------- Gmail Helper Functions ----------------
-
-import os
-
-BASE_DIR = r"C:\Users\kiran.yabaji\Desktop\Chroma"  # folder where credentials.json is
-CLIENT_SECRET_FILE = os.path.join(BASE_DIR, "credentials.json")
-TOKEN_FILE = os.path.join(BASE_DIR, "token.json")
-
-SCOPES = ["https://www.googleapis.com/auth/gmail.modify"]  # readonly + send
-
-def authenticate_gmail():
-    creds = None
-    if os.path.exists(TOKEN_FILE):
-        creds = Credentials.from_authorized_user_file(TOKEN_FILE, SCOPES)
-    if not creds or not creds.valid:
-        flow = InstalledAppFlow.from_client_secrets_file(CLIENT_SECRET_FILE, SCOPES)
-        creds = flow.run_local_server(port=8080)
-        with open(TOKEN_FILE, "w") as token_file:
-            token_file.write(creds.to_json())
-    return creds
-
-def get_gmail_service():
-    creds = authenticate_gmail()
-    return build("gmail", "v1", credentials=creds)
-
-def clean_body(raw_body: str) -> str:
-    if not raw_body:
-        return ""
-    if "<html" in raw_body.lower():
-        soup = BeautifulSoup(raw_body, "html.parser")
-        text = soup.get_text()
-        text = re.sub(r"\n\s*\n", "\n\n", text)
-        return text.strip()
-    return raw_body.strip()
-
-def fetch_latest_email():
-    service = get_gmail_service()
-    results = service.users().messages().list(userId="me", maxResults=1, labelIds=["INBOX"], q="is:unread").execute()
-    messages = results.get("messages", [])
-    if not messages:
-        return None
-
-    msg_data = service.users().messages().get(userId="me", id=messages[0]["id"]).execute()
-    headers = msg_data["payload"].get("headers", [])
-    subject = next((h["value"] for h in headers if h["name"] == "Subject"), "")
-    sender = next((h["value"] for h in headers if h["name"] == "From"), "")
-
-    # Extract body
-    body = ""
-    if "data" in msg_data["payload"]["body"]:
-        body = base64.urlsafe_b64decode(msg_data["payload"]["body"]["data"]).decode("utf-8", errors="ignore")
-    else:
-        for part in msg_data["payload"].get("parts", []):
-            if part["mimeType"] in ["text/plain", "text/html"]:
-                data = part["body"].get("data")
-                if data:
-                    body = base64.urlsafe_b64decode(data).decode("utf-8", errors="ignore")
-                    break
-
-    # Mark as read
-    service.users().messages().modify(userId="me", id=messages[0]["id"], body={"removeLabelIds": ["UNREAD"]}).execute()
-
-    return {"subject": subject, "from": sender, "body": clean_body(body)}
-
-def send_email(to: str, subject: str, body: str):
-    service = get_gmail_service()
-    from email.mime.text import MIMEText
-    import base64
-
-    message = MIMEText(body)
-    message["to"] = to
-    message["subject"] = subject
-    raw = base64.urlsafe_b64encode(message.as_bytes()).decode()
-    service.users().messages().send(userId="me", body={"raw": raw}).execute()
-
-
-# ---------------- LangGraph Workflow ----------------
-
-class EmailState(TypedDict):
-    email: Optional[dict]
-    draft: Optional[str]
-    validated: Optional[str]
-    rewritten: Optional[str]
-
-def retrieve_node(state: EmailState):
-    email = fetch_latest_email()
-    if not email:
-        print("📭 No new emails")
-        return state
-    print(f"📥 New email from {email['from']} with subject: {email['subject']}")
-    state["email"] = email
-    return state
-
-def draft_node(state: EmailState):
-    email = state.get("email")
-    if email:
-        state["draft"] = f"Hi, regarding '{email['subject']}', here is a draft reply..."
-    return state
-
-def validate_node(state: EmailState):
-    state["validated"] = state.get("draft")  # approve draft for now
-    return state
-
-def rewrite_node(state: EmailState):
-    draft = state.get("validated")
-    if draft:
-        state["rewritten"] = draft.replace("draft", "final")
-    return state
-
-def send_node(state: EmailState):
-    email = state.get("email")
-    reply = state.get("rewritten")
-    if email and reply:
-        send_email(email["from"], f"Re: {email['subject']}", reply)
-        print(f"📤 Email sent to: {email['from']}")
-    return state
-
-# Build workflow
-workflow = StateGraph(EmailState)
-workflow.add_node("Retrieve", retrieve_node)
-workflow.add_node("Draft", draft_node)
-workflow.add_node("Validate", validate_node)
-workflow.add_node("Rewrite", rewrite_node)
-workflow.add_node("Send", send_node)
-
-workflow.set_entry_point("Retrieve")
-workflow.add_edge("Retrieve", "Draft")
-workflow.add_edge("Draft", "Validate")
-workflow.add_edge("Validate", "Rewrite")
-workflow.add_edge("Rewrite", "Send")
-
-app = workflow.compile()
-
-# Run
-if __name__ == "__main__":
-    final_state = app.invoke({})
-    print("✅ Workflow done. Final state:", final_state)
+# main.py
+import os
+import base64
+import threading
+from typing import TypedDict, Optional, List
+from google.oauth2.credentials import Credentials
+from google_auth_oauthlib.flow import InstalledAppFlow
+from google.auth.transport.requests import Request
+from googleapiclient.discovery import build
+from googleapiclient.http import HttpRequest
+import google_auth_httplib2
+import httplib2
+from langgraph.graph import StateGraph
+from mime_utils import extract_body, html_to_text
+from metrics import GMAIL_SECONDS, GMAIL_ERRORS, timed_call
+
+# ---------------- Gmail Helper Functions ----------------
+
+import os
+
+BASE_DIR = r"C:\Users\kiran.yabaji\Desktop\Chroma"  # folder where credentials.json is
+CLIENT_SECRET_FILE = os.path.join(BASE_DIR, "credentials.json")
+TOKEN_FILE = os.path.join(BASE_DIR, "token.json")
+
+SCOPES = ["https://www.googleapis.com/auth/gmail.modify"]  # readonly + send
+
+# Process-wide Gmail service cache: one service per scope set, built lazily
+_service_lock = threading.Lock()
+_refresh_lock = threading.Lock()
+_services = {}
+_thread_local = threading.local()
+HTTP_TIMEOUT = 60
+SERVICE_STATS = {"builds": 0, "refreshes": 0, "token_reads": 0, "auth_flows": 0}
+
+def _save_token(creds):
+    with open(TOKEN_FILE, "w") as token_file:
+        token_file.write(creds.to_json())
+
+def authenticate_gmail(scopes=SCOPES):
+    creds = None
+    if os.path.exists(TOKEN_FILE):
+        creds = Credentials.from_authorized_user_file(TOKEN_FILE, scopes)
+        SERVICE_STATS["token_reads"] += 1
+    if creds and creds.expired and creds.refresh_token:
+        creds.refresh(Request())
+        SERVICE_STATS["refreshes"] += 1
+        _save_token(creds)
+    if not creds or not creds.valid:
+        flow = InstalledAppFlow.from_client_secrets_file(CLIENT_SECRET_FILE, scopes)
+        creds = flow.run_local_server(port=8080)
+        SERVICE_STATS["auth_flows"] += 1
+        _save_token(creds)
+    return creds
+
+def _ensure_fresh(creds):
+    """Refreshes an expired access token once, even when many threads notice it at the same time."""
+    if creds.valid:
+        return
+    with _refresh_lock:
+        if not creds.valid:
+            creds.refresh(Request())
+            SERVICE_STATS["refreshes"] += 1
+            _save_token(creds)
+
+def _authorized_http(creds):
+    # httplib2.Http is not thread-safe, so every thread keeps its own keep-alive connection pool
+    pool = getattr(_thread_local, "http", None)
+    if pool is None:
+        pool = _thread_local.http = {}
+    http = pool.get(id(creds))
+    if http is None:
+        http = pool[id(creds)] = google_auth_httplib2.AuthorizedHttp(creds, http=httplib2.Http(timeout=HTTP_TIMEOUT))
+    return http
+
+def get_gmail_service(scopes=SCOPES):
+    key = frozenset(scopes)
+    service = _services.get(key)
+    if service is not None:
+        return service
+    with _service_lock:
+        service = _services.get(key)
+        if service is None:
+            creds = authenticate_gmail(list(scopes))
+
+            def build_request(http, *args, **kwargs):
+                _ensure_fresh(creds)
+                return HttpRequest(_authorized_http(creds), *args, **kwargs)
+
+            service = build("gmail", "v1", http=_authorized_http(creds), requestBuilder=build_request, cache_discovery=False)
+            SERVICE_STATS["builds"] += 1
+            _services[key] = service
+    return service
+
+def reset_gmail_service():
+    """Drops cached services, e.g. after token.json was replaced."""
+    with _service_lock:
+        _services.clear()
+
+def get_service_stats() -> dict:
+    return {**SERVICE_STATS, "cached_services": len(_services)}
+
+def clean_body(raw_body: str) -> str:
+    if not raw_body:
+        return ""
+    if "<html" in raw_body.lower():
+        return html_to_text(raw_body)
+    return raw_body.strip()
+
+def parse_message(msg_data: dict) -> dict:
+    headers = msg_data["payload"].get("headers", [])
+    subject = next((h["value"] for h in headers if h["name"] == "Subject"), "")
+    sender = next((h["value"] for h in headers if h["name"] == "From"), "")
+
+    return {
+        "id": msg_data["id"],
+        "thread_id": msg_data.get("threadId"),
+        "subject": subject,
+        "from": sender,
+        "body": extract_body(msg_data["payload"]),
+    }
+
+@timed_call(GMAIL_SECONDS, GMAIL_ERRORS, op="fetch_latest")
+def fetch_latest_email(mark_read: bool = True):
+    service = get_gmail_service()
+    results = service.users().messages().list(userId="me", maxResults=1, labelIds=["INBOX"], q="is:unread").execute()
+    messages = results.get("messages", [])
+    if not messages:
+        return None
+
+    msg_data = service.users().messages().get(userId="me", id=messages[0]["id"]).execute()
+    email = parse_message(msg_data)
+
+    # Mark as read
+    if mark_read:
+        service.users().messages().modify(userId="me", id=messages[0]["id"], body={"removeLabelIds": ["UNREAD"]}).execute()
+
+    return email
+
+@timed_call(GMAIL_SECONDS, GMAIL_ERRORS, op="get")
+def fetch_email(message_id: str) -> dict:
+    service = get_gmail_service()
+    return parse_message(service.users().messages().get(userId="me", id=message_id).execute())
+
+# ---------------- Batch Helpers (inbox drain) ----------------
+
+# Gmail accepts up to 100 calls per batch, but recommends 50 to stay clear of rate limits.
+GMAIL_BATCH_SIZE = 50
+
+@timed_call(GMAIL_SECONDS, GMAIL_ERRORS, op="list_unread")
+def list_unread_message_ids(max_results: int = 100, page_token: Optional[str] = None):
+    """Lists one page of unread INBOX message IDs. Returns (ids, next_page_token)."""
+    service = get_gmail_service()
+    results = service.users().messages().list(
+        userId="me", maxResults=max_results, labelIds=["INBOX"], q="is:unread", pageToken=page_token
+    ).execute()
+    ids = [m["id"] for m in results.get("messages", [])]
+    return ids, results.get("nextPageToken")
+
+@timed_call(GMAIL_SECONDS, GMAIL_ERRORS, op="get_batch")
+def fetch_emails_batch(message_ids: List[str], batch_size: int = GMAIL_BATCH_SIZE):
+    """Fetches and parses many messages with Gmail batch requests.
+
+    Returns (emails, errors): emails in the order of message_ids, errors as {message_id: str}.
+    """
+    service = get_gmail_service()
+    fetched, errors = {}, {}
+
+    def on_response(request_id, response, exception):
+        if exception is not None:
+            errors[request_id] = str(exception)
+        else:
+            fetched[request_id] = parse_message(response)
+
+    for start in range(0, len(message_ids), batch_size):
+        batch = service.new_batch_http_request(callback=on_response)
+        for msg_id in message_ids[start:start + batch_size]:
+            batch.add(service.users().messages().get(userId="me", id=msg_id), request_id=msg_id)
+        batch.execute()
+
+    return [fetched[m] for m in message_ids if m in fetched], errors
+
+@timed_call(GMAIL_SECONDS, GMAIL_ERRORS, op="mark_read")
+def mark_as_read(message_ids: List[str]):
+    """Removes the UNREAD label from many messages in a single batchModify call per 1000 IDs."""
+    service = get_gmail_service()
+    for start in range(0, len(message_ids), 1000):
+        service.users().messages().batchModify(
+            userId="me", body={"ids": message_ids[start:start + 1000], "removeLabelIds": ["UNREAD"]}
+        ).execute()
+
+def build_send_body(to: str, subject: str, body: str) -> dict:
+    from email.mime.text import MIMEText
+
+    message = MIMEText(body)
+    message["to"] = to
+    message["subject"] = subject
+    raw = base64.urlsafe_b64encode(message.as_bytes()).decode()
+    return {"raw": raw}
+
+@timed_call(GMAIL_SECONDS, GMAIL_ERRORS, op="send")
+def send_email(to: str, subject: str, body: str):
+    service = get_gmail_service()
+    service.users().messages().send(userId="me", body=build_send_body(to, subject, body)).execute()
+
+
+# ---------------- LangGraph Workflow ----------------
+
+class EmailState(TypedDict):
+    email: Optional[dict]
+    draft: Optional[str]
+    validated: Optional[str]
+    rewritten: Optional[str]
+
+def retrieve_node(state: EmailState):
+    email = fetch_latest_email()
+    if not email:
+        print("📭 No new emails")
+        return state
+    print(f"📥 New email from {email['from']} with subject: {email['subject']}")
+    state["email"] = email
+    return state
+
+def draft_node(state: EmailState):
+    email = state.get("email")
+    if email:
+        state["draft"] = f"Hi, regarding '{email['subject']}', here is a draft reply..."
+    return state
+
+def validate_node(state: EmailState):
+    state["validated"] = state.get("draft")  # approve draft for now
+    return state
+
+def rewrite_node(state: EmailState):
+    draft = state.get("validated")
+    if draft:
+        state["rewritten"] = draft.replace("draft", "final")
+    return state
+
+def send_node(state: EmailState):
+    email = state.get("email")
+    reply = state.get("rewritten")
+    if email and reply:
+        send_email(email["from"], f"Re: {email['subject']}", reply)
+        print(f"📤 Email sent to: {email['from']}")
+    return state
+
+# Build workflow
+workflow = StateGraph(EmailState)
+workflow.add_node("Retrieve", retrieve_node)
+workflow.add_node("Draft", draft_node)
+workflow.add_node("Validate", validate_node)
+workflow.add_node("Rewrite", rewrite_node)
+workflow.add_node("Send", send_node)
+
+workflow.set_entry_point("Retrieve")
+workflow.add_edge("Retrieve", "Draft")
+workflow.add_edge("Draft", "Validate")
+workflow.add_edge("Validate", "Rewrite")
+workflow.add_edge("Rewrite", "Send")
+
+app = workflow.compile()
+
+# Run
+if __name__ == "__main__":
+    final_state = app.invoke({})
+    print("✅ Workflow done. Final state:", final_state)
@@ -0,0 +1,159 @@
+# gmail_sync.py
+import os
+import json
+import time
+from typing import Iterable, List, Optional
+
+from googleapiclient.errors import HttpError
+
+# Where the last seen mailbox historyId is kept between runs
+SYNC_STATE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "gmail_sync_state.json")
+
+class MailboxSync:
+    """Incremental mailbox sync based on Gmail history IDs.
+
+    The first poll (or any poll after the saved historyId has expired) does a full
+    `is:unread` listing and remembers the mailbox historyId. Every later poll only pulls
+    the `messagesAdded` deltas through `users().history().list`, so its cost scales with
+    new mail rather than with inbox size.
+
+    A poll does not move the saved historyId: call commit() once the returned messages have
+    been processed. Until then the next poll (e.g. after a crash) returns them again. Messages
+    passed to commit(failed_ids=...) are kept and returned again by the next poll as well.
+
+    poll() returns IDs oldest first. After a poll, `gone` lists the messages that were read,
+    lost the label or were deleted since the previous one. resync_limit caps a full resync at
+    the most recent messages, for callers that only show a few.
+
+    Pass state_path=None to keep the historyId in memory only.
+    """
+
+    def __init__(self, service=None, state_path: Optional[str] = SYNC_STATE_FILE,
+                 label_id: str = "INBOX", unread_only: bool = True, resync_limit: Optional[int] = None):
+        self._service = service
+        self.state_path = state_path
+        self.label_id = label_id
+        self.unread_only = unread_only
+        self.resync_limit = resync_limit
+        self.history_id = None
+        self.pending_history_id = None
+        self.retry_ids: List[str] = []
+        self.gone: List[str] = []
+        self.stats = {"full_syncs": 0, "incremental_syncs": 0, "history_expired": 0, "messages_seen": 0}
+        self._load_state()
+
+    @property
+    def service(self):
+        if self._service is None:
+            from gmail import get_gmail_service
+            self._service = get_gmail_service()
+        return self._service
+
+    # --- State persistence ---
+    def _load_state(self):
+        if self.state_path and os.path.exists(self.state_path):
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+            self.history_id = state.get("historyId")
+            self.retry_ids = state.get("retry", [])
+
+    def _save_state(self):
+        if not self.state_path:
+            return
+        tmp_path = self.state_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"historyId": self.history_id, "retry": self.retry_ids, "updated_at": time.time()}, f)
+        os.replace(tmp_path, self.state_path)
+
+    def reset(self):
+        """Forgets the saved historyId so the next poll does a full resync."""
+        self.history_id = self.pending_history_id = None
+        self.retry_ids = []
+        if self.state_path and os.path.exists(self.state_path):
+            os.remove(self.state_path)
+
+    # --- Sync ---
+    def poll(self) -> List[str]:
+        """Returns the IDs of messages that arrived since the last commit(), plus the ones that
+        failed then."""
+        self.gone = []
+        if self.history_id is None:
+            ids = self.full_resync()
+        else:
+            try:
+                ids = self._pull_history()
+            except HttpError as e:
+                # A 404 means the startHistoryId is too old (Gmail keeps roughly a week of history)
+                if e.resp.status != 404:
+                    raise
+                print("⚠️ Gmail history ID expired, doing a full resync")
+                self.stats["history_expired"] += 1
+                ids = self.full_resync()
+            else:
+                gone = set(self.gone)
+                ids = [msg_id for msg_id in self.retry_ids if msg_id not in gone and msg_id not in ids] + ids
+        self.stats["messages_seen"] += len(ids)
+        return ids
+
+    def commit(self, failed_ids: Iterable[str] = ()):
+        """Saves the historyId reached by the last poll, once its messages have been processed.
+        failed_ids are returned again by the next poll."""
+        if self.pending_history_id is None:
+            return
+        self.history_id, self.pending_history_id = self.pending_history_id, None
+        self.retry_ids = list(dict.fromkeys(failed_ids))
+        self._save_state()
+
+    def full_resync(self) -> List[str]:
+        # Read the historyId first so that mail arriving during the listing shows up in the next delta
+        history_id = self.service.users().getProfile(userId="me").execute()["historyId"]
+        query = "is:unread" if self.unread_only else None
+        limit = self.resync_limit
+        ids, page_token = [], None
+        while limit is None or len(ids) < limit:
+            results = self.service.users().messages().list(
+                userId="me", labelIds=[self.label_id], q=query, pageToken=page_token,
+                maxResults=500 if limit is None else min(500, limit - len(ids))
+            ).execute()
+            ids.extend(m["id"] for m in results.get("messages", []))
+            page_token = results.get("nextPageToken")
+            if not page_token:
+                break
+        # The listing is newest first and covers everything unread, failed messages included
+        self.pending_history_id = history_id
+        self.stats["full_syncs"] += 1
+        return ids[::-1]
+
+    def _pull_history(self) -> List[str]:
+        ids, gone, page_token = {}, {}, None
+        latest_history_id = self.history_id
+        while True:
+            results = self.service.users().history().list(
+                userId="me", startHistoryId=self.history_id, historyTypes=["messageAdded", "labelRemoved", "messageDeleted"],
+                labelId=self.label_id, maxResults=500, pageToken=page_token
+            ).execute()
+            # Records come oldest first: a message read or deleted after it arrived is not new any more
+            for record in results.get("history", []):
+                for added in record.get("messagesAdded", []):
+                    msg = added["message"]
+                    if self._wanted(msg.get("labelIds", [])):
+                        ids[msg["id"]] = None
+                        gone.pop(msg["id"], None)
+                for change in record.get("labelsRemoved", []) + record.get("messagesDeleted", []):
+                    msg = change["message"]
+                    if "labelIds" not in change or not self._wanted(msg.get("labelIds", [])):
+                        ids.pop(msg["id"], None)
+                        gone[msg["id"]] = None
+            latest_history_id = results.get("historyId", latest_history_id)
+            page_token = results.get("nextPageToken")
+            if not page_token:
+                break
+        self.pending_history_id = latest_history_id
+        self.gone = list(gone)
+        self.stats["incremental_syncs"] += 1
+        return list(ids)
+
+    def _wanted(self, label_ids: List[str]) -> bool:
+        if self.label_id not in label_ids:
+            return False
+        return not self.unread_only or "UNREAD" in label_ids
@@ -0,0 +1,256 @@
+# indexing.py
+# Shared ingestion pipeline: chunking, batched embedding and bulk Chroma writes run as concurrent
+# stages connected by bounded queues.
+import queue
+import threading
+import time
+import uuid
+from itertools import islice
+from typing import Iterable, Iterator, List, Optional
+
+from embedding_cache import content_hash
+from metrics import CHROMA_SECONDS
+
+EMBED_BATCH_SIZE = 64
+DEFAULT_CHROMA_BATCH_SIZE = 5000
+# Embedding batches in flight between the chunking, embedding and writing stages
+PIPELINE_QUEUE_SIZE = 4
+# Collection metadata key set to a new value whenever indexing changes a collection, so processes
+# caching anything derived from it (the API's reply cache) notice a reindex done elsewhere
+CONTENT_VERSION_KEY = "content_version"
+
+def batched(iterable: Iterable, size: int) -> Iterator[list]:
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+def max_chroma_batch_size(client) -> int:
+    """Largest number of records Chroma accepts in one add/upsert call."""
+    try:
+        return client.get_max_batch_size()
+    except AttributeError:
+        return getattr(client, "max_batch_size", DEFAULT_CHROMA_BATCH_SIZE)
+
+def chunk_ids(source: str, hashes: List[str], seen: Optional[dict] = None) -> List[str]:
+    """Content-addressed chunk IDs: an unchanged chunk keeps its ID across reindexes.
+
+    Pass the same `seen` dict to number repeated chunks consistently across calls on one document.
+    """
+    ids = []
+    seen = {} if seen is None else seen
+    for h in hashes:
+        n = seen.get(h, 0)
+        seen[h] = n + 1
+        ids.append(f"{source}::{h[:16]}" if n == 0 else f"{source}::{h[:16]}-{n}")
+    return ids
+
+def mark_changed(collection):
+    # hnsw:* settings cannot be passed to modify() again, and are kept by Chroma anyway
+    metadata = {key: value for key, value in (collection.metadata or {}).items() if not key.startswith("hnsw:")}
+    with CHROMA_SECONDS.time(op="modify"):
+        collection.modify(metadata={**metadata, CONTENT_VERSION_KEY: uuid.uuid4().hex})
+
+def content_version(collection) -> Optional[str]:
+    """Changes whenever the collection's content does; read it from a freshly fetched collection."""
+    return (collection.metadata or {}).get(CONTENT_VERSION_KEY)
+
+class _Stage(threading.Thread):
+    """Runs fn(put) on a thread, passing it a put() that blocks while the bounded queue is full.
+
+    Items come out of the stage by iterating it; an exception in fn is re-raised there. If the
+    consumer gives up (cancel()), put() raises so the producer stops instead of blocking forever.
+    """
+
+    _DONE = object()
+
+    def __init__(self, fn, maxsize: int, name: str):
+        super().__init__(name=name, daemon=True)
+        self._fn = fn
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._cancelled = threading.Event()
+        self._error = None
+
+    def _put(self, item):
+        while True:
+            if self._cancelled.is_set():
+                raise RuntimeError("pipeline cancelled")
+            try:
+                self._queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def run(self):
+        try:
+            self._fn(self._put)
+        except Exception as e:
+            self._error = e
+        finally:
+            try:
+                self._put(self._DONE)
+            except RuntimeError:
+                pass  # nobody is reading any more
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def __iter__(self):
+        while True:
+            item = self._queue.get()
+            if item is self._DONE:
+                if self._error is not None:
+                    raise self._error
+                return
+            yield item
+
+def index_document_stream(collection, source: str, chunks: Iterable[dict], embedder,
+                          write_batch_size: int = DEFAULT_CHROMA_BATCH_SIZE,
+                          keyword_index=None,
+                          embed_batch_size: int = EMBED_BATCH_SIZE,
+                          queue_size: int = PIPELINE_QUEUE_SIZE) -> dict:
+    """Incrementally (re)indexes one document from a stream of {"text", "metadata"} chunks.
+
+    Three stages run concurrently, connected by bounded queues: chunking (pulling from `chunks`,
+    e.g. iter_chunks over a file being read), embedding and writing to Chroma. Chunks whose
+    content-hash ID is already stored for `source` are skipped, only new or changed ones are
+    embedded, and chunks that disappeared are deleted at the end. The optional keyword index is
+    updated in the same pass. Memory is bounded by the queue and batch sizes, not the document;
+    only the chunk IDs are kept for the whole run.
+    """
+    start = time.perf_counter()
+    with CHROMA_SECONDS.time(op="get"):
+        existing = set(collection.get(where={"source": source}, include=[])["ids"])
+    seen_ids = set()
+    counts = {"total": 0, "unchanged": 0}
+
+    def backfill_keyword_index(unchanged: List[tuple]):
+        # Chunks already in Chroma but not yet in the keyword index (e.g. it was added later) need no embedding
+        missing = set(keyword_index.missing(collection.name, [chunk_id for chunk_id, _, _ in unchanged]))
+        backfill = [record for record in unchanged if record[0] in missing]
+        if backfill:
+            keyword_index.upsert(collection.name, *map(list, zip(*backfill)))
+
+    def chunk_stage(put):
+        hash_counts = {}
+        batch, unchanged = [], []
+        for chunk in chunks:
+            h = content_hash(chunk["text"])
+            chunk_id = chunk_ids(source, [h], hash_counts)[0]
+            seen_ids.add(chunk_id)
+            counts["total"] += 1
+            record = (chunk_id, chunk["text"], {"source": source, "chunk_hash": h, **(chunk.get("metadata") or {})})
+            if chunk_id in existing:
+                counts["unchanged"] += 1
+                if keyword_index is not None:
+                    unchanged.append(record)
+                    if len(unchanged) >= 500:
+                        backfill_keyword_index(unchanged)
+                        unchanged = []
+                continue
+            batch.append(record)
+            if len(batch) >= embed_batch_size:
+                put(batch)
+                batch = []
+        if batch:
+            put(batch)
+        if unchanged:
+            backfill_keyword_index(unchanged)
+
+    def embed_stage(put):
+        try:
+            for batch in chunker:
+                # Kept as float32 rows (not Python lists of floats, which are ~8x larger) until written
+                put((batch, list(embedder.encode([text for _, text, _ in batch], batch_size=embed_batch_size))))
+        finally:
+            chunker.cancel()
+
+    chunker = _Stage(chunk_stage, queue_size, "ingest-chunk")
+    encoder = _Stage(embed_stage, queue_size, "ingest-embed")
+    chunker.start()
+    encoder.start()
+
+    ids: List[str] = []
+    documents: List[str] = []
+    metadatas: List[dict] = []
+    embeddings: List[list] = []
+    embedded = writes = 0
+
+    def write(n: int):
+        nonlocal writes
+        with CHROMA_SECONDS.time(op="upsert"):
+            collection.upsert(ids=ids[:n], documents=documents[:n], embeddings=embeddings[:n], metadatas=metadatas[:n])
+        if keyword_index is not None:
+            keyword_index.upsert(collection.name, ids[:n], documents[:n], metadatas[:n])
+        writes += 1
+        for buffer in (ids, documents, metadatas, embeddings):
+            del buffer[:n]
+
+    try:
+        for batch, vectors in encoder:
+            for chunk_id, text, metadata in batch:
+                ids.append(chunk_id)
+                documents.append(text)
+                metadatas.append(metadata)
+            embeddings.extend(vectors)
+            embedded += len(batch)
+            while len(ids) >= write_batch_size:
+                write(write_batch_size)
+        if ids:
+            write(len(ids))
+    finally:
+        # Stops the embedding stage if writing failed; it stops the chunking stage in turn. Waiting
+        # for both means nothing reads from `chunks` any more once this returns or raises.
+        encoder.cancel()
+        encoder.join()
+        chunker.join()
+
+    stale = list(existing.difference(seen_ids))
+    for batch in batched(stale, write_batch_size):
+        with CHROMA_SECONDS.time(op="delete"):
+            collection.delete(ids=batch)
+    if keyword_index is not None and stale:
+        keyword_index.delete(collection.name, stale)
+    if embedded or stale:
+        mark_changed(collection)
+
+    seconds = time.perf_counter() - start
+    return {
+        "chunks": embedded,
+        "writes": writes,
+        "seconds": round(seconds, 3),
+        "chunks_per_sec": round(embedded / seconds, 1) if seconds > 0 else None,
+        "total": counts["total"],
+        "unchanged": counts["unchanged"],
+        "deleted": len(stale),
+    }
+
+def index_document(collection, source: str, chunks: List[str], embedder,
+                   metadatas: Optional[List[dict]] = None,
+                   write_batch_size: int = DEFAULT_CHROMA_BATCH_SIZE,
+                   keyword_index=None) -> dict:
+    """Incrementally (re)indexes one document whose chunks are already in memory.
+
+    Chunks whose content hash is already stored for `source` are left alone, only new or
+    changed chunks are embedded and written, and chunks that disappeared are deleted. The
+    optional keyword index is updated in the same pass. See index_document_stream.
+    """
+    records = ({"text": chunk, "metadata": metadatas[i] if metadatas else None} for i, chunk in enumerate(chunks))
+    return index_document_stream(collection, source, records, embedder, write_batch_size=write_batch_size,
+                                 keyword_index=keyword_index)
+
+def remove_document(collection, source: str, write_batch_size: int = DEFAULT_CHROMA_BATCH_SIZE,
+                    keyword_index=None) -> int:
+    """Deletes every chunk of `source` (e.g. after the file was deleted). Returns the number removed."""
+    with CHROMA_SECONDS.time(op="get"):
+        ids = collection.get(where={"source": source}, include=[])["ids"]
+    for batch in batched(ids, write_batch_size):
+        with CHROMA_SECONDS.time(op="delete"):
+            collection.delete(ids=batch)
+    if keyword_index is not None and ids:
+        keyword_index.delete(collection.name, ids)
+    if ids:
+        mark_changed(collection)
+    return len(ids)
@@ -0,0 +1,202 @@
+# jobs.py
+# Background job subsystem for the email workflows: a persistent SQLite job table and a
+# bounded pool of asyncio workers, so HTTP callers get a job ID back right away.
+#
+# Several worker processes can share one job table: every job belongs to the runner that queued
+# it, runners heartbeat, and only the jobs of runners whose heartbeat lapsed are recovered.
+import asyncio
+import functools
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Awaitable, Callable, Dict, Optional
+
+JOBS_DB = "jobs.sqlite3"
+JOB_HEARTBEAT_SECONDS = 15.0
+# A runner that has not heartbeat for this long is considered dead and its jobs are taken over
+JOB_LEASE_SECONDS = 60.0
+
+class JobQueueFull(Exception):
+    pass
+
+class JobStore:
+    def __init__(self, path: str = JOBS_DB):
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    params TEXT,
+                    result TEXT,
+                    error TEXT,
+                    created_at REAL NOT NULL,
+                    started_at REAL,
+                    finished_at REAL,
+                    owner TEXT
+                )"""
+            )
+            columns = {row["name"] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+            if "owner" not in columns:
+                self._conn.execute("ALTER TABLE jobs ADD COLUMN owner TEXT")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_status_created ON jobs (status, created_at)")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS runners (owner TEXT PRIMARY KEY, heartbeat_at REAL NOT NULL)")
+
+    def _execute(self, sql: str, args=()):
+        with self._lock, self._conn:
+            return self._conn.execute(sql, args).fetchall()
+
+    def create(self, kind: str, params: Optional[dict] = None, owner: Optional[str] = None) -> str:
+        job_id = uuid.uuid4().hex
+        self._execute("INSERT INTO jobs (id, kind, status, params, created_at, owner) VALUES (?, ?, 'queued', ?, ?, ?)",
+                      (job_id, kind, json.dumps(params or {}), time.time(), owner))
+        return job_id
+
+    def mark_running(self, job_id: str):
+        self._execute("UPDATE jobs SET status = 'running', started_at = ? WHERE id = ?", (time.time(), job_id))
+
+    def mark_done(self, job_id: str, result):
+        self._execute("UPDATE jobs SET status = 'done', result = ?, finished_at = ? WHERE id = ?",
+                      (json.dumps(result, default=str), time.time(), job_id))
+
+    def mark_failed(self, job_id: str, error: str):
+        self._execute("UPDATE jobs SET status = 'failed', error = ?, finished_at = ? WHERE id = ?",
+                      (error, time.time(), job_id))
+
+    def get(self, job_id: str, with_result: bool = False) -> Optional[dict]:
+        rows = self._execute("SELECT * FROM jobs WHERE id = ?", (job_id,))
+        return self._to_dict(rows[0], with_result) if rows else None
+
+    def list(self, status: Optional[str] = None, limit: int = 50) -> list:
+        if status:
+            rows = self._execute("SELECT * FROM jobs WHERE status = ? ORDER BY created_at DESC LIMIT ?", (status, limit))
+        else:
+            rows = self._execute("SELECT * FROM jobs ORDER BY created_at DESC LIMIT ?", (limit,))
+        return [self._to_dict(row) for row in rows]
+
+    def heartbeat(self, owner: str):
+        self._execute("INSERT INTO runners (owner, heartbeat_at) VALUES (?, ?) "
+                      "ON CONFLICT (owner) DO UPDATE SET heartbeat_at = excluded.heartbeat_at", (owner, time.time()))
+
+    def retire(self, owner: str):
+        """Forgets a runner that shut down, so its queued jobs are taken over right away."""
+        self._execute("DELETE FROM runners WHERE owner = ?", (owner,))
+
+    def recover(self, owner: str, lease_seconds: float = JOB_LEASE_SECONDS) -> list:
+        """Takes over the jobs of runners whose heartbeat lapsed (e.g. the process died).
+
+        Their running jobs are marked interrupted; their queued ones now belong to `owner` and are
+        returned so they can be enqueued. Jobs of live runners are left alone, and each update is a
+        single statement, so two runners recovering at once never adopt the same job.
+        """
+        now = time.time()
+        dead = "(owner IS NULL OR owner NOT IN (SELECT owner FROM runners WHERE heartbeat_at >= ?))"
+        self._execute(f"UPDATE jobs SET status = 'interrupted', finished_at = ? WHERE status = 'running' AND {dead}",
+                      (now, now - lease_seconds))
+        rows = self._execute(f"UPDATE jobs SET owner = ? WHERE status = 'queued' AND {dead} RETURNING id, kind, params, created_at",
+                             (owner, now - lease_seconds))
+        self._execute("DELETE FROM runners WHERE heartbeat_at < ?", (now - lease_seconds,))
+        return [(row["id"], row["kind"], json.loads(row["params"] or "{}")) for row in sorted(rows, key=lambda row: row["created_at"])]
+
+    def counts(self) -> dict:
+        return {row["status"]: row["n"] for row in self._execute("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status")}
+
+    @staticmethod
+    def _to_dict(row: sqlite3.Row, with_result: bool = False) -> dict:
+        job = {key: row[key] for key in ("id", "kind", "status", "error", "created_at", "started_at", "finished_at", "owner")}
+        job["params"] = json.loads(row["params"] or "{}")
+        if with_result:
+            job["result"] = json.loads(row["result"]) if row["result"] else None
+        return job
+
+class JobRunner:
+    """Runs queued jobs on a fixed number of asyncio workers.
+
+    handlers maps a job kind to an async function taking the job params and returning a
+    JSON-serialisable result. The runner heartbeats while it runs and periodically takes over
+    the queued jobs of runners (in other processes) that stopped heartbeating. JobStore calls
+    run in the default executor, so a busy database never stalls the event loop.
+    """
+
+    def __init__(self, store: JobStore, handlers: Dict[str, Callable[[dict], Awaitable]],
+                 workers: int = 4, max_pending: int = 100,
+                 heartbeat_seconds: float = JOB_HEARTBEAT_SECONDS, lease_seconds: float = JOB_LEASE_SECONDS):
+        self.store = store
+        self.handlers = handlers
+        self.workers = workers
+        self.max_pending = max_pending
+        self.heartbeat_seconds = heartbeat_seconds
+        self.lease_seconds = lease_seconds
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._queue: Optional[asyncio.Queue] = None
+        self._submitting = 0
+        self._tasks = []
+
+    async def _store(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(None, functools.partial(fn, *args))
+
+    async def start(self):
+        self._queue = asyncio.Queue()
+        await self._store(self.store.heartbeat, self.owner)
+        await self._adopt()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._heartbeat()))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        await self._store(self.store.retire, self.owner)
+
+    async def submit(self, kind: str, params: Optional[dict] = None) -> str:
+        if kind not in self.handlers:
+            raise ValueError(f"Unknown job kind: {kind}")
+        if self._queue is None:
+            raise RuntimeError("JobRunner is not running; call start() before submitting jobs")
+        # Submits still writing their row count too, so concurrent callers cannot overshoot max_pending
+        if self._queue.qsize() + self._submitting >= self.max_pending:
+            raise JobQueueFull(f"{self._queue.qsize()} jobs already queued")
+        self._submitting += 1
+        try:
+            job_id = await self._store(self.store.create, kind, params, self.owner)
+        finally:
+            self._submitting -= 1
+        self._queue.put_nowait((job_id, kind, params or {}))
+        return job_id
+
+    def pending(self) -> int:
+        return self._queue.qsize() if self._queue else 0
+
+    async def _adopt(self):
+        for job in await self._store(self.store.recover, self.owner, self.lease_seconds):
+            print(f"🔁 Taking over queued job {job[0]} ({job[1]})")
+            self._queue.put_nowait(job)
+
+    async def _heartbeat(self):
+        while True:
+            await asyncio.sleep(self.heartbeat_seconds)
+            await self._store(self.store.heartbeat, self.owner)
+            await self._adopt()
+
+    async def _worker(self):
+        while True:
+            job_id, kind, params = await self._queue.get()
+            try:
+                await self._store(self.store.mark_running, job_id)
+                result = await self.handlers[kind](params)
+            except Exception as e:
+                print(f"❌ Job {job_id} ({kind}) failed: {e}")
+                await self._store(self.store.mark_failed, job_id, str(e))
+            else:
+                await self._store(self.store.mark_done, job_id, result)
+            finally:
+                self._queue.task_done()
@@ -0,0 +1,222 @@
+# keyword_index.py
+# Compact on-disk inverted index (SQLite) with BM25 scoring, kept in sync with the Chroma
+# collections by indexing.py, plus reciprocal rank fusion for hybrid BM25 + vector retrieval.
+import json
+import math
+import re
+import sqlite3
+import threading
+from collections import Counter
+from typing import Dict, List, Optional
+
+KEYWORD_INDEX_DB = "keyword_index.sqlite3"
+BM25_K1 = 1.2
+BM25_B = 0.75
+RRF_K = 60
+
+# Keeps numbers like "724" and "30.00" and single letters like fare classes "B", "E", "G" as tokens
+_TOKEN_RE = re.compile(r"[0-9]+(?:[.,][0-9]+)*|[^\W\d_]+", re.UNICODE)
+
+def tokenize(text: str) -> List[str]:
+    tokens = []
+    for token in _TOKEN_RE.findall(text.lower()):
+        tokens.append(token)
+        if token[0].isdigit() and ("." in token or "," in token):
+            # "30.00" should also match a query for "30"
+            tokens.append(re.split(r"[.,]", token, 1)[0])
+    return tokens
+
+_WHERE_OPERATORS = {"$eq": "=", "$ne": "!=", "$gt": ">", "$gte": ">=", "$lt": "<", "$lte": "<="}
+_SCALAR_TYPES = (str, int, float, bool)
+
+def _check_operand(key: str, op: str, value):
+    """Applies Chroma's operand rules, so a filter the keyword index accepts is also valid for Chroma."""
+    if op in ("$gt", "$gte", "$lt", "$lte"):
+        valid = isinstance(value, (int, float)) and not isinstance(value, bool)
+    elif op in ("$eq", "$ne"):
+        valid = isinstance(value, _SCALAR_TYPES)
+    elif op in ("$in", "$nin"):
+        # Non-empty, and every item of the same type (Chroma rejects [1, 2.5] as well as [1, "a"])
+        valid = (isinstance(value, list) and bool(value) and isinstance(value[0], _SCALAR_TYPES)
+                 and all(type(item) is type(value[0]) for item in value))
+    else:
+        raise ValueError(f"Unsupported where operator for {key!r}: {op}")
+    if not valid:
+        raise ValueError(f"Unsupported where condition for {key!r}: {op} {value!r}")
+
+def where_sql(where: dict, column: str = "d.metadata") -> tuple:
+    """Translates a Chroma-style metadata filter into (SQL condition, params) over a JSON column.
+
+    Supports {"key": value}, {"key": {"$eq"|"$ne"|"$gt"|"$gte"|"$lt"|"$lte"|"$in"|"$nin": value}}
+    and nested {"$and"|"$or": [...]}. Raises ValueError for anything else.
+    """
+    if not isinstance(where, dict) or not where:
+        raise ValueError(f"Invalid where filter: {where!r}")
+    clauses, params = [], []
+    for key, condition in where.items():
+        if key in ("$and", "$or"):
+            if not isinstance(condition, list) or not condition:
+                raise ValueError(f"{key} expects a non-empty list of filters")
+            parts = [where_sql(part, column) for part in condition]
+            clauses.append("(" + f" {key[1:].upper()} ".join(sql for sql, _ in parts) + ")")
+            params.extend(param for _, part_params in parts for param in part_params)
+            continue
+        if key.startswith("$"):
+            raise ValueError(f"Unsupported where operator: {key}")
+        if isinstance(condition, dict) and not condition:
+            raise ValueError(f"Empty where condition for {key!r}")
+        path = '$."' + key.replace('"', '\\"') + '"'
+        for op, value in (condition.items() if isinstance(condition, dict) else [("$eq", condition)]):
+            _check_operand(key, op, value)
+            if op in _WHERE_OPERATORS:
+                clauses.append(f"json_extract({column}, ?) {_WHERE_OPERATORS[op]} ?")
+                params.extend([path, value])
+            else:
+                negate = "NOT " if op == "$nin" else ""
+                clauses.append(f"json_extract({column}, ?) {negate}IN ({','.join('?' * len(value))})")
+                params.extend([path, *value])
+    return " AND ".join(clauses), params
+
+def _combine(op: str, clauses: List[dict]) -> dict:
+    # Chroma wants two or more entries under $and/$or; a single clause stands on its own
+    return clauses[0] if len(clauses) == 1 else {op: clauses}
+
+def _normalize(where: dict) -> dict:
+    clauses = []
+    for key, condition in where.items():
+        if key in ("$and", "$or"):
+            clauses.append(_combine(key, [_normalize(part) for part in condition]))
+        elif isinstance(condition, dict):
+            clauses.extend({key: {op: value}} for op, value in condition.items())
+        else:
+            clauses.append({key: condition})
+    return _combine("$and", clauses)
+
+def normalize_where(where: Optional[dict]) -> Optional[dict]:
+    """Validates a filter and rewrites it into the form Chroma accepts: one key per filter level and
+    one operator per field, so {"a": 1, "b": 2} and {"n": {"$gte": 1, "$lte": 3}} become $and lists,
+    and a one-entry $and/$or is unwrapped. Raises ValueError for filters Chroma would reject."""
+    if not where:
+        return None
+    where_sql(where)  # validates
+    return _normalize(where)
+
+class KeywordIndex:
+    def __init__(self, path: str = KEYWORD_INDEX_DB):
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS docs (
+                    doc_id INTEGER PRIMARY KEY,
+                    collection TEXT NOT NULL,
+                    chunk_id TEXT NOT NULL,
+                    length INTEGER NOT NULL,
+                    document TEXT NOT NULL,
+                    metadata TEXT,
+                    UNIQUE (collection, chunk_id)
+                )"""
+            )
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS postings (
+                    collection TEXT NOT NULL,
+                    term TEXT NOT NULL,
+                    doc_id INTEGER NOT NULL,
+                    tf INTEGER NOT NULL,
+                    PRIMARY KEY (collection, term, doc_id)
+                ) WITHOUT ROWID"""
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS postings_doc ON postings (doc_id)")
+
+    def _delete_locked(self, collection: str, ids: List[str]):
+        for start in range(0, len(ids), 500):
+            part = ids[start:start + 500]
+            placeholders = ",".join("?" * len(part))
+            doc_ids = [row[0] for row in self._conn.execute(
+                f"SELECT doc_id FROM docs WHERE collection = ? AND chunk_id IN ({placeholders})", [collection, *part])]
+            if not doc_ids:
+                continue
+            doc_placeholders = ",".join("?" * len(doc_ids))
+            self._conn.execute(f"DELETE FROM postings WHERE doc_id IN ({doc_placeholders})", doc_ids)
+            self._conn.execute(f"DELETE FROM docs WHERE doc_id IN ({doc_placeholders})", doc_ids)
+
+    def upsert(self, collection: str, ids: List[str], documents: List[str], metadatas: Optional[List[dict]] = None):
+        with self._lock, self._conn:
+            self._delete_locked(collection, list(ids))
+            for i, (chunk_id, document) in enumerate(zip(ids, documents)):
+                terms = Counter(tokenize(document))
+                metadata = json.dumps(metadatas[i]) if metadatas else None
+                doc_id = self._conn.execute(
+                    "INSERT INTO docs (collection, chunk_id, length, document, metadata) VALUES (?, ?, ?, ?, ?)",
+                    (collection, chunk_id, sum(terms.values()), document, metadata),
+                ).lastrowid
+                self._conn.executemany(
+                    "INSERT INTO postings (collection, term, doc_id, tf) VALUES (?, ?, ?, ?)",
+                    [(collection, term, doc_id, tf) for term, tf in terms.items()],
+                )
+
+    def delete(self, collection: str, ids: List[str]):
+        with self._lock, self._conn:
+            self._delete_locked(collection, list(ids))
+
+    def missing(self, collection: str, ids: List[str]) -> List[str]:
+        """The subset of ids that are not in the index."""
+        present = set()
+        with self._lock:
+            for start in range(0, len(ids), 500):
+                part = ids[start:start + 500]
+                placeholders = ",".join("?" * len(part))
+                present.update(row[0] for row in self._conn.execute(
+                    f"SELECT chunk_id FROM docs WHERE collection = ? AND chunk_id IN ({placeholders})", [collection, *part]))
+        return [chunk_id for chunk_id in ids if chunk_id not in present]
+
+    def search(self, collection: str, query: str, top_k: int = 5, where: Optional[dict] = None) -> List[dict]:
+        """BM25 search. Returns [{"id", "score", "document", "metadata"}], best first.
+
+        With a Chroma-style `where` filter, only chunks whose metadata matches are scored.
+        """
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms:
+            return []
+        filter_sql, filter_params = where_sql(where) if where else ("", [])
+        postings_sql = ("SELECT p.doc_id, p.tf, d.length FROM postings p JOIN docs d ON d.doc_id = p.doc_id "
+                        "WHERE p.collection = ? AND p.term = ?" + (f" AND {filter_sql}" if filter_sql else ""))
+        with self._lock:
+            n_docs, avg_len = self._conn.execute(
+                "SELECT COUNT(*), AVG(length) FROM docs WHERE collection = ?", (collection,)).fetchone()
+            if not n_docs:
+                return []
+            scores: Dict[int, float] = {}
+            for term in terms:
+                rows = self._conn.execute(postings_sql, (collection, term, *filter_params)).fetchall()
+                if not rows:
+                    continue
+                # Document frequency over the whole collection, so scores do not depend on the filter
+                df = len(rows) if not filter_sql else self._conn.execute(
+                    "SELECT COUNT(*) FROM postings WHERE collection = ? AND term = ?", (collection, term)).fetchone()[0]
+                idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+                for doc_id, tf, length in rows:
+                    norm = tf * (BM25_K1 + 1) / (tf + BM25_K1 * (1 - BM25_B + BM25_B * length / avg_len))
+                    scores[doc_id] = scores.get(doc_id, 0.0) + idf * norm
+            best = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:top_k]
+            if not best:
+                return []
+            placeholders = ",".join("?" * len(best))
+            docs = {row[0]: row[1:] for row in self._conn.execute(
+                f"SELECT doc_id, chunk_id, document, metadata FROM docs WHERE doc_id IN ({placeholders})",
+                [doc_id for doc_id, _ in best])}
+        return [
+            {"id": docs[doc_id][0], "score": round(score, 4), "document": docs[doc_id][1],
+             "metadata": json.loads(docs[doc_id][2]) if docs[doc_id][2] else None}
+            for doc_id, score in best
+        ]
+
+def reciprocal_rank_fusion(rankings: List[List[str]], k: int = RRF_K) -> List[tuple]:
+    """Fuses several ranked ID lists. Returns [(id, score)] sorted by fused score."""
+    scores: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
@@ -0,0 +1,126 @@
+# ledger.py
+# Idempotent processing ledger: remembers how far each Gmail message got through the agent
+# workflow, so a retry resumes from the last completed stage instead of re-drafting or re-sending.
+#
+# A run first claims a message (a lease held by the run's owner ID), so concurrent runs never work
+# on the same message; the lease is released when the run ends, or lapses if the process died.
+import json
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+LEDGER_DB = "message_ledger.sqlite3"
+# Long enough to cover drafting, validation and waiting on the paced send queue
+LEDGER_LEASE_SECONDS = 900.0
+
+# Stages in workflow order; "sent" and "escalated" are terminal. "sending" is recorded right before
+# a reply is handed to Gmail and "send_failed" after Gmail rejected it; they share a rank so a
+# failed send can be attempted again.
+STAGE_RANK = {"fetched": 0, "drafted": 1, "validated": 2, "sending": 3, "send_failed": 3, "sent": 4, "escalated": 4}
+TERMINAL_STAGES = ("sent", "escalated")
+
+class MessageLedger:
+    def __init__(self, path: str = LEDGER_DB):
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            # Keyed by Gmail message ID; WITHOUT ROWID keeps lookups to a single B-tree probe
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS messages (
+                    message_id TEXT PRIMARY KEY,
+                    stage TEXT NOT NULL,
+                    stage_rank INTEGER NOT NULL,
+                    email TEXT,
+                    draft TEXT,
+                    updated_at REAL NOT NULL,
+                    owner TEXT,
+                    lease_until REAL,
+                    send_attempts INTEGER NOT NULL DEFAULT 0
+                ) WITHOUT ROWID"""
+            )
+            columns = {row["name"] for row in self._conn.execute("PRAGMA table_info(messages)")}
+            for column, definition in (("owner", "TEXT"), ("lease_until", "REAL"), ("send_attempts", "INTEGER NOT NULL DEFAULT 0")):
+                if column not in columns:
+                    self._conn.execute(f"ALTER TABLE messages ADD COLUMN {column} {definition}")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS messages_rank_updated ON messages (stage_rank, updated_at)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS messages_owner ON messages (owner)")
+
+    def get(self, message_id: str) -> Optional[dict]:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM messages WHERE message_id = ?", (message_id,)).fetchone()
+        if row is None:
+            return None
+        return {
+            "message_id": row["message_id"],
+            "stage": row["stage"],
+            "email": json.loads(row["email"]) if row["email"] else None,
+            "draft": row["draft"],
+            "send_attempts": row["send_attempts"],
+            "updated_at": row["updated_at"],
+        }
+
+    def claim(self, message_id: str, owner: str, lease_seconds: float = LEDGER_LEASE_SECONDS) -> bool:
+        """Atomically leases a message to `owner`. False if another owner holds an unexpired lease."""
+        now = time.time()
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                """INSERT INTO messages (message_id, stage, stage_rank, updated_at, owner, lease_until)
+                   VALUES (?, 'fetched', 0, ?, ?, ?)
+                   ON CONFLICT (message_id) DO UPDATE SET
+                       owner = excluded.owner,
+                       lease_until = excluded.lease_until
+                   WHERE messages.owner IS NULL OR messages.owner = excluded.owner OR messages.lease_until < ?""",
+                (message_id, now, owner, now + lease_seconds, now),
+            )
+            return cursor.rowcount == 1
+
+    def release(self, owner: str):
+        """Drops every lease held by `owner`, e.g. when its workflow run ended."""
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE messages SET owner = NULL, lease_until = NULL WHERE owner = ?", (owner,))
+
+    def start_send(self, message_id: str) -> int:
+        """Records that a reply is about to be handed to Gmail. Returns the attempt number."""
+        with self._lock, self._conn:
+            self._conn.execute(
+                """UPDATE messages SET stage = 'sending', stage_rank = ?, send_attempts = send_attempts + 1, updated_at = ?
+                   WHERE message_id = ? AND stage_rank <= ?""",
+                (STAGE_RANK["sending"], time.time(), message_id, STAGE_RANK["sending"]),
+            )
+            row = self._conn.execute("SELECT send_attempts FROM messages WHERE message_id = ?", (message_id,)).fetchone()
+        return row["send_attempts"] if row else 0
+
+    def record(self, message_id: str, stage: str, email: Optional[dict] = None, draft: Optional[str] = None):
+        """Moves a message to `stage`. A message never moves back to an earlier stage."""
+        rank = STAGE_RANK[stage]
+        with self._lock, self._conn:
+            self._conn.execute(
+                """INSERT INTO messages (message_id, stage, stage_rank, email, draft, updated_at)
+                   VALUES (?, ?, ?, ?, ?, ?)
+                   ON CONFLICT (message_id) DO UPDATE SET
+                       stage = excluded.stage,
+                       stage_rank = excluded.stage_rank,
+                       email = COALESCE(excluded.email, messages.email),
+                       draft = COALESCE(excluded.draft, messages.draft),
+                       updated_at = excluded.updated_at
+                   WHERE excluded.stage_rank >= messages.stage_rank""",
+                (message_id, stage, rank, json.dumps(email) if email is not None else None, draft, time.time()),
+            )
+
+    def incomplete(self, limit: int = 100) -> list:
+        """Oldest messages that have not reached a terminal stage, e.g. after a crash."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT message_id, stage FROM messages WHERE stage_rank < ? ORDER BY stage_rank, updated_at LIMIT ?",
+                (STAGE_RANK["sent"], limit),
+            ).fetchall()
+        return [{"message_id": row["message_id"], "stage": row["stage"]} for row in rows]
+
+    def counts(self) -> dict:
+        with self._lock:
+            rows = self._conn.execute("SELECT stage, COUNT(*) AS n FROM messages GROUP BY stage").fetchall()
+        return {row["stage"]: row["n"] for row in rows}
@@ -1,36 +1,314 @@
-# llm_client.py
-import os
-import random
-
-# You need to import your actual LLM client here
-# e.g., import openai
-# from openai import OpenAI
-# client = OpenAI()
-
-def generate_draft(email: dict) -> str:
-    """Uses an LLM to generate a draft email reply."""
-    print("🤖 Generating draft with LLM...")
-    # This is where you would call your LLM's API
-    # Example using OpenAI:
-    # prompt = f"Draft a professional reply to the email: {email['body']}"
-    # response = client.chat.completions.create(model="gpt-4", messages=[{"role": "user", "content": prompt}])
-    # return response.choices[0].message.content
-
-    # Placeholder logic
-    return f"Hi, I've received your email regarding '{email['subject']}'. I am working on a solution and will get back to you shortly."
-
-def validate_draft(draft: str) -> bool:
-    """Uses an LLM to validate the draft email for tone, PII, etc."""
-    print("🤖 Validating draft with LLM...")
-    # This is where you would call your LLM's API to perform validation
-    # Example using a placeholder:
-    # A real implementation would use the LLM to check for errors.
-    # We will simulate a random success/failure here for demonstration.
-    return random.choice([True, True, True, False]) # Simulate passing most of the time
-
-def rewrite_draft(draft: str, feedback: str) -> str:
-    """Uses an LLM to rewrite the draft based on feedback."""
-    print("🤖 Rewriting draft with LLM...")
-    # This is where you would call your LLM's API to rewrite the draft based on feedback
-    # Example using a placeholder:
-    return draft.replace("working on a solution", "currently looking into this issue")
\ No newline at end of file
+# llm_client.py
+# Draft / validate / rewrite calls behind a pluggable backend, chosen with LLM_BACKEND:
+#   placeholder  canned replies and random validation (default, no server needed)
+#   openai       any OpenAI-compatible /chat/completions endpoint, e.g. mock_llm_server.py:
+#                LLM_BACKEND=openai LLM_BASE_URL=http://localhost:8001/v1
+import os
+import json
+import random
+import re
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, Iterator, List, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from chunking import count_tokens
+
+# Upper bound on retrieved policy text handed to the generator, in tokens
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "800"))
+
+def pack_context(chunks: List[str], max_tokens: int = CONTEXT_TOKEN_BUDGET) -> List[str]:
+    """Deduplicates retrieved chunks (best first) and keeps as many as fit in max_tokens."""
+    packed, seen, used = [], set(), 0
+    for chunk in chunks:
+        key = " ".join(chunk.split())
+        if not key or key in seen:
+            continue
+        seen.add(key)
+        tokens = count_tokens(chunk)
+        if used + tokens > max_tokens:
+            continue  # a smaller, lower-ranked chunk may still fit
+        packed.append(chunk)
+        used += tokens
+    return packed
+
+def build_draft_prompt(email: dict, context: Optional[List[str]] = None) -> str:
+    prompt = f"Draft a professional reply to the email: {email['body']}"
+    if context:
+        policy = "\n\n".join(f"[{i + 1}] {chunk}" for i, chunk in enumerate(context))
+        prompt = f"Answer using only the policy excerpts below.\n\n{policy}\n\n{prompt}"
+    return prompt
+
+# --- Prompts ---
+DRAFT_SYSTEM_PROMPT = "You write concise, polite customer-support email replies for an airline. Return only the reply."
+VALIDATE_SYSTEM_PROMPT = ("You review a draft customer-support reply for tone, accuracy and personal data. "
+                          "Answer PASS or FAIL, followed by a one-sentence reason.")
+VALIDATE_BATCH_SYSTEM_PROMPT = ("You review several draft customer-support replies for tone, accuracy and personal data. "
+                                "Answer with only a JSON array of booleans, one per draft in order, true if it passes.")
+REWRITE_SYSTEM_PROMPT = "You rewrite a draft customer-support reply so it addresses the reviewer feedback. Return only the new reply."
+
+def format_draft_batch(drafts: List[str]) -> str:
+    return "\n\n".join(f"Draft {i + 1}:\n{draft}" for i, draft in enumerate(drafts))
+
+# --- Backends ---
+class LLMError(Exception):
+    pass
+
+class PlaceholderBackend:
+    name = "placeholder"
+    batch_validation = False
+
+    def generate_draft(self, email: dict, context: Optional[List[str]] = None,
+                       on_token: Optional[Callable[[str], None]] = None) -> str:
+        # The context is not used: a canned reply cannot answer from it, and pasting raw chunks (heading
+        # paths, neighbouring Q&A items) into customer mail is worse than no policy text at all
+        reply = f"Hi, I've received your email regarding '{email['subject']}'. I am working on a solution and will get back to you shortly."
+        if on_token:
+            for word in reply.split(" "):
+                on_token(word + " ")
+        return reply
+
+    def validate_draft(self, draft: str) -> bool:
+        # We will simulate a random success/failure here for demonstration.
+        return random.choice([True, True, True, False]) # Simulate passing most of the time
+
+    def validate_drafts(self, drafts: List[str]) -> List[bool]:
+        return [self.validate_draft(draft) for draft in drafts]
+
+    def rewrite_draft(self, draft: str, feedback: str) -> str:
+        return draft.replace("working on a solution", "currently looking into this issue")
+
+    def stats(self) -> dict:
+        return {"backend": self.name}
+
+class OpenAICompatibleBackend:
+    """Chat completions over one pooled requests.Session, with timeouts and retries on 429/5xx."""
+
+    name = "openai"
+    batch_validation = True
+    RETRY_STATUSES = {408, 409, 429, 500, 502, 503, 504}
+
+    def __init__(self, base_url: str, api_key: Optional[str] = None, model: str = "gpt-4o-mini",
+                 connect_timeout: float = 5.0, read_timeout: float = 60.0, max_retries: int = 3,
+                 backoff: float = 0.5, max_backoff: float = 8.0, pool_size: int = 32, temperature: float = 0.2):
+        self.base_url = base_url.rstrip("/")
+        self.model = model
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.temperature = temperature
+        # Keep-alive connections shared by every agent-io thread instead of one TCP/TLS handshake per call
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        if api_key:
+            self.session.headers["Authorization"] = f"Bearer {api_key}"
+        self._lock = threading.Lock()
+        self.counts = {"requests": 0, "retries": 0, "errors": 0, "prompt_tokens": 0, "completion_tokens": 0}
+
+    def _count(self, **deltas):
+        with self._lock:
+            for key, value in deltas.items():
+                self.counts[key] += value
+
+    def _post(self, payload: dict, stream: bool = False) -> requests.Response:
+        url = f"{self.base_url}/chat/completions"
+        for attempt in range(self.max_retries + 1):
+            retry_after = None
+            self._count(requests=1)
+            try:
+                response = self.session.post(url, json=payload, timeout=self.timeout, stream=stream)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = e
+            else:
+                if response.status_code < 400:
+                    return response
+                error = LLMError(f"LLM endpoint returned {response.status_code}: {response.text[:200]}")
+                retry_after = response.headers.get("Retry-After")
+                response.close()
+                if response.status_code not in self.RETRY_STATUSES:
+                    self._count(errors=1)
+                    raise error
+            if attempt == self.max_retries:
+                self._count(errors=1)
+                raise error
+            self._count(retries=1)
+            delay = min(self.max_backoff, self.backoff * 2 ** attempt) + random.uniform(0, self.backoff)
+            if retry_after:
+                try:
+                    delay = max(delay, float(retry_after))
+                except ValueError:
+                    pass
+            time.sleep(delay)
+
+    def _payload(self, system: str, user: str, **extra) -> dict:
+        return {"model": self.model, "temperature": self.temperature,
+                "messages": [{"role": "system", "content": system}, {"role": "user", "content": user}], **extra}
+
+    def chat(self, system: str, user: str) -> str:
+        data = self._post(self._payload(system, user)).json()
+        usage = data.get("usage") or {}
+        self._count(prompt_tokens=usage.get("prompt_tokens", 0), completion_tokens=usage.get("completion_tokens", 0))
+        return data["choices"][0]["message"]["content"].strip()
+
+    def stream_chat(self, system: str, user: str) -> Iterator[str]:
+        """Yields content deltas from a server-sent-events completion as they arrive."""
+        with self._post(self._payload(system, user, stream=True), stream=True) as response:
+            for line in response.iter_lines(decode_unicode=True):
+                if not line or not line.startswith("data:"):
+                    continue
+                data = line[5:].strip()
+                if data == "[DONE]":
+                    break
+                delta = json.loads(data)["choices"][0].get("delta", {}).get("content")
+                if delta:
+                    self._count(completion_tokens=1)
+                    yield delta
+
+    def generate_draft(self, email: dict, context: Optional[List[str]] = None,
+                       on_token: Optional[Callable[[str], None]] = None) -> str:
+        prompt = build_draft_prompt(email, context)
+        if on_token is None:
+            return self.chat(DRAFT_SYSTEM_PROMPT, prompt)
+        parts = []
+        for token in self.stream_chat(DRAFT_SYSTEM_PROMPT, prompt):
+            on_token(token)
+            parts.append(token)
+        return "".join(parts).strip()
+
+    def validate_draft(self, draft: str) -> bool:
+        return self.chat(VALIDATE_SYSTEM_PROMPT, draft).upper().startswith("PASS")
+
+    def validate_drafts(self, drafts: List[str]) -> List[bool]:
+        if len(drafts) == 1:
+            return [self.validate_draft(drafts[0])]
+        answer = self.chat(VALIDATE_BATCH_SYSTEM_PROMPT, format_draft_batch(drafts))
+        try:
+            verdicts = json.loads(re.search(r"\[.*\]", answer, re.S).group(0))
+            if len(verdicts) == len(drafts):
+                return [bool(v) for v in verdicts]
+        except (AttributeError, ValueError):
+            pass
+        # Unparseable batch answer: fall back to one request per draft
+        return [self.validate_draft(draft) for draft in drafts]
+
+    def rewrite_draft(self, draft: str, feedback: str) -> str:
+        return self.chat(REWRITE_SYSTEM_PROMPT, f"Feedback: {feedback}\n\nDraft:\n{draft}")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"backend": self.name, "model": self.model, **self.counts}
+
+class ValidationBatcher:
+    """Collects validate calls from concurrent threads for up to max_wait_ms and sends them as one request.
+
+    The first caller of a batch waits, then validates everything that arrived meanwhile; later
+    callers just wait for their result. A full batch is sent immediately by the caller that filled it.
+    """
+
+    def __init__(self, validate_many: Callable[[List[str]], List[bool]], max_batch: int = 16, max_wait_ms: float = 20.0):
+        self.validate_many = validate_many
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self._pending = []
+        self._lock = threading.Lock()
+
+    def validate(self, draft: str) -> bool:
+        future, batch = Future(), None
+        with self._lock:
+            self._pending.append((draft, future))
+            leader = len(self._pending) == 1
+            if len(self._pending) >= self.max_batch:
+                batch, self._pending = self._pending, []
+        if batch is None and leader:
+            time.sleep(self.max_wait)
+            with self._lock:
+                if self._pending and self._pending[0][1] is future:
+                    batch, self._pending = self._pending, []
+        if batch:
+            try:
+                verdicts = self.validate_many([d for d, _ in batch])
+                for (_, f), verdict in zip(batch, verdicts):
+                    f.set_result(verdict)
+            except Exception as e:
+                for _, f in batch:
+                    f.set_exception(e)
+        return future.result()
+
+_backend = None
+_validation_batcher = None
+_backend_lock = threading.Lock()
+
+def create_backend():
+    kind = os.getenv("LLM_BACKEND", "placeholder").lower()
+    if kind == "placeholder":
+        return PlaceholderBackend()
+    if kind == "openai":
+        return OpenAICompatibleBackend(
+            base_url=os.getenv("LLM_BASE_URL", "https://api.openai.com/v1"),
+            api_key=os.getenv("LLM_API_KEY") or os.getenv("OPENAI_API_KEY"),
+            model=os.getenv("LLM_MODEL", "gpt-4o-mini"),
+            read_timeout=float(os.getenv("LLM_TIMEOUT", "60")),
+            max_retries=int(os.getenv("LLM_MAX_RETRIES", "3")),
+            pool_size=int(os.getenv("LLM_POOL_SIZE", "32")),
+        )
+    raise ValueError(f"Unknown LLM_BACKEND: {kind}")
+
+def _make_batcher(backend) -> Optional[ValidationBatcher]:
+    if backend is None or not backend.batch_validation:
+        return None
+    return ValidationBatcher(backend.validate_drafts, max_wait_ms=float(os.getenv("LLM_VALIDATE_BATCH_WAIT_MS", "20")))
+
+def get_backend():
+    global _backend, _validation_batcher
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                backend = create_backend()
+                _validation_batcher = _make_batcher(backend)
+                _backend = backend
+    return _backend
+
+def set_backend(backend):
+    """Swaps the process-wide backend (benchmarks, tests). Pass None to re-read LLM_BACKEND."""
+    global _backend, _validation_batcher
+    with _backend_lock:
+        _validation_batcher = _make_batcher(backend)
+        _backend = backend
+
+def get_llm_stats() -> dict:
+    return get_backend().stats()
+
+# --- Public API ---
+def generate_draft(email: dict, context: Optional[List[str]] = None,
+                   on_token: Optional[Callable[[str], None]] = None) -> str:
+    """Uses an LLM to generate a draft email reply, grounded in the retrieved policy chunks if given.
+
+    With on_token, the reply is streamed and each piece is passed to the callback as it arrives.
+    """
+    print("🤖 Generating draft with LLM...")
+    return get_backend().generate_draft(email, context, on_token)
+
+def validate_draft(draft: str) -> bool:
+    """Uses an LLM to validate the draft email for tone, PII, etc."""
+    print("🤖 Validating draft with LLM...")
+    backend = get_backend()
+    # Concurrent workflows share one validation request where the backend supports it
+    if _validation_batcher is not None:
+        return _validation_batcher.validate(draft)
+    return backend.validate_draft(draft)
+
+def validate_drafts(drafts: List[str]) -> List[bool]:
+    """Validates many drafts, in a single LLM request where the backend supports it."""
+    print(f"🤖 Validating {len(drafts)} drafts with LLM...")
+    return get_backend().validate_drafts(drafts) if drafts else []
+
+def rewrite_draft(draft: str, feedback: str) -> str:
+    """Uses an LLM to rewrite the draft based on feedback."""
+    print("🤖 Rewriting draft with LLM...")
+    return get_backend().rewrite_draft(draft, feedback)
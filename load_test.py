@@ -0,0 +1,85 @@
+# load_test.py
+# Checks that /query latency stays flat while email workflows run on the same rag_api worker.
+#
+#   uvicorn rag_api:app --port 8000
+#   python load_test.py --collection airlines_policy --email-workers 4
+import argparse
+import json
+import threading
+import time
+
+import requests
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p * len(values)))] if values else None
+
+def measure_queries(url: str, collection: str, query: str, duration: float, clients: int) -> list:
+    latencies, lock = [], threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def client():
+        session = requests.Session()
+        while time.monotonic() < deadline:
+            start = time.perf_counter()
+            session.post(f"{url}/query", json={"query": query, "collection": collection}).raise_for_status()
+            with lock:
+                latencies.append(time.perf_counter() - start)
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return latencies
+
+def run_email_workers(url: str, workers: int, stop: threading.Event) -> list:
+    runs = []
+
+    def worker():
+        session = requests.Session()
+        while not stop.is_set():
+            start = time.perf_counter()
+            session.post(f"{url}/process-email")
+            runs.append(time.perf_counter() - start)
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(workers)]
+    for t in threads:
+        t.start()
+    return runs
+
+def summarize(latencies: list, duration: float) -> dict:
+    return {
+        "requests": len(latencies),
+        "qps": round(len(latencies) / duration, 1),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 1) if latencies else None,
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 1) if latencies else None,
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--collection", required=True)
+    parser.add_argument("--query", default="Can I receive an invoice for my booked flight?")
+    parser.add_argument("--duration", type=float, default=20.0, help="Seconds per phase")
+    parser.add_argument("--clients", type=int, default=4, help="Concurrent /query clients")
+    parser.add_argument("--email-workers", type=int, default=4, help="Concurrent /process-email callers")
+    args = parser.parse_args()
+
+    print(f"⏱️ Phase 1: /query only ({args.duration}s)...")
+    baseline = measure_queries(args.url, args.collection, args.query, args.duration, args.clients)
+
+    print(f"⏱️ Phase 2: /query with {args.email_workers} email workflows running ({args.duration}s)...")
+    stop = threading.Event()
+    runs = run_email_workers(args.url, args.email_workers, stop)
+    loaded = measure_queries(args.url, args.collection, args.query, args.duration, args.clients)
+    stop.set()
+
+    report = {
+        "query_baseline": summarize(baseline, args.duration),
+        "query_under_email_load": summarize(loaded, args.duration),
+        "email_workflows_completed": len(runs),
+    }
+    if baseline and loaded:
+        report["p99_ratio"] = round(percentile(loaded, 0.99) / percentile(baseline, 0.99), 2)
+    print(json.dumps(report, indent=2))
@@ -1,115 +1,203 @@
-import os
-from typing import TypedDict, Optional
-from langgraph.graph import StateGraph, END
-
-# Assuming these files contain the necessary functions
-import gmail
-import llm_client
-
-# --- LangGraph State Definition ---
-# This defines the data structure that the graph nodes will share and update.
-class EmailState(TypedDict):
-    """Represents the state of the email processing workflow."""
-    email: Optional[dict]
-    draft: Optional[str]
-    validation_status: str
-    error: Optional[str]
-    rewrite_attempts: int
-
-# --- LangGraph Node Definitions ---
-# Each function is a "node" that performs a specific action and updates the state.
-
-def retrieve_node(state: EmailState) -> dict:
-    """Retrieves the latest email and initializes the state."""
-    print("Retrieving the latest email...")
-    email_data = gmail_client.fetch_latest_email()
-    if not email_data:
-        return {"error": "No new emails found."}
-    return {"email": email_data, "validation_status": "pending", "rewrite_attempts": 0}
-
-def draft_node(state: EmailState) -> dict:
-    """Generates an initial draft of the email reply using an LLM."""
-    if state.get("error"):
-        return state
-    print("Drafting reply with the agent...")
-    draft_content = llm_client.generate_draft(state["email"])
-    return {"draft": draft_content}
-
-def validate_node(state: EmailState) -> dict:
-    """Validates the drafted email using an LLM or a rule-based check."""
-    print("Validating the draft...")
-    is_valid = llm_client.validate_draft(state["draft"])
-    return {"validation_status": "valid" if is_valid else "invalid"}
-
-def rewrite_node(state: EmailState) -> dict:
-    """Rewrites the draft based on validation failure feedback."""
-    print("Validation failed, rewriting the draft...")
-    new_draft = llm_client.rewrite_draft(state["draft"], "The previous draft failed validation.")
-    return {"draft": new_draft, "rewrite_attempts": state.get("rewrite_attempts", 0) + 1}
-
-def send_node(state: EmailState) -> dict:
-    """Sends the final, validated email draft."""
-    print("Draft approved. Sending email...")
-    email_info = state["email"]
-    gmail_client.send_email(
-        to=email_info["from"],
-        subject=f"Re: {email_info['subject']}",
-        body=state["draft"]
-    )
-    return {"status": "Email sent successfully."}
-
-# --- LangGraph Conditional Logic ---
-# This function determines the next node based on the current state.
-def should_continue(state: EmailState) -> str:
-    """Decides the next step in the workflow based on the state."""
-    if state.get("error"):
-        return END  # Terminate on error
-    if state["validation_status"] == "valid":
-        return "send"
-    if state["rewrite_attempts"] >= 2:
-        return "escalate" # End the workflow if max rewrites are reached
-    return "rewrite"
-
-# --- Graph Definition and Compilation ---
-# 1. Create the graph
-workflow = StateGraph(EmailState)
-
-# 2. Add nodes to the graph
-workflow.add_node("retrieve", retrieve_node)
-workflow.add_node("draft", draft_node)
-workflow.add_node("validate", validate_node)
-workflow.add_node("rewrite", rewrite_node)
-workflow.add_node("send", send_node)
-
-# 3. Define the graph's structure
-workflow.set_entry_point("retrieve")
-workflow.add_edge("retrieve", "draft")
-workflow.add_edge("draft", "validate")
-workflow.add_edge("rewrite", "validate")
-workflow.add_edge("send", END)
-
-# 4. Add conditional routing from the 'validate' node
-workflow.add_conditional_edges(
-    "validate",
-    should_continue,
-    {"send": "send", "rewrite": "rewrite", "escalate": END}
-)
-
-# 5. Compile the graph into a runnable application
-email_agent_app = workflow.compile()
-
-# --- Main Execution Block ---
-if __name__ == "__main__":
-    print("Starting the email agent workflow...")
-    # Invoke the graph with an initial state
-    final_state = email_agent_app.invoke({})
-    
-    print("\n--- Workflow Summary ---")
-    if final_state.get("error"):
-        print(f"Workflow failed: {final_state['error']}")
-    else:
-        print(f"Status: {final_state.get('status', 'Completed')}")
-        if final_state.get("draft"):
-            print(f"Final Draft: \n---\n{final_state['draft']}\n---")
-    print("\n--- Final State ---")
+import os
+import uuid
+from typing import TypedDict, Optional
+from langgraph.graph import StateGraph, END
+
+# Assuming these files contain the necessary functions
+import gmail as gmail_client
+import llm_client
+from prevalidation import prevalidate
+from metrics import instrument_node
+from ledger import MessageLedger, LEDGER_DB, TERMINAL_STAGES
+from send_queue import is_retriable, is_throttled
+
+# Same ledger as rag_api.py: messages stay unread until their reply is sent, and a claim keeps
+# the CLI and the API off the same message
+ledger = MessageLedger(os.getenv("MESSAGE_LEDGER_DB", LEDGER_DB))
+CLAIM_CANDIDATES = 20
+MAX_SEND_ATTEMPTS = int(os.getenv("MAX_SEND_ATTEMPTS", "3"))
+
+# --- LangGraph State Definition ---
+# This defines the data structure that the graph nodes will share and update.
+class EmailState(TypedDict):
+    """Represents the state of the email processing workflow."""
+    email: Optional[dict]
+    draft: Optional[str]
+    validation_status: str
+    error: Optional[str]
+    rewrite_attempts: int
+    status: Optional[str]
+    feedback: Optional[str]
+    owner: Optional[str]
+    escalation: Optional[str]
+
+# --- LangGraph Node Definitions ---
+# Each function is a "node" that performs a specific action and updates the state.
+
+def claim_next_unread(owner: str) -> Optional[dict]:
+    """The newest unread email that no other run is working on, claimed in the ledger for owner."""
+    ids, _ = gmail_client.list_unread_message_ids(max_results=CLAIM_CANDIDATES)
+    for message_id in ids:
+        if ledger.claim(message_id, owner):
+            return gmail_client.fetch_email(message_id)
+    return None
+
+def retrieve_node(state: EmailState) -> dict:
+    """Retrieves and claims the latest email and initializes the state."""
+    owner = state["owner"]
+    email_data = state.get("email")
+    if not email_data:
+        print("Retrieving the latest email...")
+        # Not marked read here: if the run dies before sending, the email is picked up again
+        email_data = claim_next_unread(owner)
+        if not email_data:
+            return {"error": "No new emails found."}
+    elif not ledger.claim(email_data["id"], owner):
+        # Email was pre-fetched (e.g. by a batch drain) but another run is on it
+        return {"error": "Already being processed by another run."}
+
+    entry = ledger.get(email_data["id"])
+    update = {"email": email_data, "validation_status": "pending", "rewrite_attempts": 0}
+    if entry["stage"] in TERMINAL_STAGES:
+        gmail_client.mark_as_read([email_data["id"]])
+        update["status"] = f"Already {entry['stage']}, skipped."
+    elif entry["stage"] == "sending":
+        update["escalation"] = "An earlier send never reported back; the reply may already have been delivered."
+    elif entry["stage"] == "send_failed" and entry["send_attempts"] >= MAX_SEND_ATTEMPTS:
+        update["escalation"] = f"Sending the reply failed {entry['send_attempts']} times."
+    else:
+        ledger.record(email_data["id"], "fetched", email=email_data)
+    return update
+
+def draft_node(state: EmailState) -> dict:
+    """Generates an initial draft of the email reply using an LLM."""
+    if state.get("error"):
+        return state
+    print("Drafting reply with the agent...")
+    draft_content = llm_client.generate_draft(state["email"])
+    ledger.record(state["email"]["id"], "drafted", draft=draft_content)
+    return {"draft": draft_content}
+
+def validate_node(state: EmailState) -> dict:
+    """Validates the drafted email using an LLM or a rule-based check."""
+    print("Validating the draft...")
+    # Cheap local rules first; only borderline drafts are sent to the LLM
+    check = prevalidate(state["draft"])
+    if check["verdict"] == "fail":
+        return {"validation_status": "invalid", "feedback": check["feedback"]}
+    is_valid = check["verdict"] == "pass" or llm_client.validate_draft(state["draft"])
+    return {"validation_status": "valid" if is_valid else "invalid", "feedback": None}
+
+def rewrite_node(state: EmailState) -> dict:
+    """Rewrites the draft based on validation failure feedback."""
+    print("Validation failed, rewriting the draft...")
+    feedback = state.get("feedback") or "The previous draft failed validation."
+    new_draft = llm_client.rewrite_draft(state["draft"], feedback)
+    return {"draft": new_draft, "rewrite_attempts": state.get("rewrite_attempts", 0) + 1}
+
+def send_node(state: EmailState) -> dict:
+    """Sends the final, validated email draft."""
+    print("Draft approved. Sending email...")
+    email_info = state["email"]
+    # "sending" while Gmail has the reply: a run resuming after a crash escalates instead of resending
+    attempt = ledger.start_send(email_info["id"])
+    try:
+        gmail_client.send_email(
+            to=email_info["from"],
+            subject=f"Re: {email_info['subject']}",
+            body=state["draft"]
+        )
+    except Exception as e:
+        if is_retriable(e) and not is_throttled(e):
+            return {"escalation": f"Delivery unknown, not resending: {e}"}
+        ledger.record(email_info["id"], "send_failed")
+        if attempt >= MAX_SEND_ATTEMPTS:
+            return {"escalation": f"Sending the reply failed {attempt} times: {e}"}
+        return {"error": f"Send failed (attempt {attempt} of {MAX_SEND_ATTEMPTS}): {e}"}
+    ledger.record(email_info["id"], "sent")
+    gmail_client.mark_as_read([email_info["id"]])
+    return {"status": "Email sent successfully."}
+
+def escalate_node(state: EmailState) -> dict:
+    """Leaves the email to a human: recorded as escalated and marked read so it is not drafted again."""
+    message_id = state["email"]["id"]
+    print(f"Escalating email {message_id}: {state.get('escalation') or 'draft failed validation after max rewrites'}")
+    ledger.record(message_id, "escalated")
+    gmail_client.mark_as_read([message_id])
+    return {}
+
+# --- LangGraph Conditional Logic ---
+# These functions determine the next node based on the current state.
+def after_retrieve(state: EmailState) -> str:
+    if state.get("error") or state.get("status"):
+        return END
+    if state.get("escalation"):
+        return "escalate"
+    return "draft"
+
+def after_send(state: EmailState) -> str:
+    return "escalate" if state.get("escalation") else END
+
+def should_continue(state: EmailState) -> str:
+    """Decides the next step in the workflow based on the state."""
+    if state.get("error"):
+        return END  # Terminate on error
+    if state["validation_status"] == "valid":
+        return "send"
+    if state["rewrite_attempts"] >= 2:
+        return "escalate" # End the workflow if max rewrites are reached
+    return "rewrite"
+
+# --- Graph Definition and Compilation ---
+# 1. Create the graph
+workflow = StateGraph(EmailState)
+
+# 2. Add nodes to the graph (each one timed, see metrics.py)
+workflow.add_node("retrieve", instrument_node("retrieve", retrieve_node))
+workflow.add_node("draft", instrument_node("draft", draft_node))
+workflow.add_node("validate", instrument_node("validate", validate_node))
+workflow.add_node("rewrite", instrument_node("rewrite", rewrite_node))
+workflow.add_node("send", instrument_node("send", send_node))
+workflow.add_node("escalate", instrument_node("escalate", escalate_node))
+
+# 3. Define the graph's structure
+workflow.set_entry_point("retrieve")
+workflow.add_conditional_edges("retrieve", after_retrieve, {"draft": "draft", "escalate": "escalate", END: END})
+workflow.add_edge("draft", "validate")
+workflow.add_edge("rewrite", "validate")
+workflow.add_conditional_edges("send", after_send, {"escalate": "escalate", END: END})
+workflow.add_edge("escalate", END)
+
+# 4. Add conditional routing from the 'validate' node
+workflow.add_conditional_edges(
+    "validate",
+    should_continue,
+    {"send": "send", "rewrite": "rewrite", "escalate": "escalate", END: END}
+)
+
+# 5. Compile the graph into a runnable application
+email_agent_app = workflow.compile()
+
+def run_once(initial: Optional[dict] = None) -> dict:
+    """Runs the graph for one email; the ledger claim it takes is released however the run ends."""
+    owner = uuid.uuid4().hex
+    try:
+        return email_agent_app.invoke({**(initial or {}), "owner": owner})
+    finally:
+        ledger.release(owner)
+
+# --- Main Execution Block ---
+if __name__ == "__main__":
+    print("Starting the email agent workflow...")
+    # Invoke the graph with an initial state
+    final_state = run_once()
+    
+    print("\n--- Workflow Summary ---")
+    if final_state.get("error"):
+        print(f"Workflow failed: {final_state['error']}")
+    else:
+        print(f"Status: {final_state.get('status', 'Completed')}")
+        if final_state.get("draft"):
+            print(f"Final Draft: \n---\n{final_state['draft']}\n---")
+    print("\n--- Final State ---")
     print(final_state)
\ No newline at end of file
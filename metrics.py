@@ -0,0 +1,213 @@
+# metrics.py
+# In-process counters and latency histograms with Prometheus text rendering (no client library
+# needed), plus helpers to time LangGraph nodes, Gmail calls, embedding and Chroma operations.
+import asyncio
+import functools
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+RESERVOIR_SIZE = 2048  # recent samples per label set, for exact-ish p50/p99
+
+_registry = []
+_registry_lock = threading.Lock()
+
+def _label_text(labelnames: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{name}="{value}"' for name, value in zip(labelnames, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+def _percentile(values: list, p: float) -> Optional[float]:
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p * len(values)))]
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labelnames: Iterable[str] = ()):
+        self.name, self.help, self.labelnames = name, help_text, tuple(labelnames)
+        self._values: Dict[tuple, float] = {}
+        self._lock = threading.Lock()
+        with _registry_lock:
+            _registry.append(self)
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_label_text(self.labelnames, key)} {value:g}")
+        return lines
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {",".join(key) or "total": value for key, value in sorted(self._values.items())}
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, labelnames: Iterable[str] = (), buckets: Tuple[float, ...] = LATENCY_BUCKETS,
+                 seconds: bool = True):
+        self.name, self.help, self.labelnames, self.buckets = name, help_text, tuple(labelnames), buckets
+        self.seconds = seconds  # latency histograms are summarized in milliseconds, others as raw values
+        self._series: Dict[tuple, dict] = {}
+        self._lock = threading.Lock()
+        with _registry_lock:
+            _registry.append(self)
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0,
+                                              "recent": deque(maxlen=RESERVOIR_SIZE)}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series["counts"][i] += 1
+                    break
+            series["sum"] += value
+            series["count"] += 1
+            series["recent"].append(value)
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                cumulative = 0
+                labels = _label_text(self.labelnames, key)
+                for bound, count in zip(self.buckets, series["counts"]):
+                    cumulative += count
+                    bucket_labels = _label_text(self.labelnames, key, 'le="%g"' % bound)
+                    lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+                bucket_labels = _label_text(self.labelnames, key, 'le="+Inf"')
+                lines.append(f"{self.name}_bucket{bucket_labels} {series['count']}")
+                lines.append(f"{self.name}_sum{labels} {series['sum']:.6f}")
+                lines.append(f"{self.name}_count{labels} {series['count']}")
+        return lines
+
+    def snapshot(self) -> dict:
+        """{label values: {count, p50_ms, p99_ms, mean_ms}} over the recent samples (p50/p99/mean if not a latency)."""
+        scale, suffix = (1000, "_ms") if self.seconds else (1, "")
+        out = {}
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                recent = list(series["recent"])
+                out[",".join(key) or "total"] = {
+                    "count": series["count"],
+                    "p50" + suffix: round(_percentile(recent, 0.50) * scale, 2) if recent else None,
+                    "p99" + suffix: round(_percentile(recent, 0.99) * scale, 2) if recent else None,
+                    "mean" + suffix: round(series["sum"] / series["count"] * scale, 2) if series["count"] else None,
+                }
+        return out
+
+    def reset(self):
+        with self._lock:
+            self._series.clear()
+
+def render_prometheus(gauges: Optional[Dict[str, float]] = None) -> str:
+    """All registered metrics in the Prometheus text format, plus ad-hoc gauges ({name: value})."""
+    with _registry_lock:
+        metrics = list(_registry)
+    lines = []
+    for metric in metrics:
+        lines.extend(metric.render())
+    for name, value in sorted((gauges or {}).items()):
+        if value is None:
+            continue
+        lines.append(f"# TYPE {name} gauge")
+        lines.append(f"{name} {float(value):g}")
+    return "\n".join(lines) + "\n"
+
+def snapshot() -> dict:
+    with _registry_lock:
+        metrics = list(_registry)
+    return {metric.name: metric.snapshot() for metric in metrics}
+
+def reset():
+    """Clears every recorded value, e.g. between the phases of a benchmark."""
+    with _registry_lock:
+        metrics = list(_registry)
+    for metric in metrics:
+        metric.reset()
+
+# --- Metrics shared across modules ---
+NODE_SECONDS = Histogram("agent_node_seconds", "Time spent in each LangGraph node.", ["node"])
+NODE_ERRORS = Counter("agent_node_errors_total", "LangGraph node invocations that raised.", ["node"])
+WORKFLOW_SECONDS = Histogram("agent_workflow_seconds", "End-to-end time of one email workflow run.", ["outcome"])
+REWRITES = Histogram("agent_rewrites_per_email", "Rewrite-loop iterations per processed email.", [],
+                     buckets=(0, 1, 2, 3, 5), seconds=False)
+GMAIL_SECONDS = Histogram("gmail_call_seconds", "Gmail API helper latency.", ["op"])
+GMAIL_ERRORS = Counter("gmail_call_errors_total", "Gmail API helper calls that raised.", ["op"])
+EMBED_SECONDS = Histogram("embedding_encode_seconds", "Embedding model encode() latency.", ["model"])
+EMBED_TEXTS = Counter("embedding_texts_total", "Texts run through the embedding model.", ["model"])
+CHROMA_SECONDS = Histogram("chroma_op_seconds", "Chroma collection operation latency.", ["op"])
+
+# --- Instrumentation helpers ---
+def instrument_node(name: str, fn: Callable) -> Callable:
+    """Wraps a LangGraph node: records its latency and, if the run carries a `trace` list, appends a span."""
+
+    def finish(state: dict, update, start: float, wall: float):
+        elapsed = time.perf_counter() - start
+        NODE_SECONDS.observe(elapsed, node=name)
+        if state.get("trace") is not None:
+            update = {**(update or {}), "trace": [{"node": name, "start": round(wall, 6), "ms": round(elapsed * 1000, 3)}]}
+        return update
+
+    if asyncio.iscoroutinefunction(fn):
+        @functools.wraps(fn)
+        async def async_wrapper(state):
+            start, wall = time.perf_counter(), time.time()
+            try:
+                update = await fn(state)
+            except Exception:
+                NODE_ERRORS.inc(node=name)
+                raise
+            return finish(state, update, start, wall)
+        return async_wrapper
+
+    @functools.wraps(fn)
+    def wrapper(state):
+        start, wall = time.perf_counter(), time.time()
+        try:
+            update = fn(state)
+        except Exception:
+            NODE_ERRORS.inc(node=name)
+            raise
+        return finish(state, update, start, wall)
+    return wrapper
+
+def timed_call(histogram: Histogram, errors: Optional[Counter] = None, **labels):
+    """Decorator: times every call of the function into histogram (and counts exceptions)."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            except Exception:
+                if errors is not None:
+                    errors.inc(**labels)
+                raise
+            finally:
+                histogram.observe(time.perf_counter() - start, **labels)
+        return wrapper
+    return decorator
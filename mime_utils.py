@@ -0,0 +1,87 @@
+# mime_utils.py
+# Single-pass body extraction for Gmail API message payloads.
+import base64
+import html
+import re
+from typing import Iterator, Optional
+
+# Only this many characters of an HTML body are converted to text; marketing mail can be megabytes
+HTML_TEXT_CAP = 200_000
+
+_DROP_RE = re.compile(r"<(script|style|head|title)\b.*?</\1\s*>", re.I | re.S)
+_COMMENT_RE = re.compile(r"<!--.*?-->", re.S)
+_BLOCK_RE = re.compile(r"<\s*/?\s*(?:br|p|div|tr|li|h[1-6]|table|blockquote)\b[^>]*>", re.I)
+_TAG_RE = re.compile(r"<[^>]*>")
+_SPACES_RE = re.compile(r"[ \t\r\f\v\xa0]+")
+_BLANK_LINES_RE = re.compile(r"\n\s*\n+")
+_CHARSET_RE = re.compile(r'charset="?([\w.:-]+)', re.I)
+
+def _header(part: dict, name: str) -> str:
+    name = name.lower()
+    return next((h["value"] for h in part.get("headers", []) if h["name"].lower() == name), "")
+
+def is_attachment(part: dict) -> bool:
+    body = part.get("body", {})
+    return bool(part.get("filename")) or "attachmentId" in body or \
+        _header(part, "Content-Disposition").lower().startswith("attachment")
+
+def iter_leaf_parts(payload: dict) -> Iterator[dict]:
+    """Yields the non-multipart parts of a payload depth-first, skipping attachments without decoding them."""
+    stack = [payload]
+    while stack:
+        part = stack.pop()
+        children = part.get("parts")
+        if children:
+            stack.extend(reversed(children))
+        elif not is_attachment(part):
+            yield part
+
+def decode_part(part: dict, max_chars: Optional[int] = None) -> str:
+    """Decodes a part's base64url body. With max_chars, only the needed prefix of the data is decoded."""
+    data = part.get("body", {}).get("data")
+    if not data:
+        return ""
+    if max_chars is not None:
+        # 4 base64 characters encode 3 bytes; a UTF-8 character is at most 4 bytes
+        data = data[:((max_chars * 4) // 3 + 1) * 4]
+    charset_match = _CHARSET_RE.search(_header(part, "Content-Type"))
+    charset = charset_match.group(1) if charset_match else "utf-8"
+    raw = base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+    try:
+        return raw.decode(charset, errors="ignore")
+    except LookupError:
+        return raw.decode("utf-8", errors="ignore")
+
+def html_to_text(raw_html: str, max_chars: int = HTML_TEXT_CAP) -> str:
+    """Regex-based HTML to text conversion. No DOM is built, and input beyond max_chars is ignored."""
+    text = raw_html[:max_chars]
+    text = _DROP_RE.sub("", text)
+    text = _COMMENT_RE.sub("", text)
+    text = _BLOCK_RE.sub("\n", text)
+    text = _TAG_RE.sub("", text)
+    text = html.unescape(text)
+    text = _SPACES_RE.sub(" ", text)
+    text = "\n".join(line.strip() for line in text.split("\n"))
+    return _BLANK_LINES_RE.sub("\n\n", text).strip()
+
+def looks_like_html(text: str) -> bool:
+    head = text[:1024].lower()
+    return "<html" in head or "<!doctype html" in head
+
+def extract_body(payload: dict, max_html_chars: int = HTML_TEXT_CAP) -> str:
+    """Returns the readable body of a message payload.
+
+    Walks nested multipart trees once, prefers text/plain over text/html and only decodes
+    the part that is finally used.
+    """
+    html_part = None
+    for part in iter_leaf_parts(payload):
+        mime_type = part.get("mimeType", "")
+        if mime_type == "text/plain" and part.get("body", {}).get("data"):
+            text = decode_part(part)
+            return html_to_text(text, max_html_chars) if looks_like_html(text) else text.strip()
+        if mime_type == "text/html" and html_part is None and part.get("body", {}).get("data"):
+            html_part = part
+    if html_part is not None:
+        return html_to_text(decode_part(html_part, max_chars=max_html_chars), max_html_chars)
+    return ""
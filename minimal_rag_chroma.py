@@ -1,116 +1,213 @@
-# minimal_rag_chroma.py
-import os
-import argparse
-import time
-import chromadb
-from sentence_transformers import SentenceTransformer
-from watchdog.observers import Observer
-from watchdog.events import FileSystemEventHandler
-
-# --- Embedding model ---
-embedder = SentenceTransformer("all-MiniLM-L6-v2")
-
-# --- File loader ---
-def file_to_text(file_path: str) -> str:
-    ext = os.path.splitext(file_path)[1].lower()
-
-    if ext == ".pdf":
-        import fitz  # PyMuPDF
-        doc = fitz.open(file_path)
-        text = ""
-        for page in doc:
-            text += page.get_text()
-        return text
-
-    elif ext in [".md", ".txt"]:
-        with open(file_path, "r", encoding="utf-8") as f:
-            return f.read()
-
-    else:
-        raise ValueError(f"Unsupported file type: {ext}")
-
-# --- Chunk text ---
-def chunk_text(text: str, chunk_size: int = 500, overlap: int = 50):
-    words = text.split()
-    chunks, start = [], 0
-    while start < len(words):
-        end = min(start + chunk_size, len(words))
-        chunks.append(" ".join(words[start:end]))
-        start += chunk_size - overlap
-    return chunks
-
-# --- Index file into Chroma ---
-def index_file(collection_name: str, file_path: str):
-    if not os.path.exists(file_path):
-        print(f"❌ File not found: {file_path}")
-        return
-
-    text = file_to_text(file_path)
-    chunks = chunk_text(text)
-
-    client = chromadb.PersistentClient(path="chroma_db")
-    collection = client.get_or_create_collection(name=collection_name)
-
-    embeddings = embedder.encode(chunks).tolist()
-    ids = [f"{os.path.basename(file_path)}_{i}" for i in range(len(chunks))]
-
-    # Remove old docs with same prefix
-    try:
-        collection.delete(ids=ids)
-    except Exception:
-        pass
-
-    collection.add(documents=chunks, embeddings=embeddings, ids=ids)
-    print(f"✅ Indexed {len(chunks)} chunks from {file_path} into collection '{collection_name}'.")
-
-# --- Query Chroma ---
-def query_collection(collection_name: str, query: str, top_k: int = 5):
-    client = chromadb.PersistentClient(path="chroma_db")
-    collection = client.get_or_create_collection(name=collection_name)
-
-    q_emb = embedder.encode([query]).tolist()
-    results = collection.query(query_embeddings=q_emb, n_results=top_k)
-
-    print("\n🔎 Query Results:")
-    for i, doc in enumerate(results["documents"][0]):
-        print(f"\nResult {i+1}: {doc}")
-
-# --- Watchdog for auto-reindex ---
-class FileChangeHandler(FileSystemEventHandler):
-    def __init__(self, collection_name, file_path):
-        self.collection_name = collection_name
-        self.file_path = file_path
-
-    def on_modified(self, event):
-        if event.src_path.replace("/", "\\") == self.file_path.replace("/", "\\"):
-            print(f"\n🔄 Detected change in {self.file_path}, re-indexing...")
-            index_file(self.collection_name, self.file_path)
-
-# --- Main ---
-if __name__ == "__main__":
-    parser = argparse.ArgumentParser()
-    parser.add_argument("--index", type=str, help="Path to file (PDF/MD/TXT) to index")
-    parser.add_argument("--query", type=str, help="Query to ask")
-    parser.add_argument("--collection", type=str, required=True, help="Collection name")
-    parser.add_argument("--topk", type=int, default=5, help="Number of results")
-    parser.add_argument("--watch", action="store_true", help="Watch file for changes")
-    args = parser.parse_args()
-
-    if args.index:
-        index_file(args.collection, args.index)
-
-    if args.query:
-        query_collection(args.collection, args.query, args.topk)
-
-    if args.watch and args.index:
-        event_handler = FileChangeHandler(args.collection, args.index)
-        observer = Observer()
-        observer.schedule(event_handler, path=os.path.dirname(args.index) or ".", recursive=False)
-        observer.start()
-        print(f"👀 Watching {args.index} for changes. Press Ctrl+C to stop.")
-        try:
-            while True:
-                time.sleep(1)
-        except KeyboardInterrupt:
-            observer.stop()
-        observer.join()
+# minimal_rag_chroma.py
+import os
+import argparse
+import json
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import groupby
+
+from embedding_cache import CachedEmbedder, EmbeddingCache
+from indexing import index_document_stream, remove_document, max_chroma_batch_size
+from document_loader import (iter_file_lines, iter_text_lines, find_documents, source_name,
+                             pdf_page_count, extract_pages, PDF_PAGES_PER_TASK)
+from chunking import iter_chunks
+from keyword_index import KeywordIndex, reciprocal_rank_fusion, normalize_where
+from watch_service import WatchService
+from resources import EMBEDDING_MODEL, LazyEmbedder, get_chroma_client, embedding_cache_key
+
+# --- Embedding model ---
+# Loaded on first encode(), so runs that do not embed (and --index-dir worker processes,
+# which re-import this module) never pay for torch and the model
+embedder = LazyEmbedder(EMBEDDING_MODEL)
+cached_embedder = CachedEmbedder(embedder, embedding_cache_key(), EmbeddingCache())
+# BM25 index kept in sync with the Chroma collections, for --mode keyword/hybrid
+keyword_index = KeywordIndex()
+
+# --- Index file into Chroma ---
+def index_file(collection_name: str, file_path: str, root: str = None):
+    if not os.path.exists(file_path):
+        print(f"❌ File not found: {file_path}")
+        return
+
+    client = get_chroma_client()
+    collection = client.get_or_create_collection(name=collection_name)
+
+    # Streamed: read and chunked incrementally while earlier chunks are embedded and written.
+    # Unchanged chunks keep their content-hash IDs; only new/changed ones are embedded, stale ones deleted
+    stats = index_document_stream(collection, source_name(file_path, root), iter_chunks(iter_file_lines(file_path)),
+                                  cached_embedder, write_batch_size=max_chroma_batch_size(client), keyword_index=keyword_index)
+    print(f"✅ Indexed {stats['total']} chunks from {file_path} into collection '{collection_name}' "
+          f"({stats['chunks']} embedded, {stats['unchanged']} unchanged, {stats['deleted']} removed).")
+
+# --- Index a whole folder into Chroma ---
+def _extraction_tasks(paths):
+    """(path, page range) per PDF_PAGES_PER_TASK pages of each PDF, (path, None) for a text file."""
+    for path in paths:
+        if not path.lower().endswith(".pdf"):
+            yield path, None
+            continue
+        try:
+            pages = pdf_page_count(path)
+        except Exception:
+            # Let the worker fail on it, so the error is reported with the file like any other
+            yield path, (0, None)
+            continue
+        for start in range(0, max(pages, 1), PDF_PAGES_PER_TASK):
+            yield path, (start, min(start + PDF_PAGES_PER_TASK, pages))
+
+def _prefetch(pool, tasks, window: int):
+    """Yields (path, future or None) in task order, with at most `window` page ranges in flight."""
+    in_flight = deque()
+    for path, pages in tasks:
+        in_flight.append((path, pool.submit(extract_pages, path, *pages) if pages else None))
+        if len(in_flight) >= window:
+            yield in_flight.popleft()
+    while in_flight:
+        yield in_flight.popleft()
+
+def index_directory(collection_name: str, root: str, workers: int = None, docs_root: str = None):
+    paths = find_documents(root)
+    if not paths:
+        print(f"❌ No PDF/MD/TXT files found under {root}")
+        return
+
+    client = get_chroma_client()
+    collection = client.get_or_create_collection(name=collection_name)
+    write_batch_size = max_chroma_batch_size(client)
+    workers = workers or os.cpu_count() or 1
+
+    start = time.perf_counter()
+    totals = {"files": 0, "failed": 0, "chunks": 0, "embedded": 0}
+    # PDF parsing runs in worker processes, a few pages per task, and its page text streams back in
+    # order into chunking and embedding here, so all files share one model instance and one
+    # embedding cache. Only about 2 x workers page ranges are extracted ahead of the indexer.
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        stream = _prefetch(pool, _extraction_tasks(paths), window=2 * workers)
+        for done, (path, parts) in enumerate(groupby(stream, key=lambda item: item[0]), start=1):
+            extract_seconds = [0.0]
+
+            def lines(parts=parts, extract_seconds=extract_seconds):
+                for _, future in parts:
+                    if future is None:
+                        yield from iter_file_lines(path)
+                        continue
+                    texts, seconds = future.result()
+                    extract_seconds[0] += seconds
+                    for text in texts:
+                        yield from iter_text_lines(text)
+
+            try:
+                stats = index_document_stream(collection, source_name(path, docs_root), iter_chunks(lines()), cached_embedder,
+                                              write_batch_size=write_batch_size, keyword_index=keyword_index)
+            except Exception as e:
+                totals["failed"] += 1
+                print(f"[{done}/{len(paths)}] ❌ {path}: {e}")
+                continue
+            totals["files"] += 1
+            totals["chunks"] += stats["total"]
+            totals["embedded"] += stats["chunks"]
+            print(f"[{done}/{len(paths)}] ✅ {path}: {stats['total']} chunks ({stats['chunks']} embedded), "
+                  f"extract {extract_seconds[0]:.2f}s, total {stats['seconds']:.2f}s")
+
+    elapsed = time.perf_counter() - start
+    print(f"\n📊 Indexed {totals['files']} files ({totals['failed']} failed) into '{collection_name}' in {elapsed:.1f}s: "
+          f"{totals['chunks']} chunks, {totals['embedded']} embedded, "
+          f"{totals['files'] / elapsed:.1f} files/s, {totals['chunks'] / elapsed:.1f} chunks/s")
+
+# --- Query Chroma ---
+def query_collection(collection_name: str, query: str, top_k: int = 5, mode: str = "dense", where: dict = None):
+    # Optional Chroma-style metadata filter, e.g. {"section": "Invoice Questions"}; applied before ranking
+    where = normalize_where(where)
+    if mode == "keyword":
+        hits = keyword_index.search(collection_name, query, top_k, where=where)
+        results = [(hit["document"], hit["metadata"]) for hit in hits]
+    else:
+        client = get_chroma_client()
+        if collection_name not in [c if isinstance(c, str) else c.name for c in client.list_collections()]:
+            print(f"❌ Collection not found: {collection_name}")
+            return
+        collection = client.get_collection(name=collection_name)
+
+        q_emb = embedder.encode([query]).tolist()
+        n_results = top_k * 2 if mode == "hybrid" else top_k
+        dense = collection.query(query_embeddings=q_emb, n_results=n_results, **({"where": where} if where else {}))
+        results = list(zip(dense["documents"][0], dense["metadatas"][0]))
+
+        if mode == "hybrid":
+            # Exact terms (fare codes, flight numbers, amounts) come from BM25, paraphrases from the vectors
+            hits = keyword_index.search(collection_name, query, top_k * 2, where=where)
+            by_id = dict(zip(dense["ids"][0], results))
+            by_id.update({hit["id"]: (hit["document"], hit["metadata"]) for hit in hits})
+            fused = reciprocal_rank_fusion([dense["ids"][0], [hit["id"] for hit in hits]])
+            results = [by_id[doc_id] for doc_id, _ in fused[:top_k]]
+
+    print("\n🔎 Query Results:")
+    for i, (doc, metadata) in enumerate(results):
+        metadata = metadata or {}
+        location = " | ".join(str(metadata[key]) for key in ("source", "heading_path") if metadata.get(key))
+        if metadata.get("qa_start") is not None:
+            location += f" | Q{metadata['qa_start']}" + (f"-{metadata['qa_end']}" if metadata.get("qa_end") != metadata["qa_start"] else "")
+        print(f"\nResult {i+1}" + (f" [{location}]" if location else "") + f": {doc}")
+
+# --- Watch mode: continuous reindexing ---
+def remove_file(collection_name: str, file_path: str, root: str = None):
+    client = get_chroma_client()
+    collection = client.get_or_create_collection(name=collection_name)
+    removed = remove_document(collection, source_name(file_path, root),
+                              write_batch_size=max_chroma_batch_size(client), keyword_index=keyword_index)
+    print(f"🗑️ Removed {removed} chunks of deleted file {file_path} from collection '{collection_name}'.")
+
+def watch(collection_name: str, file_path: str = None, root: str = None, debounce: float = 1.0, docs_root: str = None):
+    """Keeps the collection in sync with a file or a whole folder until Ctrl+C."""
+    # Same source keys as index_file / index_directory, so edits replace the chunks indexed above
+    service = WatchService(
+        on_index=lambda path: index_file(collection_name, path, docs_root),
+        on_delete=lambda path: remove_file(collection_name, path, docs_root),
+        debounce=debounce,
+    )
+    if root:
+        service.watch_directory(root)
+    if file_path:
+        service.watch_file(file_path)
+    service.start()
+    print(f"👀 Watching {root or file_path} for changes. Press Ctrl+C to stop.")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.stop()
+        print(f"📊 Watch stats: {service.stats()}")
+
+# --- Main ---
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--index", type=str, help="Path to file (PDF/MD/TXT) to index")
+    parser.add_argument("--index-dir", type=str, help="Folder to index recursively (PDF/MD/TXT)")
+    parser.add_argument("--root", type=str, default=None,
+                        help="Documents root; sources are stored relative to it (default: current directory)")
+    parser.add_argument("--workers", type=int, default=None, help="Extraction processes for --index-dir (default: CPU count)")
+    parser.add_argument("--query", type=str, help="Query to ask")
+    parser.add_argument("--collection", type=str, required=True, help="Collection name")
+    parser.add_argument("--topk", type=int, default=5, help="Number of results")
+    parser.add_argument("--mode", choices=["dense", "keyword", "hybrid"], default="dense",
+                        help="Retrieval mode: vector search, BM25 keyword search, or both fused")
+    parser.add_argument("--where", type=json.loads, default=None,
+                        help='Metadata filter as JSON, e.g. \'{"section": "Invoice Questions"}\' or \'{"qa_start": {"$lte": 3}}\'')
+    parser.add_argument("--watch", action="store_true", help="Keep reindexing the --index file or --index-dir folder as it changes")
+    parser.add_argument("--debounce", type=float, default=1.0, help="Seconds of quiet before a changed file is reindexed")
+    args = parser.parse_args()
+
+    if args.index:
+        index_file(args.collection, args.index, args.root)
+
+    if args.index_dir:
+        index_directory(args.collection, args.index_dir, args.workers, args.root)
+
+    if args.query:
+        query_collection(args.collection, args.query, args.topk, args.mode, args.where)
+
+    if args.watch and (args.index or args.index_dir):
+        watch(args.collection, file_path=args.index, root=args.index_dir, debounce=args.debounce, docs_root=args.root)
@@ -0,0 +1,140 @@
+# mock_llm_server.py
+# Deterministic OpenAI-compatible chat completions server, so the agent workflow can be
+# load-tested offline with realistic LLM latency:
+#
+#   python mock_llm_server.py --port 8001 --latency-ms 300 --tokens-per-sec 80
+#   LLM_BACKEND=openai LLM_BASE_URL=http://localhost:8001/v1 uvicorn rag_api:app --port 8000
+#
+# The same prompt always gets the same answer: validation verdicts are derived from a hash of
+# the draft, and a rewrite always passes validation.
+import argparse
+import hashlib
+import json
+import random
+import re
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from llm_client import (DRAFT_SYSTEM_PROMPT, VALIDATE_SYSTEM_PROMPT, VALIDATE_BATCH_SYSTEM_PROMPT,
+                        REWRITE_SYSTEM_PROMPT)
+
+REVISED_MARKER = "Kind regards,"
+
+def _stable_fraction(text: str) -> float:
+    return int(hashlib.sha256(text.encode("utf-8")).hexdigest()[:8], 16) / 0xFFFFFFFF
+
+def _passes(draft: str, fail_rate: float) -> bool:
+    return REVISED_MARKER in draft or _stable_fraction(draft) >= fail_rate
+
+def draft_reply(prompt: str) -> str:
+    email = prompt.rsplit("Draft a professional reply to the email:", 1)[-1].strip()
+    topic = " ".join(email.split()[:12]) or "your request"
+    reply = f"Hello,\n\nThank you for your message about \"{topic}\". We have looked into it for you."
+    excerpt = re.search(r"\[1\] (.+)", prompt)
+    if excerpt:
+        reply += f" According to our policy: {excerpt.group(1)[:300]}"
+    return reply + "\n\nBest regards,\nCustomer Support"
+
+def respond(system: str, user: str, fail_rate: float) -> str:
+    if system == VALIDATE_SYSTEM_PROMPT:
+        return "PASS: tone and content are fine." if _passes(user, fail_rate) else "FAIL: the reply is too vague."
+    if system == VALIDATE_BATCH_SYSTEM_PROMPT:
+        drafts = re.split(r"(?:^|\n\n)Draft \d+:\n", user)[1:]
+        return json.dumps([_passes(draft, fail_rate) for draft in drafts])
+    if system == REWRITE_SYSTEM_PROMPT:
+        draft = user.split("Draft:\n", 1)[-1]
+        return draft.replace("Best regards,", REVISED_MARKER) if "Best regards," in draft else f"{draft}\n\n{REVISED_MARKER}\nCustomer Support"
+    if system == DRAFT_SYSTEM_PROMPT:
+        return draft_reply(user)
+    return f"Echo: {user[:200]}"
+
+class MockLLMHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, so client connection pooling is measurable
+    config = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, body: dict):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/models"):
+            self._send_json(200, {"object": "list", "data": [{"id": "mock", "object": "model"}]})
+        else:
+            self._send_json(404, {"error": {"message": "Not found"}})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        request = json.loads(self.rfile.read(length) or b"{}")
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": "Not found"}})
+            return
+        config = self.config
+        if config.error_rate and random.random() < config.error_rate:
+            self._send_json(503, {"error": {"message": "Simulated overload"}})
+            return
+
+        messages = request.get("messages") or []
+        system = next((m["content"] for m in messages if m.get("role") == "system"), "")
+        user = next((m["content"] for m in reversed(messages) if m.get("role") == "user"), "")
+        answer = respond(system, user, config.fail_rate)
+        words = re.findall(r"\S+\s*", answer)
+        usage = {"prompt_tokens": len(f"{system} {user}".split()), "completion_tokens": len(words)}
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        time.sleep(config.latency_ms / 1000)
+
+        if not request.get("stream"):
+            if config.tokens_per_sec:
+                time.sleep(len(words) / config.tokens_per_sec)
+            self._send_json(200, {
+                "id": f"mock-{_stable_fraction(user):.8f}", "object": "chat.completion", "model": request.get("model"),
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": answer}, "finish_reason": "stop"}],
+                "usage": usage,
+            })
+            return
+
+        # Server-sent events, one word per chunk; the connection is closed to end the stream
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        for word in words:
+            chunk = {"object": "chat.completion.chunk", "choices": [{"index": 0, "delta": {"content": word}}]}
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+            if config.tokens_per_sec:
+                time.sleep(1 / config.tokens_per_sec)
+        self.wfile.write(b"data: [DONE]\n\n")
+
+def serve(host: str = "127.0.0.1", port: int = 8001, latency_ms: float = 200.0, tokens_per_sec: float = 0.0,
+          fail_rate: float = 0.2, error_rate: float = 0.0) -> ThreadingHTTPServer:
+    """Creates the server (call serve_forever() on it, e.g. in a thread for benchmarks)."""
+    config = argparse.Namespace(latency_ms=latency_ms, tokens_per_sec=tokens_per_sec, fail_rate=fail_rate, error_rate=error_rate)
+    handler = type("ConfiguredMockLLMHandler", (MockLLMHandler,), {"config": config})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Deterministic OpenAI-compatible mock LLM server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency-ms", type=float, default=200.0, help="Fixed delay before every response")
+    parser.add_argument("--tokens-per-sec", type=float, default=0.0, help="Generation speed (0 = instant)")
+    parser.add_argument("--fail-rate", type=float, default=0.2, help="Share of first drafts that fail validation")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests answered with 503")
+    args = parser.parse_args()
+
+    server = serve(args.host, args.port, args.latency_ms, args.tokens_per_sec, args.fail_rate, args.error_rate)
+    print(f"🧪 Mock LLM listening on http://{args.host}:{args.port}/v1 (latency {args.latency_ms:.0f} ms)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,149 @@
+# prevalidation.py
+# Cheap local checks that run before the LLM validator. Obvious failures (PII, banned phrases,
+# missing greeting, bad length) are rejected with specific feedback for rewrite_draft; clean
+# drafts pass without an LLM call; only drafts with soft warning signs go on to the LLM.
+import re
+import threading
+import time
+from collections import deque
+from typing import Dict, Iterable, List
+
+MIN_DRAFT_CHARS = 40
+MAX_DRAFT_CHARS = 4000
+
+BANNED_PHRASES = (
+    "as an ai", "as a language model", "i cannot help", "i can't help", "lorem ipsum", "[insert", "{name}",
+    "todo", "tbd", "placeholder", "not my problem", "calm down", "stupid", "idiot", "shut up",
+)
+# Commitments and sensitive topics a human reviewer (here: the LLM validator) should look at
+REVIEW_PHRASES = (
+    "refund", "compensation", "reimburse", "guarantee", "legal", "lawsuit", "lawyer", "court",
+    "complaint", "discrimination", "injury", "medical",
+)
+
+_GREETING_RE = re.compile(r"^\s*(hi|hello|hey|dear|good (morning|afternoon|evening)|greetings|thank you|thanks)\b", re.I)
+_CARD_RE = re.compile(r"\b(?:\d[ -]?){13,19}\b")
+_IBAN_RE = re.compile(r"\b[A-Z]{2}\d{2}(?: ?[A-Z0-9]{4}){2,7}(?: ?[A-Z0-9]{1,4})?\b")
+_SSN_RE = re.compile(r"\b\d{3}-\d{2}-\d{4}\b")
+_PASSPORT_RE = re.compile(r"\bpassport (?:number|no\.?)\s*:?\s*[A-Z0-9]{6,9}\b", re.I)
+_PHONE_RE = re.compile(r"(?:\+\d{1,3}[ .-]?)?\(?\d{2,4}\)?[ .-]?\d{3}[ .-]?\d{3,4}\b")
+_EMAIL_RE = re.compile(r"\b[\w.+-]+@[\w-]+\.[\w.-]+\b")
+
+def _luhn_ok(digits: str) -> bool:
+    total = 0
+    for i, ch in enumerate(reversed(digits)):
+        n = int(ch)
+        if i % 2:
+            n = n * 2 - 9 if n > 4 else n * 2
+        total += n
+    return total % 10 == 0
+
+def _iban_ok(iban: str) -> bool:
+    iban = iban.replace(" ", "")
+    rearranged = iban[4:] + iban[:4]
+    return int("".join(str(int(ch, 36)) for ch in rearranged)) % 97 == 1
+
+class PhraseMatcher:
+    """Aho-Corasick automaton: finds every whole-word occurrence of any phrase in one pass over the text."""
+
+    def __init__(self, phrases: Iterable[str]):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail = [0]
+        self._out: List[List[str]] = [[]]
+        for phrase in phrases:
+            state = 0
+            for ch in phrase.lower():
+                if ch not in self._goto[state]:
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append([])
+                    self._goto[state][ch] = len(self._goto) - 1
+                state = self._goto[state][ch]
+            self._out[state].append(phrase.lower())
+
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self._goto[state].items():
+                queue.append(nxt)
+                fallback = self._fail[state]
+                while fallback and ch not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[nxt] = self._goto[fallback].get(ch, 0)
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+
+    def find(self, text: str) -> List[str]:
+        text = text.lower()
+        found, state = [], 0
+        for i, ch in enumerate(text):
+            while state and ch not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(ch, 0)
+            for phrase in self._out[state]:
+                start, end = i - len(phrase) + 1, i + 1
+                # Whole words only, so "todo" does not match "today" and "court" does not match "courtesy"
+                if (start == 0 or not text[start - 1].isalnum()) and (end == len(text) or not text[end].isalnum()):
+                    found.append(phrase)
+        return list(dict.fromkeys(found))
+
+_banned = PhraseMatcher(BANNED_PHRASES)
+_review = PhraseMatcher(REVIEW_PHRASES)
+
+_stats_lock = threading.Lock()
+_stats = {"pass": 0, "fail": 0, "borderline": 0, "seconds": 0.0}
+
+def prevalidate(draft: str) -> dict:
+    """Returns {"verdict": "pass" | "fail" | "borderline", "issues": [...], "feedback": str}.
+
+    "fail" issues are specific enough to hand to rewrite_draft as feedback; "borderline" means
+    the draft has no hard problems but should still be reviewed by the LLM validator.
+    """
+    start = time.perf_counter()
+    issues, warnings = [], []
+    text = draft or ""
+
+    if len(text.strip()) < MIN_DRAFT_CHARS:
+        issues.append(f"The reply is too short; write at least {MIN_DRAFT_CHARS} characters that answer the question.")
+    elif len(text) > MAX_DRAFT_CHARS:
+        issues.append(f"The reply is too long ({len(text)} characters); keep it under {MAX_DRAFT_CHARS}.")
+    if text.strip() and not _GREETING_RE.match(text):
+        issues.append("Start the reply with a greeting such as 'Hello' or 'Dear ...'.")
+
+    for match in _CARD_RE.finditer(text):
+        digits = re.sub(r"\D", "", match.group(0))
+        if 13 <= len(digits) <= 19 and _luhn_ok(digits):
+            issues.append("Remove the payment card number from the reply.")
+            break
+    if any(_iban_ok(m.group(0)) for m in _IBAN_RE.finditer(text)):
+        issues.append("Remove the bank account (IBAN) from the reply.")
+    if _SSN_RE.search(text) or _PASSPORT_RE.search(text):
+        issues.append("Remove the identity document number from the reply.")
+    banned = _banned.find(text)
+    if banned:
+        issues.append(f"Remove inappropriate or unfinished wording: {', '.join(repr(p) for p in banned)}.")
+
+    if not issues:
+        # Contact details may be ours (fine) or the customer's (PII): let the LLM judge
+        if _PHONE_RE.search(text) or _EMAIL_RE.search(text):
+            warnings.append("contact details")
+        review = _review.find(text)
+        if review:
+            warnings.append(f"sensitive topics: {', '.join(review)}")
+
+    verdict = "fail" if issues else "borderline" if warnings else "pass"
+    with _stats_lock:
+        _stats[verdict] += 1
+        _stats["seconds"] += time.perf_counter() - start
+    return {"verdict": verdict, "issues": issues or warnings, "feedback": " ".join(issues)}
+
+def get_prevalidation_stats() -> dict:
+    with _stats_lock:
+        checks = _stats["pass"] + _stats["fail"] + _stats["borderline"]
+        return {
+            "checks": checks,
+            "pass": _stats["pass"],
+            "fail": _stats["fail"],
+            "borderline": _stats["borderline"],
+            "llm_calls_avoided": _stats["pass"] + _stats["fail"],
+            "avg_us": round(_stats["seconds"] / checks * 1e6, 1) if checks else None,
+        }
@@ -0,0 +1,154 @@
+# query_embeddings.py
+# Query-side embedding: an LRU+TTL cache in front of the model, and a micro-batching dispatcher
+# that collects concurrent /query requests for a few milliseconds and encodes them in one pass.
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, List, Optional
+
+QUERY_CACHE_SIZE = 10_000
+QUERY_CACHE_TTL = 3600.0
+QUERY_BATCH_SIZE = 32
+QUERY_BATCH_WAIT_MS = 5.0
+
+def _key(text: str) -> str:
+    return " ".join(text.split())
+
+class QueryEmbeddingCache:
+    def __init__(self, max_entries: int = QUERY_CACHE_SIZE, ttl_seconds: float = QUERY_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()  # key -> (vector, expires_at)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, text: str) -> Optional[list]:
+        key = _key(text)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            if entry is not None:
+                del self._entries[key]
+                self.evictions += 1
+            self.misses += 1
+            return None
+
+    def put(self, text: str, vector: list):
+        key = _key(text)
+        with self._lock:
+            self._entries[key] = (vector, time.monotonic() + self.ttl_seconds)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+        }
+
+class MicroBatcher:
+    """Gathers concurrent embed() calls for up to max_wait_ms (or max_batch texts) and encodes them together.
+
+    encode_fn is the blocking model call (list of texts -> array); it runs in the default executor.
+    """
+
+    def __init__(self, encode_fn: Callable[[List[str]], "object"], cache: Optional[QueryEmbeddingCache] = None,
+                 max_batch: int = QUERY_BATCH_SIZE, max_wait_ms: float = QUERY_BATCH_WAIT_MS):
+        self.encode_fn = encode_fn
+        self.cache = cache or QueryEmbeddingCache()
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self._pending = []
+        self._timer = None
+        self._tasks = set()
+        self._inflight = {}
+        self.batches = 0
+        self.batched_texts = 0
+        self.max_batch_seen = 0
+
+    async def embed(self, text: str) -> list:
+        vector = self.cache.get(text)
+        if vector is not None:
+            return vector
+        # Identical queries already waiting for the model share one result
+        future = self._inflight.get(_key(text))
+        if future is not None:
+            return await asyncio.shield(future)
+        loop = asyncio.get_running_loop()
+        future = self._inflight[_key(text)] = loop.create_future()
+        self._pending.append((text, future))
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._flush)
+        return await asyncio.shield(future)
+
+    async def embed_many(self, texts: List[str]) -> List[list]:
+        """Embeds a whole request's worth of texts in one model call, reusing cached vectors."""
+        vectors = [self.cache.get(text) for text in texts]
+        missing = list(dict.fromkeys(t for t, v in zip(texts, vectors) if v is None))
+        if missing:
+            fresh = await self._encode(missing)
+            vectors = [v if v is not None else fresh[t] for t, v in zip(texts, vectors)]
+        return vectors
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.ensure_future(self._run(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: list):
+        texts = [text for text, _ in batch]
+        try:
+            vectors = await self._encode(texts)
+        except Exception as e:
+            vectors, error = None, e
+        for text, future in batch:
+            self._inflight.pop(_key(text), None)
+            if future.done():
+                continue
+            if vectors is None:
+                future.set_exception(error)
+            else:
+                future.set_result(vectors[text])
+
+    async def _encode(self, texts: List[str]) -> dict:
+        loop = asyncio.get_running_loop()
+        vectors = (await loop.run_in_executor(None, self.encode_fn, texts)).tolist()
+        self.batches += 1
+        self.batched_texts += len(texts)
+        self.max_batch_seen = max(self.max_batch_seen, len(texts))
+        for text, vector in zip(texts, vectors):
+            self.cache.put(text, vector)
+        return dict(zip(texts, vectors))
+
+    def stats(self) -> dict:
+        return {
+            "cache": self.cache.stats(),
+            "batches": self.batches,
+            "texts_encoded": self.batched_texts,
+            "avg_batch_size": round(self.batched_texts / self.batches, 2) if self.batches else None,
+            "max_batch_size": self.max_batch_seen,
+            "pending": len(self._pending),
+        }
@@ -1,127 +1,665 @@
-import os
-import fitz  # PyMuPDF
-import chromadb
-from sentence_transformers import SentenceTransformer
-from fastapi import FastAPI, UploadFile, Form
-from pydantic import BaseModel
-from typing import TypedDict, Optional
-from langgraph.graph import StateGraph, END
-
-# Assuming these files exist in your project
-from gmail import fetch_latest_email, send_email
-from llm_client import generate_draft, validate_draft, rewrite_draft
-
-# Initialize FastAPI
-app = FastAPI(title="RAG Agent API with Chroma")
-
-# --- Chroma + Embeddings ---
-chroma_client = chromadb.PersistentClient(path="chroma_db")
-embedder = SentenceTransformer("all-MiniLM-L6-v2")
-
-def file_to_text(file_path: str) -> str:
-    ext = os.path.splitext(file_path)[1].lower()
-    if ext == ".pdf":
-        doc = fitz.open(file_path)
-        return "\n".join([page.get_text() for page in doc])
-    elif ext in [".md", ".txt"]:
-        with open(file_path, "r", encoding="utf-8") as f:
-            return f.read()
-    else:
-        raise ValueError(f"Unsupported file type: {ext}")
-
-def get_collection(name: str):
-    return chroma_client.get_or_create_collection(name)
-
-# --- RAG API Endpoints ---
-@app.get("/")
-def root():
-    return {"message": "Welcome to the RAG API! Server is running 🚀"}
-
-class QueryRequest(BaseModel):
-    query: str
-    collection: str
-
-@app.post("/index")
-async def index_file(file: UploadFile, collection: str = Form(...)):
-    file_path = os.path.join("uploads", file.filename)
-    os.makedirs("uploads", exist_ok=True)
-    with open(file_path, "wb") as f:
-        f.write(await file.read())
-    text = file_to_text(file_path)
-    collection_db = get_collection(collection)
-    chunks = [text[i:i+500] for i in range(0, len(text), 500)]
-    embeddings = embedder.encode(chunks).tolist()
-    for idx, chunk in enumerate(chunks):
-        collection_db.add(documents=[chunk], embeddings=[embeddings[idx]], ids=[f"{file.filename}_{idx}"])
-    return {"status": "success", "chunks_indexed": len(chunks)}
-
-@app.post("/query")
-async def query_collection(request: QueryRequest):
-    collection_db = get_collection(request.collection)
-    query_embedding = embedder.encode([request.query]).tolist()[0]
-    results = collection_db.query(query_embeddings=[query_embedding], n_results=3)
-    return {"query": request.query, "results": results["documents"]}
-
-# --- LangGraph Agent Integration ---
-class EmailState(TypedDict):
-    email: Optional[dict]
-    draft: Optional[str]
-    validation_status: str
-    error: Optional[str]
-    rewrite_attempts: int
-
-def retrieve_node(state: EmailState) -> dict:
-    email = fetch_latest_email()
-    if not email:
-        return {"error": "No new emails found."}
-    return {"email": email, "validation_status": "pending", "rewrite_attempts": 0}
-
-def draft_node(state: EmailState) -> dict:
-    if "error" in state:
-        return state
-    draft_content = generate_draft(state["email"])
-    return {"draft": draft_content}
-
-def validate_node(state: EmailState) -> dict:
-    is_valid = validate_draft(state["draft"])
-    return {"validation_status": "valid" if is_valid else "invalid"}
-
-def rewrite_node(state: EmailState) -> dict:
-    new_draft = rewrite_draft(state["draft"], "Validation failed.")
-    return {"draft": new_draft, "rewrite_attempts": state.get("rewrite_attempts", 0) + 1}
-
-def send_node(state: EmailState) -> dict:
-    send_email(to=state["email"]["from"], subject=f"Re: {state['email']['subject']}", body=state["draft"])
-    return {"status": "Email sent successfully."}
-
-def should_continue(state: EmailState) -> str:
-    if state.get("error"):
-        return END
-    if state["validation_status"] == "valid":
-        return "send"
-    if state["rewrite_attempts"] >= 2:
-        return "escalate"
-    return "rewrite"
-
-workflow = StateGraph(EmailState)
-workflow.add_node("retrieve", retrieve_node)
-workflow.add_node("draft", draft_node)
-workflow.add_node("validate", validate_node)
-workflow.add_node("rewrite", rewrite_node)
-workflow.add_node("send", send_node)
-workflow.set_entry_point("retrieve")
-workflow.add_edge("retrieve", "draft")
-workflow.add_edge("draft", "validate")
-workflow.add_edge("rewrite", "validate")
-workflow.add_edge("send", END)
-workflow.add_conditional_edges("validate", should_continue, {"send": "send", "rewrite": "rewrite", "escalate": END})
-agent_app = workflow.compile()
-
-# --- New API Endpoint to run the agent ---
-@app.post("/process-email")
-async def process_email_endpoint():
-    print("Starting email agent workflow...")
-    final_state = await agent_app.ainvoke({})
-    if final_state.get("error"):
-        return {"status": "failed", "message": final_state["error"]}
-    return {"status": "success", "message": "Workflow completed.", "final_state": final_state}
\ No newline at end of file
+import os
+import time
+import asyncio
+import functools
+import operator
+import shutil
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import FastAPI, UploadFile, Form, HTTPException
+from fastapi.responses import PlainTextResponse
+from fastapi.concurrency import run_in_threadpool
+from pydantic import BaseModel
+from typing import TypedDict, Optional, List, Annotated
+from langgraph.graph import StateGraph, END
+
+# Assuming these files exist in your project
+from gmail import fetch_email, list_unread_message_ids, fetch_emails_batch, mark_as_read, get_service_stats
+from llm_client import generate_draft, validate_draft, rewrite_draft, pack_context, get_llm_stats, CONTEXT_TOKEN_BUDGET
+from gmail_sync import MailboxSync
+from send_queue import get_send_queue, DeliveryUnknown
+from jobs import JobStore, JobRunner, JobQueueFull
+from ledger import MessageLedger, LEDGER_DB, TERMINAL_STAGES
+from indexing import index_document_stream, max_chroma_batch_size, content_version
+from embedding_cache import CachedEmbedder, EmbeddingCache
+from document_loader import iter_file_lines, source_name
+from chunking import iter_chunks, count_tokens
+from query_embeddings import MicroBatcher
+from prevalidation import prevalidate, get_prevalidation_stats
+from semantic_cache import SemanticResponseCache, SEMANTIC_CACHE_THRESHOLD
+from keyword_index import KeywordIndex, KEYWORD_INDEX_DB, reciprocal_rank_fusion, normalize_where
+from section_routing import SectionRouter, prefer_sections, CONTEXT_SECTIONS, ROUTING_OVERFETCH
+from metrics import CHROMA_SECONDS, WORKFLOW_SECONDS, REWRITES, instrument_node, render_prometheus, snapshot
+from resources import EMBEDDING_MODEL, LazyEmbedder, get_chroma_client, embedding_cache_key, is_loaded, warmup, warmup_on_startup
+
+# Initialize FastAPI
+app = FastAPI(title="RAG Agent API with Chroma")
+
+# --- Chroma + Embeddings ---
+# Both are created on first use (see resources.py), so startup and non-RAG endpoints stay fast
+embedder = LazyEmbedder(EMBEDDING_MODEL)
+# Ingestion goes through the on-disk cache so unchanged chunks are never re-embedded
+cached_embedder = CachedEmbedder(embedder, embedding_cache_key(), EmbeddingCache())
+# Query embeddings: LRU/TTL cache plus micro-batching of concurrent /query requests
+query_embedder = MicroBatcher(embedder.encode)
+# BM25 inverted index kept in sync with Chroma by the indexing pipeline, for keyword and hybrid retrieval
+keyword_index = KeywordIndex(os.getenv("KEYWORD_INDEX_DB", KEYWORD_INDEX_DB))
+
+def get_collection(name: str, create: bool = False):
+    """The named Chroma collection, or None if it does not exist. Only indexing creates collections."""
+    client = get_chroma_client()
+    if create:
+        return client.get_or_create_collection(name)
+    from chromadb.errors import NotFoundError
+    try:
+        return client.get_collection(name)
+    except (NotFoundError, ValueError):  # older Chroma releases raise ValueError
+        return None
+
+def require_collection(name: str):
+    collection_db = get_collection(name)
+    if collection_db is None:
+        raise HTTPException(status_code=404, detail=f"Collection '{name}' not found")
+    return collection_db
+
+def chroma_query(collection_db, **kwargs):
+    with CHROMA_SECONDS.time(op="query"):
+        return collection_db.query(**kwargs)
+
+def filtered_query(collection_db, where: dict, **kwargs):
+    """chroma_query with a request's parsed where filter; a filter Chroma still rejects is a client error."""
+    from chromadb.errors import InvalidArgumentError
+    try:
+        return chroma_query(collection_db, **where, **kwargs)
+    except (InvalidArgumentError, ValueError) as e:
+        if not where:
+            raise
+        raise HTTPException(status_code=422, detail=f"Invalid where filter: {e}")
+
+# --- RAG API Endpoints ---
+@app.get("/")
+def root():
+    return {"message": "Welcome to the RAG API! Server is running 🚀"}
+
+@app.post("/warmup")
+async def warmup_endpoint():
+    """Loads the embedding model, Chroma and the tokenizer now instead of on the first request."""
+    timings = await run_in_threadpool(warmup, EMBEDDING_MODEL)
+    return {"status": "warm", "seconds": timings, "loaded": is_loaded()}
+
+class QueryRequest(BaseModel):
+    query: str
+    collection: str
+    mode: str = "dense"  # "dense", "keyword" or "hybrid"
+    top_k: int = 3
+    # Chroma-style metadata filter, e.g. {"section": "Invoice Questions"} or {"qa_start": {"$lte": 3}}
+    where: Optional[dict] = None
+
+class BatchQueryRequest(BaseModel):
+    queries: List[str]
+    collection: str
+    top_k: int = 3
+    where: Optional[dict] = None
+
+def parse_where(where: Optional[dict]) -> dict:
+    """Validated filter as keyword arguments for collection.query (empty without a filter)."""
+    try:
+        where = normalize_where(where)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    return {"where": where} if where else {}
+
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+
+def save_upload(file: UploadFile, file_path: str):
+    # Copied in fixed-size pieces, never read into memory as a whole
+    with open(file_path, "wb") as f:
+        shutil.copyfileobj(file.file, f, UPLOAD_CHUNK_BYTES)
+
+@app.post("/index")
+async def index_file(file: UploadFile, collection: str = Form(...)):
+    file_path = os.path.join("uploads", file.filename)
+    os.makedirs("uploads", exist_ok=True)
+    await run_in_threadpool(save_upload, file, file_path)
+    collection_db = get_collection(collection, create=True)
+    # Streaming ingestion: the file is read a page/line at a time and chunked incrementally while
+    # earlier chunks are embedded and written, so memory does not grow with the document.
+    # Only new or changed chunks are embedded (in fixed-size batches) and written to Chroma in bulk.
+    stats = await run_in_threadpool(index_document_stream, collection_db, source_name(file_path, "uploads"), iter_chunks(iter_file_lines(file_path)),
+                                    cached_embedder, write_batch_size=max_chroma_batch_size(get_chroma_client()),
+                                    keyword_index=keyword_index)
+    if collection == POLICY_COLLECTION:
+        sync_policy_version(await run_in_threadpool(get_collection, POLICY_COLLECTION))
+    return {"status": "success", "chunks_indexed": stats["total"], "chunks_embedded": stats["chunks"],
+            "chunks_unchanged": stats["unchanged"], "chunks_deleted": stats["deleted"],
+            "seconds": stats["seconds"], "chunks_per_sec": stats["chunks_per_sec"]}
+
+@app.post("/query")
+async def query_collection(request: QueryRequest):
+    if request.mode not in ("dense", "keyword", "hybrid"):
+        raise HTTPException(status_code=422, detail="mode must be 'dense', 'keyword' or 'hybrid'")
+    where = parse_where(request.where)
+    if request.mode == "keyword":
+        # Pure lexical lookup: never touches the embedding model or Chroma
+        hits = await run_in_threadpool(keyword_index.search, request.collection, request.query, request.top_k, **where)
+        return {"query": request.query, "mode": request.mode, "results": [[hit["document"] for hit in hits]],
+                "ids": [[hit["id"] for hit in hits]], "metadatas": [[hit["metadata"] for hit in hits]]}
+
+    collection_db = await run_in_threadpool(require_collection, request.collection)
+    query_embedding = await query_embedder.embed(request.query)
+    if request.mode == "dense":
+        results = await run_in_threadpool(filtered_query, collection_db, where, query_embeddings=[query_embedding],
+                                          n_results=request.top_k)
+        return {"query": request.query, "mode": request.mode, "results": results["documents"],
+                "ids": results["ids"], "metadatas": results["metadatas"]}
+
+    # Hybrid: over-fetch from both retrievers (with the same filter) and fuse the two rankings with RRF
+    candidates = request.top_k * 2
+    dense, hits = await asyncio.gather(
+        run_in_threadpool(filtered_query, collection_db, where, query_embeddings=[query_embedding], n_results=candidates),
+        run_in_threadpool(keyword_index.search, request.collection, request.query, candidates, **where),
+    )
+    documents = dict(zip(dense["ids"][0], zip(dense["documents"][0], dense["metadatas"][0])))
+    documents.update({hit["id"]: (hit["document"], hit["metadata"]) for hit in hits})
+    fused = reciprocal_rank_fusion([dense["ids"][0], [hit["id"] for hit in hits]])[:request.top_k]
+    return {"query": request.query, "mode": request.mode, "results": [[documents[doc_id][0] for doc_id, _ in fused]],
+            "ids": [[doc_id for doc_id, _ in fused]], "metadatas": [[documents[doc_id][1] for doc_id, _ in fused]]}
+
+@app.post("/query/batch")
+async def query_collection_batch(request: BatchQueryRequest):
+    if not request.queries:
+        return {"results": []}
+    where = parse_where(request.where)
+    collection_db = await run_in_threadpool(require_collection, request.collection)
+    query_embeddings = await query_embedder.embed_many(request.queries)
+    results = await run_in_threadpool(filtered_query, collection_db, where, query_embeddings=query_embeddings,
+                                      n_results=request.top_k)
+    return {"results": [{"query": q, "results": docs, "ids": ids, "metadatas": metadatas}
+                        for q, docs, ids, metadatas in zip(request.queries, results["documents"], results["ids"], results["metadatas"])]}
+
+@app.get("/query/stats")
+def query_stats():
+    return query_embedder.stats()
+
+# --- LangGraph Agent Integration ---
+# Gmail and LLM calls are blocking, so the nodes offload them to a dedicated pool. Keeping it
+# separate from FastAPI's threadpool means a burst of email workflows cannot starve /query.
+agent_executor = ThreadPoolExecutor(max_workers=int(os.getenv("AGENT_IO_THREADS", "16")), thread_name_prefix="agent-io")
+
+async def run_blocking(fn, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(agent_executor, functools.partial(fn, *args, **kwargs))
+
+class EmailState(TypedDict):
+    email: Optional[dict]
+    draft: Optional[str]
+    validation_status: str
+    error: Optional[str]
+    rewrite_attempts: int
+    status: Optional[str]
+    context: Optional[List[str]]
+    context_sections: Optional[List[str]]
+    retrieval_ms: Optional[float]
+    context_tokens: Optional[int]
+    cache_hit: Optional[bool]
+    feedback: Optional[str]
+    # Ledger lease owner of this run (see run_workflow), and why the message goes to a human if it does
+    owner: Optional[str]
+    escalation: Optional[str]
+    # Per-node spans, only collected when the run starts with {"trace": []} (see metrics.instrument_node)
+    trace: Annotated[Optional[list], operator.add]
+
+ledger = MessageLedger(os.getenv("MESSAGE_LEDGER_DB", LEDGER_DB))
+# Unread messages looked at when a run picks its own email; those claimed by other runs are skipped
+CLAIM_CANDIDATES = 20
+# Rejected sends of one reply before the message is escalated instead of tried again
+MAX_SEND_ATTEMPTS = int(os.getenv("MAX_SEND_ATTEMPTS", "3"))
+
+async def claim_next_unread(owner: str) -> Optional[dict]:
+    """The newest unread message that no other run is working on, claimed for `owner`."""
+    ids, _ = await run_blocking(list_unread_message_ids, max_results=CLAIM_CANDIDATES)
+    for message_id in ids:
+        if await run_blocking(ledger.claim, message_id, owner):
+            return await run_blocking(fetch_email, message_id)
+    return None
+
+async def retrieve_node(state: EmailState) -> dict:
+    owner = state.get("owner") or uuid.uuid4().hex
+    email = state.get("email")
+    if not email:
+        # Messages stay unread until their reply is sent, so a crash mid-graph does not lose them;
+        # the ledger claim keeps concurrent runs off the same message
+        email = await claim_next_unread(owner)
+        if not email:
+            return {"error": "No new emails found."}
+    elif not await run_blocking(ledger.claim, email["id"], owner):
+        return {"email": email, "owner": owner, "status": "Already being processed by another run, skipped."}
+
+    entry = await run_blocking(ledger.get, email["id"])
+    if entry["stage"] == "fetched":
+        await run_blocking(ledger.record, email["id"], "fetched", email=email)
+        return {"email": email, "owner": owner, "validation_status": "pending", "rewrite_attempts": 0}
+
+    # Seen before: resume from the last completed stage
+    print(f"Resuming message {email['id']} after stage '{entry['stage']}'")
+    update = {"email": email, "owner": owner, "draft": entry["draft"], "rewrite_attempts": 0,
+              "validation_status": "valid" if entry["stage"] in ("validated", "send_failed") else "pending"}
+    if entry["stage"] in TERMINAL_STAGES:
+        await run_blocking(mark_as_read, [email["id"]])
+        update["status"] = f"Already {entry['stage']}, skipped."
+    elif entry["stage"] == "sending":
+        # An earlier run handed the reply to Gmail and never heard back: it may have been delivered
+        update["escalation"] = "An earlier send never reported back; the reply may already have been delivered."
+    elif entry["stage"] == "send_failed" and entry["send_attempts"] >= MAX_SEND_ATTEMPTS:
+        update["escalation"] = f"Sending the reply failed {entry['send_attempts']} times."
+    return update
+
+def after_retrieve(state: EmailState) -> str:
+    if state.get("error") or state.get("status"):
+        return END
+    if state.get("escalation"):
+        return "escalate"
+    if state.get("validation_status") == "valid":
+        return "send"
+    if state.get("draft"):
+        return "validate"
+    return "draft"
+
+# Policy knowledge base the drafts are grounded in (index it via /index with this collection name)
+POLICY_COLLECTION = os.getenv("POLICY_COLLECTION", "airlines_policy")
+CONTEXT_TOP_K = int(os.getenv("CONTEXT_TOP_K", "5"))
+# all-MiniLM-L6-v2 only reads the first 256 word pieces, so longer email text would not change the embedding
+CONTEXT_QUERY_CHARS = 1000
+
+# Drafts prefer chunks from the policy sections closest to the email (see section_routing.py); 0 turns it off
+section_router = SectionRouter(max_sections=int(os.getenv("CONTEXT_SECTIONS", CONTEXT_SECTIONS)))
+
+# Approved replies reused for near-duplicate questions (see semantic_cache.py)
+response_cache = SemanticResponseCache(threshold=float(os.getenv("SEMANTIC_CACHE_THRESHOLD", SEMANTIC_CACHE_THRESHOLD)))
+
+_NOT_SEEN = object()
+_policy_version = {"seen": _NOT_SEEN}
+
+def sync_policy_version(collection_db):
+    """Drops cached replies once the policy collection changed, whichever process (API, CLI,
+    watch service) reindexed it: they may quote policy text that is no longer true."""
+    version = content_version(collection_db) if collection_db is not None else None
+    if version != _policy_version["seen"]:
+        if _policy_version["seen"] is not _NOT_SEEN:
+            response_cache.invalidate()
+        _policy_version["seen"] = version
+
+def email_query_text(email: dict) -> str:
+    return f"{email.get('subject') or ''}\n{email.get('body') or ''}"[:CONTEXT_QUERY_CHARS]
+
+async def retrieve_context(collection_db, query_embedding: list) -> dict:
+    """Top-k policy chunks for an email's query embedding, packed into the context budget.
+
+    Chunks from the sections the router picks for the email move ahead of the rest of an
+    over-fetched, unfiltered search. Reuses the process-wide query embedder (cached and
+    micro-batched with /query) and Chroma client.
+    """
+    start = time.perf_counter()
+    if collection_db is None:
+        # Not indexed yet: draft without context instead of creating an empty collection
+        print(f"⚠️ Policy collection '{POLICY_COLLECTION}' not found, drafting without context")
+        return {"context": [], "context_sections": [], "retrieval_ms": None, "context_tokens": 0}
+    sections = section_router.route(collection_db, query_embedding)
+    n_results = CONTEXT_TOP_K * ROUTING_OVERFETCH if sections else CONTEXT_TOP_K
+    results = await run_in_threadpool(chroma_query, collection_db, query_embeddings=[query_embedding], n_results=n_results)
+    documents = prefer_sections(results["documents"][0], results["metadatas"][0], sections) if results["documents"] else []
+    context = pack_context(documents[:CONTEXT_TOP_K], CONTEXT_TOKEN_BUDGET)
+    return {"context": context, "context_sections": sections, "retrieval_ms": round((time.perf_counter() - start) * 1000, 2),
+            "context_tokens": sum(count_tokens(chunk) for chunk in context)}
+
+async def draft_node(state: EmailState) -> dict:
+    if "error" in state:
+        return {}
+    email = state["email"]
+    try:
+        query_embedding = await query_embedder.embed(email_query_text(email))
+        collection_db = await run_in_threadpool(get_collection, POLICY_COLLECTION)
+        sync_policy_version(collection_db)
+        cached = response_cache.lookup(query_embedding, email)
+        if cached:
+            # A reply sent for the same question: no LLM draft, but it is validated like any draft
+            print(f"♻️ Reusing sent reply {cached['key']} (similarity {cached['similarity']})")
+            await run_blocking(ledger.record, email["id"], "drafted", draft=cached["reply"])
+            return {"draft": cached["reply"], "cache_hit": True}
+        grounding = await retrieve_context(collection_db, query_embedding)
+    except Exception as e:
+        # An empty or unreachable knowledge base, or an embedding model that cannot load, should not block replies
+        print(f"⚠️ Context retrieval failed, drafting without it: {e}")
+        grounding = {"context": [], "context_sections": [], "retrieval_ms": None, "context_tokens": 0}
+    draft_content = await run_blocking(generate_draft, email, grounding["context"])
+    await run_blocking(ledger.record, email["id"], "drafted", draft=draft_content)
+    return {"draft": draft_content, "cache_hit": False, **grounding}
+
+def after_draft(state: EmailState) -> str:
+    return END if state.get("error") else "validate"
+
+async def validate_node(state: EmailState) -> dict:
+    # Local rules first (microseconds); only borderline drafts cost an LLM round trip
+    check = prevalidate(state["draft"])
+    if check["verdict"] == "fail":
+        return {"validation_status": "invalid", "feedback": check["feedback"]}
+    is_valid = check["verdict"] == "pass" or await run_blocking(validate_draft, state["draft"])
+    if is_valid:
+        await run_blocking(ledger.record, state["email"]["id"], "validated", draft=state["draft"])
+    return {"validation_status": "valid" if is_valid else "invalid", "feedback": None if is_valid else "Validation failed."}
+
+async def rewrite_node(state: EmailState) -> dict:
+    new_draft = await run_blocking(rewrite_draft, state["draft"], state.get("feedback") or "Validation failed.")
+    await run_blocking(ledger.record, state["email"]["id"], "drafted", draft=new_draft)
+    return {"draft": new_draft, "rewrite_attempts": state.get("rewrite_attempts", 0) + 1}
+
+async def send_node(state: EmailState) -> dict:
+    # The reply goes through the shared send queue, paced and batched with the other workflows'
+    # replies. The run waits for Gmail's answer so its status says whether the reply went out.
+    # The ledger says "sending" while Gmail has the reply, so a run that resumes after a crash
+    # escalates instead of sending it twice; only a confirmed send marks the message read.
+    message_id = state["email"]["id"]
+    attempt = await run_blocking(ledger.start_send, message_id)
+    future = await run_blocking(get_send_queue().submit, to=state["email"]["from"], subject=f"Re: {state['email']['subject']}",
+                                body=state["draft"], key=message_id)
+    try:
+        await asyncio.wrap_future(future)
+    except DeliveryUnknown as e:
+        return {"escalation": f"Delivery unknown, not resending: {e}"}
+    except Exception as e:
+        # Gmail rejected the reply, so nothing went out; a later run may try again
+        await run_blocking(ledger.record, message_id, "send_failed")
+        if attempt >= MAX_SEND_ATTEMPTS:
+            return {"escalation": f"Sending the reply failed {attempt} times: {e}"}
+        return {"error": f"Send failed (attempt {attempt} of {MAX_SEND_ATTEMPTS}): {e}"}
+    await run_blocking(ledger.record, message_id, "sent")
+    await run_blocking(mark_as_read, [message_id])
+    if not state.get("cache_hit"):
+        await remember_reply(state["email"], state["draft"])
+    return {"status": "Email sent."}
+
+async def remember_reply(email: dict, reply: str):
+    """Offers a sent reply to the semantic cache for near-duplicate questions. Best effort: the
+    reply is already out, so a missing embedding model must not fail the run."""
+    try:
+        query_embedding = await query_embedder.embed(email_query_text(email))
+    except Exception as e:
+        print(f"⚠️ Not caching reply to {email['id']}: {e}")
+        return
+    response_cache.put(email["id"], query_embedding, reply, email)
+
+def after_send(state: EmailState) -> str:
+    return "escalate" if state.get("escalation") else END
+
+async def escalate_node(state: EmailState) -> dict:
+    message_id = state["email"]["id"]
+    print(f"🚩 Escalating message {message_id}: {state.get('escalation') or 'draft failed validation after max rewrites'}")
+    await run_blocking(ledger.record, message_id, "escalated")
+    await run_blocking(mark_as_read, [message_id])
+    return {}
+
+def should_continue(state: EmailState) -> str:
+    if state.get("error"):
+        return END
+    if state["validation_status"] == "valid":
+        return "send"
+    if state["rewrite_attempts"] >= 2:
+        return "escalate"
+    return "rewrite"
+
+workflow = StateGraph(EmailState)
+workflow.add_node("retrieve", instrument_node("retrieve", retrieve_node))
+workflow.add_node("draft", instrument_node("draft", draft_node))
+workflow.add_node("validate", instrument_node("validate", validate_node))
+workflow.add_node("rewrite", instrument_node("rewrite", rewrite_node))
+workflow.add_node("send", instrument_node("send", send_node))
+workflow.add_node("escalate", instrument_node("escalate", escalate_node))
+workflow.set_entry_point("retrieve")
+workflow.add_conditional_edges("retrieve", after_retrieve,
+                               {"draft": "draft", "validate": "validate", "send": "send", "escalate": "escalate", END: END})
+workflow.add_conditional_edges("draft", after_draft, {"validate": "validate", END: END})
+workflow.add_edge("rewrite", "validate")
+workflow.add_conditional_edges("send", after_send, {"escalate": "escalate", END: END})
+workflow.add_edge("escalate", END)
+workflow.add_conditional_edges("validate", should_continue, {"send": "send", "rewrite": "rewrite", "escalate": "escalate", END: END})
+agent_app = workflow.compile()
+
+# --- New API Endpoint to run the agent ---
+def record_run(final_state: dict, seconds: float):
+    """Workflow latency by outcome, and the rewrite-loop count of every email that got a verdict."""
+    if final_state.get("error"):
+        outcome = "error"
+    elif not final_state.get("status"):
+        outcome = "escalated"
+    elif final_state.get("cache_hit"):
+        outcome = "cache_hit"
+    elif final_state["status"].startswith("Already"):
+        outcome = "skipped"
+    else:
+        outcome = "sent"
+    WORKFLOW_SECONDS.observe(seconds, outcome=outcome)
+    if outcome in ("sent", "cache_hit", "escalated"):
+        REWRITES.observe(final_state.get("rewrite_attempts") or 0)
+
+async def run_workflow(initial: dict, trace: bool = False) -> dict:
+    start = time.perf_counter()
+    # The ledger lease this run takes on its message is released when the run ends, however it ends
+    owner = uuid.uuid4().hex
+    try:
+        final_state = await agent_app.ainvoke({**initial, "owner": owner, **({"trace": []} if trace else {})})
+    except Exception:
+        WORKFLOW_SECONDS.observe(time.perf_counter() - start, outcome="exception")
+        raise
+    finally:
+        await run_blocking(ledger.release, owner)
+    record_run(final_state, time.perf_counter() - start)
+    return final_state
+
+async def run_email_workflow(params: Optional[dict] = None) -> dict:
+    print("Starting email agent workflow...")
+    final_state = await run_workflow({}, trace=bool((params or {}).get("trace")))
+    if final_state.get("error"):
+        return {"status": "failed", "message": final_state["error"]}
+    return {"status": "success", "message": "Workflow completed.", "final_state": final_state}
+
+@app.post("/process-email")
+async def process_email_endpoint(trace: bool = False):
+    """trace=true adds per-node spans ({node, start, ms}) to the returned final_state."""
+    return await run_email_workflow({"trace": trace})
+
+@app.get("/gmail/stats")
+def gmail_stats():
+    return get_service_stats()
+
+@app.get("/send-queue/stats")
+def send_queue_stats():
+    return get_send_queue().stats()
+
+@app.get("/llm/stats")
+def llm_stats():
+    return {**get_llm_stats(), "prevalidation": get_prevalidation_stats()}
+
+@app.get("/semantic-cache/stats")
+def semantic_cache_stats():
+    return response_cache.stats()
+
+@app.get("/section-routing/stats")
+def section_routing_stats():
+    return section_router.stats()
+
+@app.get("/ledger/stats")
+def ledger_stats():
+    return {"counts": ledger.counts(), "incomplete": ledger.incomplete(limit=20)}
+
+# --- Metrics ---
+def metric_gauges() -> dict:
+    """Point-in-time values from the components that already keep their own stats."""
+    gauges = {}
+    send_stats = get_send_queue().stats()
+    gauges["send_queue_depth"] = send_stats.get("queue_depth")
+    cache_stats = response_cache.stats()
+    gauges["semantic_cache_entries"] = cache_stats.get("size")
+    gauges["semantic_cache_hit_rate"] = cache_stats.get("hit_rate")
+    query_cache = query_embedder.stats()
+    gauges["query_embedding_cache_hit_rate"] = query_cache["cache"].get("hit_rate")
+    for stage, count in ledger.counts().items():
+        gauges[f"ledger_messages_{stage}"] = count
+    for verdict, count in get_prevalidation_stats().items():
+        if isinstance(count, (int, float)):
+            gauges[f"prevalidation_{verdict}"] = count
+    for name, value in get_llm_stats().items():
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            gauges[f"llm_{name}"] = value
+    return gauges
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    """Prometheus text format: node, workflow, Gmail, embedding and Chroma histograms plus gauges."""
+    return render_prometheus(metric_gauges())
+
+@app.get("/metrics/summary")
+def metrics_summary():
+    """Per-stage count / p50 / p99 / mean in milliseconds over the recent samples."""
+    return snapshot()
+
+# --- Inbox drain mode ---
+class DrainRequest(BaseModel):
+    max_messages: int = 100
+    concurrency: int = 4
+    incremental: bool = False
+    trace: bool = False
+
+mailbox_sync = MailboxSync()
+
+def summarize_run(email: dict, final_state: dict) -> dict:
+    result = {"id": email["id"], "from": email["from"], "subject": email["subject"]}
+    if final_state.get("error"):
+        result.update(status="failed", message=final_state["error"])
+    elif final_state.get("status", "").startswith("Already"):
+        result.update(status="skipped", message=final_state["status"])
+    elif final_state.get("status"):
+        result.update(status="success", message=final_state["status"])
+    else:
+        result.update(status="escalated", message=final_state.get("escalation") or "Draft failed validation after max rewrites.")
+    if final_state.get("trace"):
+        result["trace"] = final_state["trace"]
+    return result
+
+async def drain_inbox(max_messages: int = 100, concurrency: int = 4, incremental: bool = False, trace: bool = False) -> list:
+    """Lists up to max_messages unread message IDs, then batch-fetches them and runs each through agent_app.
+
+    With incremental=True the message IDs come from the history-based mailbox sync instead of
+    an `is:unread` listing; every new message reported by the sync is processed, regardless
+    of max_messages, and the sync's historyId is only saved once they all went through the
+    workflow, so a crash mid-drain reports them again on the next poll. Messages that could
+    not be fetched or whose workflow failed are handed back to the sync for the next poll too.
+    """
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def run_one(email: dict) -> dict:
+        async with semaphore:
+            try:
+                final_state = await run_workflow({"email": email}, trace=trace)
+            except Exception as e:
+                return {"id": email["id"], "from": email["from"], "subject": email["subject"],
+                        "status": "failed", "message": str(e)}
+            return summarize_run(email, final_state)
+
+    async def run_page(ids: list):
+        # Messages are marked read by the workflow once their reply is sent (see the ledger)
+        emails, errors = await run_blocking(fetch_emails_batch, ids)
+        results.extend({"id": msg_id, "status": "failed", "message": err} for msg_id, err in errors.items())
+        results.extend(await asyncio.gather(*(run_one(email) for email in emails)))
+
+    results = []
+    if incremental:
+        new_ids = await run_blocking(mailbox_sync.poll)
+        for start in range(0, len(new_ids), 100):
+            await run_page(new_ids[start:start + 100])
+        await run_blocking(mailbox_sync.commit, failed_ids=[r["id"] for r in results if r["status"] == "failed"])
+        return results
+
+    # Snapshot the unread IDs before processing any of them: replies mark messages read as they are
+    # sent, which would shift an `is:unread` listing under its page token and skip messages
+    ids, page_token = [], None
+    while len(ids) < max_messages:
+        page, page_token = await run_blocking(list_unread_message_ids, max_results=min(100, max_messages - len(ids)), page_token=page_token)
+        ids.extend(page)
+        if not page or not page_token:
+            break
+    for start in range(0, len(ids), 100):
+        await run_page(ids[start:start + 100])
+    return results
+
+async def run_inbox_drain(params: dict) -> dict:
+    request = DrainRequest(**params)
+    print(f"Draining inbox (max {request.max_messages}, concurrency {request.concurrency})...")
+    results = await drain_inbox(request.max_messages, request.concurrency, request.incremental, request.trace)
+    counts = {}
+    for r in results:
+        counts[r["status"]] = counts.get(r["status"], 0) + 1
+    return {"status": "success", "processed": len(results), "counts": counts, "results": results}
+
+@app.post("/process-inbox")
+async def process_inbox_endpoint(request: DrainRequest):
+    return await run_inbox_drain(request.model_dump())
+
+# --- Background jobs ---
+job_store = JobStore()
+job_runner = JobRunner(
+    job_store,
+    {"process-email": run_email_workflow, "process-inbox": run_inbox_drain},
+    workers=int(os.getenv("AGENT_JOB_WORKERS", "4")),
+    max_pending=int(os.getenv("AGENT_JOB_MAX_PENDING", "100")),
+)
+
+@app.on_event("startup")
+async def start_job_runner():
+    await job_runner.start()
+
+@app.on_event("startup")
+async def start_warmup():
+    # Opt-in background warmup: the worker accepts traffic immediately and loads the model meanwhile
+    if warmup_on_startup():
+        asyncio.get_running_loop().run_in_executor(None, warmup, EMBEDDING_MODEL)
+
+@app.on_event("shutdown")
+async def stop_job_runner():
+    await job_runner.stop()
+
+async def submit_job(kind: str, params: Optional[dict] = None) -> dict:
+    try:
+        job_id = await job_runner.submit(kind, params)
+    except JobQueueFull as e:
+        raise HTTPException(status_code=429, detail=f"Job queue is full: {e}")
+    except RuntimeError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    return {"job_id": job_id, "status": "queued"}
+
+@app.post("/jobs/process-email", status_code=202)
+async def submit_process_email_job():
+    return await submit_job("process-email")
+
+@app.post("/jobs/process-inbox", status_code=202)
+async def submit_process_inbox_job(request: DrainRequest):
+    return await submit_job("process-inbox", request.model_dump())
+
+@app.get("/jobs")
+def list_jobs(status: Optional[str] = None, limit: int = 50):
+    return {"pending": job_runner.pending(), "counts": job_store.counts(), "jobs": job_store.list(status, limit)}
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str):
+    job = job_store.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@app.get("/jobs/{job_id}/result")
+def get_job_result(job_id: str):
+    job = job_store.get(job_id, with_result=True)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job["status"] not in ("done", "failed", "interrupted"):
+        raise HTTPException(status_code=409, detail=f"Job is {job['status']}")
+    return job
@@ -1,122 +1,161 @@
-import streamlit as st
-import requests
-from datetime import datetime
-from googleapiclient.discovery import build
-from google.oauth2.credentials import Credentials
-
-st.set_page_config(page_title="Agent Dashboard", layout="wide")
-
-# --- Gmail Function to show unread emails (for display purposes only) ---
-def get_unread_messages():
-    try:
-        # NOTE: This UI function still uses the Gmail API directly for display.
-        # This is okay as it only reads emails, but the agent itself is
-        # triggered via the FastAPI endpoint.
-        creds = Credentials.from_authorized_user_file(
-            "token.json", ["https://www.googleapis.com/auth/gmail.readonly"]
-        )
-        service = build("gmail", "v1", credentials=creds)
-
-        results = service.users().messages().list(
-            userId="me", labelIds=["INBOX"], q="is:unread"
-        ).execute()
-        messages = results.get("messages", [])
-
-        emails = []
-        for msg in messages[:5]:
-            msg_data = service.users().messages().get(
-                userId="me", id=msg["id"]
-            ).execute()
-            headers = msg_data["payload"]["headers"]
-            subject = next(h["value"] for h in headers if h["name"] == "Subject")
-            sender = next(h["value"] for h in headers if h["name"] == "From")
-            
-            # This is a simplified body. The agent's full body fetch is on the backend.
-            emails.append({
-                "from": sender,
-                "subject": subject,
-                "time": datetime.now().strftime("%H:%M:%S")
-            })
-        return emails
-    except Exception as e:
-        st.error(f"❌ Gmail API error: {e}")
-        return []
-
-# --- Session state for logs ---
-if "logs" not in st.session_state:
-    st.session_state.logs = []
-if "email_data" not in st.session_state:
-    st.session_state.email_data = {}
-
-# --- Dashboard UI ---
-st.title("📨 Agent Dashboard")
-st.subheader("🟢 Agent Status")
-st.metric("Status", "Running")
-
-# --- Inbox Section ---
-st.subheader("📧 Inbox")
-emails = get_unread_messages()
-if not emails:
-    st.info("No unread emails. Waiting for new ones...")
-else:
-    for email in emails:
-        st.write(f"📩 **{email['subject']}** (from {email['from']} at {email['time']})")
-        
-# --- Agent Control & Logging ---
-st.subheader("⚙️ Agent Control")
-st.write("Click the button below to trigger the email agent.")
-
-if st.button("🚀 Run Agent Workflow"):
-    st.session_state.logs.append(f"{datetime.now().strftime('%H:%M:%S')} - Triggering agent workflow via API...")
-    
-    # Use a spinner to show that work is being done
-    with st.spinner('Processing email...'):
-        try:
-            # Send a request to your FastAPI endpoint
-            response = requests.post("http://127.0.0.1:8000/process-email")
-            response.raise_for_status() # Raise an exception for bad status codes
-            
-            result = response.json()
-            
-            if result['status'] == 'success':
-                st.session_state.logs.append(f"{datetime.now().strftime('%H:%M:%S')} - ✅ Workflow completed successfully!")
-                st.session_state.email_data = result['final_state']
-            else:
-                st.session_state.logs.append(f"{datetime.now().strftime('%H:%M:%S')} - ❌ Workflow failed: {result['message']}")
-                st.session_state.email_data = result.get('final_state', {})
-                
-        except requests.exceptions.RequestException as e:
-            st.session_state.logs.append(f"{datetime.now().strftime('%H:%M:%S')} - 🚨 API call failed: {e}")
-            st.session_state.email_data = {}
-
-# --- Display Results ---
-st.subheader("📬 Latest Agent Action")
-if st.session_state.email_data:
-    final_state = st.session_state.email_data
-    
-    if 'email' in final_state and final_state['email']:
-        st.success("✅ Email Processed and Replied")
-        
-        with st.expander("Original Email"):
-            st.write(f"**From:** {final_state['email']['from']}")
-            st.write(f"**Subject:** {final_state['email']['subject']}")
-            st.write("---")
-            st.write(final_state['email']['body'])
-
-        with st.expander("Drafted Reply"):
-            st.write(final_state.get('draft', 'No draft generated.'))
-            st.write(f"**Validation Status:** `{final_state.get('validation_status', 'N/A')}`")
-            st.write(f"**Rewrite Attempts:** `{final_state.get('rewrite_attempts', 0)}`")
-
-    elif 'error' in final_state:
-        st.error(f"❌ Error: {final_state['error']}")
-    else:
-        st.info("No new email found.")
-        st.write("The agent is waiting for a new unread email to process.")
-else:
-    st.info("Click 'Run Agent Workflow' to start.")
-
-# --- Logs ---
-st.subheader("📜 Agent Logs")
-for log in reversed(st.session_state.logs):
+import streamlit as st
+import requests
+import time
+from datetime import datetime
+from googleapiclient.discovery import build
+from google.oauth2.credentials import Credentials
+from google.auth.transport.requests import Request
+from gmail_sync import MailboxSync
+
+st.set_page_config(page_title="Agent Dashboard", layout="wide")
+
+# --- Gmail service, built once per process instead of on every rerun ---
+@st.cache_resource
+def get_gmail_service():
+    creds = Credentials.from_authorized_user_file(
+        "token.json", ["https://www.googleapis.com/auth/gmail.readonly"]
+    )
+    if creds.expired and creds.refresh_token:
+        creds.refresh(Request())
+    return build("gmail", "v1", credentials=creds, cache_discovery=False)
+
+# --- Gmail Function to show unread emails (for display purposes only) ---
+INBOX_SIZE = 5
+
+def get_unread_messages():
+    try:
+        # NOTE: This UI function still uses the Gmail API directly for display.
+        # This is okay as it only reads emails, but the agent itself is
+        # triggered via the FastAPI endpoint.
+        if "inbox_sync" not in st.session_state:
+            service = get_gmail_service()
+            # History-based sync: the first rerun lists the newest unread mail, later reruns only pull deltas
+            st.session_state.inbox_sync = MailboxSync(service, state_path=None, resync_limit=INBOX_SIZE)
+            st.session_state.inbox = []
+
+        sync = st.session_state.inbox_sync
+        new_ids = sync.poll()
+        if any(email["id"] in sync.gone for email in st.session_state.inbox):
+            # A listed message was read or deleted: relist, so older unread mail moves up into its place
+            sync.reset()
+            st.session_state.inbox = []
+            new_ids = sync.poll()
+        new_emails = []
+        for msg_id in reversed(new_ids[-INBOX_SIZE:]):  # newest first
+            msg_data = sync.service.users().messages().get(
+                userId="me", id=msg_id, format="metadata", metadataHeaders=["Subject", "From"]
+            ).execute()
+            headers = msg_data["payload"]["headers"]
+            subject = next((h["value"] for h in headers if h["name"] == "Subject"), "")
+            sender = next((h["value"] for h in headers if h["name"] == "From"), "")
+
+            # This is a simplified body. The agent's full body fetch is on the backend.
+            new_emails.append({
+                "id": msg_id,
+                "from": sender,
+                "subject": subject,
+                "time": datetime.now().strftime("%H:%M:%S")
+            })
+        sync.commit()
+        st.session_state.inbox = (new_emails + st.session_state.inbox)[:INBOX_SIZE]
+        return st.session_state.inbox
+    except Exception as e:
+        st.error(f"❌ Gmail API error: {e}")
+        return []
+
+# --- Session state for logs ---
+if "logs" not in st.session_state:
+    st.session_state.logs = []
+if "email_data" not in st.session_state:
+    st.session_state.email_data = {}
+
+# --- Dashboard UI ---
+st.title("📨 Agent Dashboard")
+st.subheader("🟢 Agent Status")
+st.metric("Status", "Running")
+
+# --- Inbox Section ---
+st.subheader("📧 Inbox")
+emails = get_unread_messages()
+if not emails:
+    st.info("No unread emails. Waiting for new ones...")
+else:
+    for email in emails:
+        st.write(f"📩 **{email['subject']}** (from {email['from']} at {email['time']})")
+        
+# --- Agent Control & Logging ---
+st.subheader("⚙️ Agent Control")
+st.write("Click the button below to trigger the email agent.")
+
+API_URL = "http://127.0.0.1:8000"
+
+if st.button("🚀 Run Agent Workflow", disabled="active_job" in st.session_state):
+    st.session_state.logs.append(f"{datetime.now().strftime('%H:%M:%S')} - Triggering agent workflow via API...")
+    try:
+        # Submit a background job; the API answers immediately with a job ID
+        response = requests.post(f"{API_URL}/jobs/process-email", timeout=10)
+        response.raise_for_status() # Raise an exception for bad status codes
+        st.session_state.active_job = response.json()["job_id"]
+        st.session_state.logs.append(f"{datetime.now().strftime('%H:%M:%S')} - 🕒 Job {st.session_state.active_job} queued")
+    except requests.exceptions.RequestException as e:
+        st.session_state.logs.append(f"{datetime.now().strftime('%H:%M:%S')} - 🚨 API call failed: {e}")
+        st.session_state.email_data = {}
+
+# --- Poll the active job ---
+if "active_job" in st.session_state:
+    job_id = st.session_state.active_job
+    try:
+        job = requests.get(f"{API_URL}/jobs/{job_id}", timeout=10)
+        job.raise_for_status()
+        status = job.json()["status"]
+        if status in ("queued", "running"):
+            st.info(f"⏳ Job {job_id} is {status}...")
+            time.sleep(1)
+            st.rerun()
+
+        del st.session_state.active_job
+        job = requests.get(f"{API_URL}/jobs/{job_id}/result", timeout=10).json()
+        result = job.get("result") or {}
+        if status == "done" and result.get("status") == "success":
+            st.session_state.logs.append(f"{datetime.now().strftime('%H:%M:%S')} - ✅ Workflow completed successfully!")
+            st.session_state.email_data = result['final_state']
+        else:
+            message = result.get("message") or job.get("error") or status
+            st.session_state.logs.append(f"{datetime.now().strftime('%H:%M:%S')} - ❌ Workflow failed: {message}")
+            st.session_state.email_data = result.get('final_state', {})
+    except requests.exceptions.RequestException as e:
+        del st.session_state.active_job
+        st.session_state.logs.append(f"{datetime.now().strftime('%H:%M:%S')} - 🚨 API call failed: {e}")
+        st.session_state.email_data = {}
+
+# --- Display Results ---
+st.subheader("📬 Latest Agent Action")
+if st.session_state.email_data:
+    final_state = st.session_state.email_data
+    
+    if 'email' in final_state and final_state['email']:
+        st.success("✅ Email Processed and Replied")
+        
+        with st.expander("Original Email"):
+            st.write(f"**From:** {final_state['email']['from']}")
+            st.write(f"**Subject:** {final_state['email']['subject']}")
+            st.write("---")
+            st.write(final_state['email']['body'])
+
+        with st.expander("Drafted Reply"):
+            st.write(final_state.get('draft', 'No draft generated.'))
+            st.write(f"**Validation Status:** `{final_state.get('validation_status', 'N/A')}`")
+            st.write(f"**Rewrite Attempts:** `{final_state.get('rewrite_attempts', 0)}`")
+
+    elif 'error' in final_state:
+        st.error(f"❌ Error: {final_state['error']}")
+    else:
+        st.info("No new email found.")
+        st.write("The agent is waiting for a new unread email to process.")
+else:
+    st.info("Click 'Run Agent Workflow' to start.")
+
+# --- Logs ---
+st.subheader("📜 Agent Logs")
+for log in reversed(st.session_state.logs):
     st.write(log)
\ No newline at end of file
@@ -0,0 +1,85 @@
+# resources.py
+# Lazily created, process-wide heavy resources: the embedding model and the Chroma client.
+#
+# Importing sentence_transformers (torch) and loading the model takes seconds, and opening Chroma
+# is not free either, so nothing here happens at import time. The first caller pays the cost
+# once (guarded by a lock so concurrent first requests do not load the model twice); code paths
+# that never embed, like the health check, the stats endpoints or keyword-only /query, never pay
+# it at all. The email workflow does embed (context retrieval and the reply cache), so its first
+# draft loads the model unless /warmup or WARMUP_ON_STARTUP already did; if the model cannot be
+# loaded, drafts go ahead without policy context.
+import os
+import threading
+import time
+from typing import Optional
+
+from metrics import EMBED_SECONDS, EMBED_TEXTS
+from embedding_backends import configured_backend, configured_threads, cache_model_key, load_embedder
+
+EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+CHROMA_PATH = "chroma_db"
+
+_lock = threading.Lock()
+_embedders = {}
+_chroma_clients = {}
+
+def get_embedder(model_name: str = EMBEDDING_MODEL, backend: Optional[str] = None):
+    """The shared model for model_name on the given (default: EMBEDDING_BACKEND) inference backend."""
+    key = (model_name, backend or configured_backend())
+    embedder = _embedders.get(key)
+    if embedder is None:
+        with _lock:
+            embedder = _embedders.get(key)
+            if embedder is None:
+                start = time.perf_counter()
+                embedder = _embedders[key] = load_embedder(model_name, key[1], configured_threads())
+                print(f"📦 Loaded embedding model {model_name} ({key[1]}) in {time.perf_counter() - start:.2f}s")
+    return embedder
+
+def embedding_cache_key(model_name: str = EMBEDDING_MODEL) -> str:
+    return cache_model_key(model_name, configured_backend())
+
+def get_chroma_client(path: str = CHROMA_PATH):
+    client = _chroma_clients.get(path)
+    if client is None:
+        with _lock:
+            client = _chroma_clients.get(path)
+            if client is None:
+                import chromadb
+                client = _chroma_clients[path] = chromadb.PersistentClient(path=path)
+    return client
+
+def is_loaded() -> dict:
+    return {"embedders": [f"{model} ({backend})" for model, backend in sorted(_embedders)],
+            "chroma_clients": sorted(_chroma_clients)}
+
+class LazyEmbedder:
+    """Stands in for a SentenceTransformer and loads the real model on the first encode() call."""
+
+    def __init__(self, model_name: str = EMBEDDING_MODEL, backend: Optional[str] = None):
+        self.model_name = model_name
+        self.backend = backend
+
+    def encode(self, texts, **kwargs):
+        model = get_embedder(self.model_name, self.backend)
+        EMBED_TEXTS.inc(len(texts), model=self.model_name)
+        with EMBED_SECONDS.time(model=self.model_name):
+            return model.encode(texts, **kwargs)
+
+def warmup(model_name: str = EMBEDDING_MODEL, chroma_path: str = CHROMA_PATH) -> dict:
+    """Loads everything up front (e.g. before a worker takes traffic). Returns per-step seconds."""
+    timings = {}
+    start = time.perf_counter()
+    get_embedder(model_name).encode(["warmup"])
+    timings["embedder"] = round(time.perf_counter() - start, 3)
+    start = time.perf_counter()
+    get_chroma_client(chroma_path).heartbeat()
+    timings["chroma"] = round(time.perf_counter() - start, 3)
+    start = time.perf_counter()
+    from chunking import count_tokens
+    count_tokens("warmup")
+    timings["tokenizer"] = round(time.perf_counter() - start, 3)
+    return timings
+
+def warmup_on_startup() -> bool:
+    return os.getenv("WARMUP_ON_STARTUP", "0").lower() in ("1", "true", "yes")
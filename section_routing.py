@@ -0,0 +1,100 @@
+# section_routing.py
+# Routes an email to the policy sections most likely to answer it. The route only reorders the
+# drafter's retrieval: the search itself stays unfiltered, over-fetches, and chunks from the routed
+# sections (or with no section at all) move ahead of the rest, so a wrong route never costs context.
+#
+# Each top-level section is represented by the centroid of its chunk embeddings. Centroids are
+# computed on a background thread, paging through the collection, and kept until the collection's
+# content version changes (see indexing.content_version); until they are ready, emails go unrouted.
+import threading
+from typing import List, Optional
+
+import numpy as np
+
+from indexing import content_version
+
+# Off by default: turn it on (e.g. CONTEXT_SECTIONS=2) once it measurably helps hit@k on your policy
+CONTEXT_SECTIONS = 0
+# With a route, retrieval fetches this many times top_k candidates to reorder
+ROUTING_OVERFETCH = 2
+CENTROID_PAGE_SIZE = 1000
+
+_IDLE = object()
+
+def prefer_sections(documents: List[str], metadatas: List[Optional[dict]], sections: List[str]) -> List[str]:
+    """Documents from the given sections, or without a section, first; otherwise in retrieval order."""
+    if not sections:
+        return list(documents)
+    wanted = set(sections)
+    def routed(metadata):
+        section = (metadata or {}).get("section")
+        return not section or section in wanted
+    pairs = list(zip(documents, metadatas))
+    return [doc for doc, metadata in pairs if routed(metadata)] + [doc for doc, metadata in pairs if not routed(metadata)]
+
+class SectionRouter:
+    def __init__(self, max_sections: int = CONTEXT_SECTIONS):
+        self.max_sections = max_sections
+        self._names: List[str] = []
+        self._centroids: Optional[np.ndarray] = None
+        self._version = None
+        self._loading = _IDLE  # content version whose centroids are being computed
+        self._loaded = False
+        self._lock = threading.Lock()
+        self.routed = self.unrouted = self.refreshes = 0
+
+    def _load(self, collection, version):
+        sums, counts = {}, {}
+        try:
+            offset = 0
+            while True:
+                page = collection.get(include=["embeddings", "metadatas"], limit=CENTROID_PAGE_SIZE, offset=offset)
+                for vector, metadata in zip(page["embeddings"], page["metadatas"]):
+                    section = (metadata or {}).get("section")
+                    if section:
+                        sums[section] = sums.get(section, 0) + np.asarray(vector, dtype=np.float32)
+                        counts[section] = counts.get(section, 0) + 1
+                if len(page["ids"]) < CENTROID_PAGE_SIZE:
+                    break
+                offset += CENTROID_PAGE_SIZE
+        except Exception as e:
+            print(f"⚠️ Loading section centroids failed: {e}")
+            with self._lock:
+                self._loading = _IDLE
+            return
+        names = sorted(sums)
+        centroids = None
+        if names:
+            centroids = np.asarray([sums[name] / counts[name] for name in names], dtype=np.float32)
+            centroids /= np.maximum(np.linalg.norm(centroids, axis=1, keepdims=True), 1e-12)
+        with self._lock:
+            self._names, self._centroids, self._version, self._loaded = names, centroids, version, True
+            self._loading = _IDLE
+            self.refreshes += 1
+
+    def route(self, collection, query_embedding) -> List[str]:
+        """The closest sections, best first. Empty when routing is off, the centroids for the
+        collection's current content are still loading, or routing would not narrow anything."""
+        if self.max_sections <= 0:
+            self.unrouted += 1
+            return []
+        version = content_version(collection)
+        with self._lock:
+            stale = not self._loaded or self._version != version
+            if stale and self._loading != version:
+                # Never on the request path: this email goes unrouted, later ones use the new centroids
+                self._loading = version
+                threading.Thread(target=self._load, args=(collection, version), name="section-centroids", daemon=True).start()
+            names, centroids = self._names, self._centroids
+        if stale or len(names) <= self.max_sections:
+            self.unrouted += 1
+            return []
+        query = np.asarray(query_embedding, dtype=np.float32)
+        similarities = centroids @ (query / max(float(np.linalg.norm(query)), 1e-12))
+        self.routed += 1
+        return [names[i] for i in np.argsort(-similarities)[:self.max_sections]]
+
+    def stats(self) -> dict:
+        return {"sections": len(self._names) if self._loaded else None, "max_sections": self.max_sections,
+                "loading": self._loading is not _IDLE, "routed": self.routed, "unrouted": self.unrouted,
+                "refreshes": self.refreshes}
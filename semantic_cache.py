@@ -0,0 +1,169 @@
+# semantic_cache.py
+# Semantic response cache: approved replies keyed by the embedding of the email they answered.
+# A new email whose embedding is close enough to a cached one reuses that reply (personalized
+# for the new sender and subject) instead of being drafted again; the reused reply is still
+# validated like any other draft.
+#
+# Only replies that are generic once the subject and first name are templated out are cached:
+# anything that may belong to the original customer or their case (names, numbers such as
+# booking references or amounts, codes, addresses, quoted text) keeps a reply out of the cache.
+import re
+import threading
+import time
+from collections import OrderedDict
+from email.utils import parseaddr
+from typing import Optional
+
+import numpy as np
+
+SEMANTIC_CACHE_THRESHOLD = 0.92
+SEMANTIC_CACHE_SIZE = 1000
+SEMANTIC_CACHE_TTL = 24 * 3600.0
+
+_SUBJECT = "\x00subject\x00"
+_NAME = "\x00name\x00"
+_QUOTES = (("'", "'"), ('"', '"'), ("\u2018", "\u2019"), ("\u201c", "\u201d"))
+
+_NUMBER_RE = re.compile(r"\d+")
+# Amounts, long numbers (phone numbers, dates, account and ticket numbers)
+_AMOUNT_RE = re.compile(r"[$€£¥]\s?\d|\d\s?(?:EUR|USD|GBP|CHF|INR)\b", re.I)
+_LONG_NUMBER_RE = re.compile(r"\d{4,}")
+# Booking references, ticket and fare codes: all-caps tokens with a digit or 6 characters (PNRs)
+_CODE_RE = re.compile(r"\b(?=[A-Z0-9]*\d)[A-Z0-9]{5,}\b|\b[A-Z]{6}\b")
+_EMAIL_RE = re.compile(r"[\w.+-]+@[\w-]+\.[\w.-]+")
+_QUOTE_RE = re.compile(r"^\s*>", re.M)
+# Sentences of the customer's email this long or longer must not show up in a cached reply
+QUOTE_MIN_CHARS = 20
+
+def _first_name(email: dict) -> str:
+    name = parseaddr(email.get("from") or "")[0].split()
+    return name[0] if name else ""
+
+def make_template(reply: str, email: dict) -> str:
+    """Replaces the email-specific parts of an approved reply with placeholders."""
+    template = reply
+    subject = email.get("subject")
+    if subject:
+        # Only where the reply quotes the subject ("regarding '<subject>'"); a subject such as
+        # "Refund" or "Hi" also occurs as an ordinary word and must stay as it is there
+        for quote, end in _QUOTES:
+            template = template.replace(f"{quote}{subject}{end}", f"{quote}{_SUBJECT}{end}")
+    name = _first_name(email)
+    if len(name) > 2:
+        template = re.sub(rf"\b{re.escape(name)}\b", _NAME, template)
+    return template
+
+def customer_data(template: str, email: dict) -> Optional[str]:
+    """What in a template may still identify the original customer or their case (None if nothing)."""
+    if _AMOUNT_RE.search(template) or _LONG_NUMBER_RE.search(template):
+        return "amounts or long numbers"
+    # Short numbers are usually policy (23 kg, 24 hours) unless the customer wrote them
+    email_numbers = set(_NUMBER_RE.findall(f"{email.get('subject') or ''} {email.get('body') or ''}"))
+    subject = (email.get("subject") or "").strip()
+    if subject and re.search(rf"(?<!\w){re.escape(subject)}(?!\w)", template, re.I):
+        # Outside a quote it cannot be templated out, and reusing it as is would be wrong
+        return "the subject outside a quote"
+    if email_numbers.intersection(_NUMBER_RE.findall(template)):
+        return "numbers from the email"
+    if _CODE_RE.search(template):
+        return "reference codes"
+    if _EMAIL_RE.search(template):
+        return "email addresses"
+    if _QUOTE_RE.search(template):
+        return "quoted text"
+    display_name, address = parseaddr(email.get("from") or "")
+    names = set(display_name.split()[1:]) | set(re.split(r"[._+-]", address.split("@")[0]))
+    for name in names:
+        if len(name) > 2 and re.search(rf"\b{re.escape(name)}\b", template, re.I):
+            return "the sender's name"
+    body = " ".join((email.get("body") or "").split())
+    lowered = " ".join(template.split()).lower()
+    for sentence in re.split(r"(?<=[.!?])\s+", body):
+        if len(sentence) >= QUOTE_MIN_CHARS and sentence.lower() in lowered:
+            return "quoted text"
+    return None
+
+def personalize(template: str, email: dict) -> str:
+    return template.replace(_SUBJECT, email.get("subject") or "").replace(_NAME, _first_name(email) or "there")
+
+class SemanticResponseCache:
+    def __init__(self, threshold: float = SEMANTIC_CACHE_THRESHOLD, max_entries: int = SEMANTIC_CACHE_SIZE,
+                 ttl_seconds: float = SEMANTIC_CACHE_TTL):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()  # key -> (unit vector, template, expires_at)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.rejected = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def _unit(vector) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _expire_locked(self):
+        now = time.monotonic()
+        expired = [key for key, (_, _, expires_at) in self._entries.items() if expires_at <= now]
+        for key in expired:
+            del self._entries[key]
+        self.evictions += len(expired)
+
+    def lookup(self, vector, email: dict) -> Optional[dict]:
+        """Best cached reply above the similarity threshold, personalized for email, or None."""
+        query = self._unit(vector)
+        with self._lock:
+            self._expire_locked()
+            if self._entries:
+                keys = list(self._entries)
+                similarities = np.stack([self._entries[key][0] for key in keys]) @ query
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.threshold:
+                    key = keys[best]
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return {"reply": personalize(self._entries[key][1], email), "key": key,
+                            "similarity": round(float(similarities[best]), 4)}
+            self.misses += 1
+            return None
+
+    def put(self, key: str, vector, reply: str, email: dict) -> bool:
+        """Caches a sent reply, unless it carries data specific to the email's sender."""
+        template = make_template(reply, email)
+        if customer_data(template, email):
+            with self._lock:
+                self.rejected += 1
+            return False
+        with self._lock:
+            self._entries[key] = (self._unit(vector), template, time.monotonic() + self.ttl_seconds)
+            self._entries.move_to_end(key)
+            self.stores += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return True
+
+    def invalidate(self):
+        """Drops every cached reply, e.g. after the policy they were grounded in changed."""
+        with self._lock:
+            self._entries.clear()
+            self.invalidations += 1
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "threshold": self.threshold,
+            "hits": self.hits,
+            "misses": self.misses,
+            "stores": self.stores,
+            "rejected": self.rejected,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+        }
@@ -0,0 +1,278 @@
+# send_queue.py
+# Outbound send pipeline: replies are queued by the agent and sent by a worker pool,
+# paced by a token bucket sized to Gmail's per-user quota units.
+import queue
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import Optional
+
+from googleapiclient.errors import HttpError
+
+from metrics import GMAIL_SECONDS
+
+# Gmail API quota units per method (https://developers.google.com/gmail/api/reference/quota)
+GMAIL_QUOTA_UNITS = {
+    "messages.send": 100,
+    "messages.get": 5,
+    "messages.list": 5,
+    "messages.modify": 5,
+    "messages.batchModify": 50,
+    "history.list": 2,
+    "getProfile": 1,
+}
+GMAIL_USER_QUOTA_PER_SEC = 250
+
+RETRIABLE_STATUSES = {429, 500, 502, 503, 504}
+RATE_LIMIT_REASONS = ("rateLimitExceeded", "userRateLimitExceeded")
+
+class TokenBucket:
+    """Blocking token bucket. The refill rate adapts: it halves on throttling and creeps back up on success."""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None, min_rate: Optional[float] = None):
+        self.max_rate = rate
+        self.rate = rate
+        self.min_rate = min_rate if min_rate is not None else rate / 10
+        self.capacity = capacity if capacity is not None else rate
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def acquire(self, units: float):
+        if units > self.capacity:
+            raise ValueError(f"Cannot acquire {units} units from a bucket of capacity {self.capacity}")
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= units:
+                    self._tokens -= units
+                    return
+                wait = (units - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def throttle(self):
+        with self._lock:
+            self._refill()
+            self.rate = max(self.min_rate, self.rate / 2)
+
+    def recover(self):
+        with self._lock:
+            self._refill()
+            self.rate = min(self.max_rate, self.rate + self.max_rate * 0.05)
+
+class DeliveryUnknown(Exception):
+    """A send failed with a 5xx or connection error. Gmail may still have delivered the reply,
+    so it is not retried: messages.send is not idempotent and a retry could reply twice."""
+
+def is_throttled(exc: Exception) -> bool:
+    """Gmail turned the call away for quota reasons, so it had no effect and is safe to repeat."""
+    if not isinstance(exc, HttpError):
+        return False
+    return exc.resp.status == 429 or (exc.resp.status == 403 and any(r in str(exc.content) for r in RATE_LIMIT_REASONS))
+
+def is_retriable(exc: Exception) -> bool:
+    if isinstance(exc, HttpError):
+        if exc.resp.status in RETRIABLE_STATUSES:
+            return True
+        return exc.resp.status == 403 and any(r in str(exc.content) for r in RATE_LIMIT_REASONS)
+    # Connection resets, timeouts and other socket-level errors
+    return isinstance(exc, OSError)
+
+class _SendJob:
+    def __init__(self, to: str, subject: str, body: str, key: Optional[str]):
+        self.to, self.subject, self.body, self.key = to, subject, body, key
+        self.future = Future()
+        self.enqueued_at = time.monotonic()
+
+class SendQueue:
+    """Queue of outbound replies drained by a pool of worker threads.
+
+    Workers pick up to `batch_size` queued replies at a time and send them in one Gmail
+    batch request. Throttling (429, 403 rateLimitExceeded) is retried with exponential backoff
+    and jitter, and slows the token bucket down for everyone. 5xx responses and connection
+    errors are not retried, because the reply may have gone out anyway; they fail the Future
+    with DeliveryUnknown.
+    """
+
+    def __init__(self, workers: int = 4, batch_size: int = 10, max_queue: int = 1000,
+                 max_retries: int = 5, base_delay: float = 1.0, max_delay: float = 64.0,
+                 quota_per_sec: float = GMAIL_USER_QUOTA_PER_SEC, service_factory=None):
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.bucket = TokenBucket(quota_per_sec)
+        self._service_factory = service_factory
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=1000)
+        self._counts = {"submitted": 0, "sent": 0, "failed": 0, "retries": 0, "throttled": 0, "deduplicated": 0,
+                        "delivery_unknown": 0}
+        self._workers = [threading.Thread(target=self._worker, name=f"gmail-send-{i}", daemon=True) for i in range(workers)]
+        for worker in self._workers:
+            worker.start()
+
+    @property
+    def service(self):
+        if self._service_factory is None:
+            from gmail import get_gmail_service
+            self._service_factory = get_gmail_service
+        return self._service_factory()
+
+    def submit(self, to: str, subject: str, body: str, key: Optional[str] = None) -> Future:
+        """Queues a reply and returns a Future resolved with the Gmail response.
+
+        Replies submitted with the same key while one is still queued share its Future,
+        so a retried workflow cannot queue the same reply twice.
+        """
+        with self._lock:
+            if key is not None and key in self._in_flight:
+                self._counts["deduplicated"] += 1
+                return self._in_flight[key].future
+            job = _SendJob(to, subject, body, key)
+            if key is not None:
+                self._in_flight[key] = job
+            self._counts["submitted"] += 1
+        self._queue.put(job)
+        return job.future
+
+    def stats(self) -> dict:
+        latencies = sorted(self._latencies)
+
+        def percentile(p):
+            return round(latencies[min(len(latencies) - 1, int(p * len(latencies)))], 4) if latencies else None
+
+        return {
+            **self._counts,
+            "queue_depth": self._queue.qsize(),
+            "in_flight": len(self._in_flight),
+            "send_rate_units_per_sec": round(self.bucket.rate, 1),
+            "latency_p50_sec": percentile(0.50),
+            "latency_p99_sec": percentile(0.99),
+        }
+
+    def shutdown(self, wait: bool = True):
+        for _ in self._workers:
+            self._queue.put(None)
+        if wait:
+            for worker in self._workers:
+                worker.join()
+
+    # --- Workers ---
+    def _worker(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            jobs = [job]
+            while len(jobs) < self.batch_size:
+                try:
+                    nxt = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if nxt is None:
+                    self._queue.put(None)
+                    break
+                jobs.append(nxt)
+            self._send_with_retries(jobs)
+
+    def _send_with_retries(self, jobs: list):
+        pending = jobs
+        for attempt in range(self.max_retries + 1):
+            for _ in pending:
+                self.bucket.acquire(GMAIL_QUOTA_UNITS["messages.send"])
+            with GMAIL_SECONDS.time(op="send_batch"):
+                failures = self._execute(pending)
+            retry, retry_after = [], 0.0
+            for job, exc in failures:
+                if is_throttled(exc) and attempt < self.max_retries:
+                    retry.append(job)
+                    if exc.resp.get("retry-after", "").isdigit():
+                        retry_after = max(retry_after, float(exc.resp["retry-after"]))
+                elif is_retriable(exc) and not is_throttled(exc):
+                    unknown = DeliveryUnknown(f"Delivery to {job.to} unknown after: {exc}")
+                    unknown.__cause__ = exc
+                    self._finish(job, exc=unknown)
+                else:
+                    self._finish(job, exc=exc)
+            if not retry:
+                return
+            self.bucket.throttle()
+            with self._lock:
+                self._counts["throttled"] += 1
+                self._counts["retries"] += len(retry)
+            delay = min(self.max_delay, self.base_delay * 2 ** attempt) + random.uniform(0, self.base_delay)
+            time.sleep(max(delay, retry_after))
+            pending = retry
+
+    def _execute(self, jobs: list) -> list:
+        """Sends the jobs, resolving successes. Returns [(job, exception)] for failures."""
+        from gmail import build_send_body
+
+        service = self.service
+        failures = []
+        if len(jobs) == 1:
+            job = jobs[0]
+            try:
+                response = service.users().messages().send(userId="me", body=build_send_body(job.to, job.subject, job.body)).execute()
+            except Exception as e:
+                return [(job, e)]
+            self._finish(job, response=response)
+            return failures
+
+        by_id = {str(i): job for i, job in enumerate(jobs)}
+
+        def on_response(request_id, response, exception):
+            if exception is not None:
+                failures.append((by_id[request_id], exception))
+            else:
+                self._finish(by_id[request_id], response=response)
+
+        batch = service.new_batch_http_request(callback=on_response)
+        for request_id, job in by_id.items():
+            batch.add(service.users().messages().send(userId="me", body=build_send_body(job.to, job.subject, job.body)),
+                      request_id=request_id)
+        try:
+            batch.execute()
+        except Exception as e:
+            # The whole batch call failed, so none of the callbacks ran
+            return [(job, e) for job in jobs if not job.future.done()]
+        return failures
+
+    def _finish(self, job: _SendJob, response=None, exc: Optional[Exception] = None):
+        with self._lock:
+            if job.key is not None:
+                self._in_flight.pop(job.key, None)
+            if exc is None:
+                self._counts["sent"] += 1
+                self._latencies.append(time.monotonic() - job.enqueued_at)
+            else:
+                self._counts["failed"] += 1
+                if isinstance(exc, DeliveryUnknown):
+                    self._counts["delivery_unknown"] += 1
+        if exc is None:
+            self.bucket.recover()
+            job.future.set_result(response)
+        else:
+            print(f"❌ Failed to send reply to {job.to}: {exc}")
+            job.future.set_exception(exc)
+
+_default_queue = None
+_default_queue_lock = threading.Lock()
+
+def get_send_queue() -> SendQueue:
+    """Returns the process-wide send queue, starting its workers on first use."""
+    global _default_queue
+    if _default_queue is None:
+        with _default_queue_lock:
+            if _default_queue is None:
+                _default_queue = SendQueue()
+    return _default_queue
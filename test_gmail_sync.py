@@ -0,0 +1,87 @@
+# test_gmail_sync.py
+# Offline tests for the history-based mailbox sync, run against fake_gmail.FakeGmailService.
+#   python -m unittest test_gmail_sync
+import os
+import tempfile
+import unittest
+
+from fake_gmail import FakeGmailService, FakeMailbox
+from gmail_sync import MailboxSync
+
+class MailboxSyncTest(unittest.TestCase):
+    def setUp(self):
+        self.mailbox = FakeMailbox()
+        self.service = FakeGmailService(self.mailbox)
+        self.sync = MailboxSync(self.service, state_path=None)
+
+    def test_first_poll_lists_unread_mail(self):
+        unread = self.mailbox.add_message("Unread")
+        self.mailbox.add_message("Read", labels=("INBOX",))
+        self.assertEqual(self.sync.poll(), [unread])
+        self.assertEqual(self.sync.stats["full_syncs"], 1)
+
+    def test_later_polls_only_return_new_mail(self):
+        self.mailbox.add_message("Old")
+        self.sync.poll()
+        self.sync.commit()
+        new = self.mailbox.add_message("New")
+        self.assertEqual(self.sync.poll(), [new])
+        self.assertEqual(self.sync.stats, {"full_syncs": 1, "incremental_syncs": 1, "history_expired": 0, "messages_seen": 2})
+
+    def test_uncommitted_poll_is_returned_again(self):
+        self.sync.poll()
+        self.sync.commit()
+        new = self.mailbox.add_message("New")
+        self.assertEqual(self.sync.poll(), [new])
+        # No commit(), e.g. the process died while handling the message
+        self.assertEqual(self.sync.poll(), [new])
+        self.sync.commit()
+        self.assertEqual(self.sync.poll(), [])
+
+    def test_failed_messages_are_returned_again(self):
+        self.sync.poll()
+        self.sync.commit()
+        failed, done = self.mailbox.add_message("Failed"), self.mailbox.add_message("Done")
+        self.assertEqual(self.sync.poll(), [failed, done])
+        self.sync.commit(failed_ids=[failed])
+        new = self.mailbox.add_message("New")
+        self.assertEqual(self.sync.poll(), [failed, new])
+        self.sync.commit()
+        self.assertEqual(self.sync.poll(), [])
+
+    def test_read_messages_are_reported_gone(self):
+        self.sync.poll()
+        self.sync.commit()
+        read, unread = self.mailbox.add_message("Read"), self.mailbox.add_message("Unread")
+        self.mailbox.modify(read, {"removeLabelIds": ["UNREAD"]})
+        self.assertEqual(self.sync.poll(), [unread])
+        self.assertEqual(self.sync.gone, [read])
+
+    def test_resync_limit_lists_only_the_newest_messages(self):
+        ids = [self.mailbox.add_message(f"Message {i}") for i in range(8)]
+        sync = MailboxSync(self.service, state_path=None, resync_limit=3)
+        self.assertEqual(sync.poll(), ids[-3:])
+
+    def test_expired_history_falls_back_to_full_resync(self):
+        self.sync.poll()
+        self.sync.commit()
+        new = self.mailbox.add_message("New")
+        self.mailbox.expire_history()
+        self.assertEqual(self.sync.poll(), [new])
+        self.assertEqual(self.sync.stats["history_expired"], 1)
+        self.assertEqual(self.sync.stats["full_syncs"], 2)
+
+    def test_history_id_is_persisted_on_commit(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            state_path = os.path.join(tmp, "sync_state.json")
+            sync = MailboxSync(self.service, state_path=state_path)
+            sync.poll()
+            self.assertFalse(os.path.exists(state_path))
+            sync.commit()
+            new = self.mailbox.add_message("New")
+            restarted = MailboxSync(self.service, state_path=state_path)
+            self.assertEqual(restarted.poll(), [new])
+            self.assertEqual(restarted.stats["full_syncs"], 0)
+
+if __name__ == "__main__":
+    unittest.main()
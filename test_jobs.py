@@ -0,0 +1,94 @@
+# test_jobs.py
+# Offline tests for the job table's recovery across runners and for JobRunner.
+#   python -m unittest test_jobs
+import asyncio
+import os
+import tempfile
+import unittest
+
+from jobs import JobQueueFull, JobRunner, JobStore
+
+async def echo(params):
+    await asyncio.sleep(params.get("sleep", 0))
+    return params
+
+class JobStoreRecoveryTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.store = JobStore(os.path.join(self.tmp.name, "jobs.sqlite3"))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_jobs_of_live_runners_are_left_alone(self):
+        self.store.heartbeat("alive")
+        self.store.create("x", owner="alive")
+        self.assertEqual(self.store.recover("other"), [])
+
+    def test_dead_runner_queued_jobs_are_adopted_and_running_ones_interrupted(self):
+        self.store.heartbeat("dead")
+        queued = self.store.create("x", {"n": 1}, owner="dead")
+        running = self.store.create("x", owner="dead")
+        self.store.mark_running(running)
+        self.store._execute("UPDATE runners SET heartbeat_at = 0 WHERE owner = 'dead'")
+        self.store.heartbeat("new")
+        self.assertEqual(self.store.recover("new", lease_seconds=60), [(queued, "x", {"n": 1})])
+        self.assertEqual(self.store.get(queued)["owner"], "new")
+        self.assertEqual(self.store.get(running)["status"], "interrupted")
+        # Adopted once only
+        self.assertEqual(self.store.recover("third", lease_seconds=60), [])
+
+    def test_retired_runner_jobs_are_adopted_right_away(self):
+        self.store.heartbeat("old")
+        job_id = self.store.create("x", owner="old")
+        self.store.retire("old")
+        self.assertEqual([job[0] for job in self.store.recover("new")], [job_id])
+
+class JobRunnerTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.store = JobStore(os.path.join(self.tmp.name, "jobs.sqlite3"))
+
+    async def asyncTearDown(self):
+        self.tmp.cleanup()
+
+    async def test_submit_before_start_is_refused(self):
+        runner = JobRunner(self.store, {"x": echo})
+        with self.assertRaises(RuntimeError):
+            await runner.submit("x")
+
+    async def test_jobs_run_to_done(self):
+        runner = JobRunner(self.store, {"x": echo}, workers=2)
+        await runner.start()
+        job_id = await runner.submit("x", {"n": 1})
+        await runner._queue.join()
+        await runner.stop()
+        job = self.store.get(job_id, with_result=True)
+        self.assertEqual((job["status"], job["result"]), ("done", {"n": 1}))
+
+    async def test_full_queue_is_refused(self):
+        runner = JobRunner(self.store, {"x": echo}, workers=1, max_pending=1)
+        await runner.start()
+        await runner.submit("x", {"sleep": 0.2})
+        await asyncio.sleep(0.05)  # the worker picks up the first job, leaving room for one
+        await runner.submit("x")
+        with self.assertRaises(JobQueueFull):
+            await runner.submit("x")
+        await runner.stop()
+
+    async def test_new_runner_takes_over_a_dead_runners_queue(self):
+        dead = JobRunner(self.store, {"x": echo}, workers=1)
+        await dead.start()
+        for task in dead._tasks:
+            task.cancel()
+        job_id = await dead.submit("x")
+        self.store._execute("UPDATE runners SET heartbeat_at = 0 WHERE owner = ?", (dead.owner,))
+        runner = JobRunner(self.store, {"x": echo}, workers=1)
+        await runner.start()
+        await runner._queue.join()
+        await runner.stop()
+        job = self.store.get(job_id)
+        self.assertEqual((job["status"], job["owner"]), ("done", runner.owner))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,49 @@
+# test_keyword_index.py
+# Offline tests for metadata filters in the keyword index.
+#   python -m unittest test_keyword_index
+import unittest
+
+from keyword_index import KeywordIndex, normalize_where, where_sql
+
+class WhereFilterTest(unittest.TestCase):
+    def test_invalid_filters_are_rejected(self):
+        for where in ({}, [], {"$not": {"a": 1}}, {"$and": []}, {"$or": {"a": 1}}, {"a": {}},
+                      {"a": {"$like": "x%"}}, {"a": {"$gt": "b"}}, {"a": {"$gt": True}}, {"a": None},
+                      {"a": {"$in": []}}, {"a": {"$in": [1, "b"]}}, {"a": {"$nin": [1, 2.5]}}, {"a": [1, 2]}):
+            with self.subTest(where=where), self.assertRaises(ValueError):
+                where_sql(where)
+        with self.assertRaises(ValueError):
+            normalize_where({"$and": [{"a": 1}, {"b": {"$regex": "."}}]})
+
+    def test_filters_are_normalized_for_chroma(self):
+        self.assertIsNone(normalize_where(None))
+        self.assertIsNone(normalize_where({}))
+        self.assertEqual(normalize_where({"a": 1}), {"a": 1})
+        self.assertEqual(normalize_where({"a": 1, "b": {"$ne": "x"}}), {"$and": [{"a": 1}, {"b": {"$ne": "x"}}]})
+        self.assertEqual(normalize_where({"n": {"$gte": 1, "$lte": 3}}), {"$and": [{"n": {"$gte": 1}}, {"n": {"$lte": 3}}]})
+        self.assertEqual(normalize_where({"$or": [{"a": 1}]}), {"a": 1})
+        self.assertEqual(normalize_where({"$or": [{"a": 1}, {"b": 2, "c": 3}]}),
+                         {"$or": [{"a": 1}, {"$and": [{"b": 2}, {"c": 3}]}]})
+
+    def test_keys_are_passed_as_parameters(self):
+        sql, params = where_sql({'x") OR 1=1 --': "y"})
+        self.assertNotIn("1=1", sql)
+        self.assertEqual(params, ['$."x\\") OR 1=1 --"', "y"])
+
+class KeywordSearchFilterTest(unittest.TestCase):
+    def setUp(self):
+        self.index = KeywordIndex(":memory:")
+        self.index.upsert("policy", ["c1", "c2", "c3"],
+                          ["Refunds for cancelled flights", "Refunds for hotel bookings", "Baggage refunds"],
+                          [{"source": "airline.md", "page": 1}, {"source": "hotel.md", "page": 2}, {"source": "airline.md", "page": 5}])
+
+    def test_search_only_scores_matching_chunks(self):
+        ids = lambda where: sorted(hit["id"] for hit in self.index.search("policy", "refunds", where=where))
+        self.assertEqual(ids(None), ["c1", "c2", "c3"])
+        self.assertEqual(ids({"source": "airline.md"}), ["c1", "c3"])
+        self.assertEqual(ids({"source": "airline.md", "page": {"$lt": 3}}), ["c1"])
+        self.assertEqual(ids({"$or": [{"source": "hotel.md"}, {"page": {"$in": [5]}}]}), ["c2", "c3"])
+        self.assertEqual(ids({"source": {"$nin": ["airline.md", "hotel.md"]}}), [])
+
+if __name__ == "__main__":
+    unittest.main()
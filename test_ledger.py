@@ -0,0 +1,62 @@
+# test_ledger.py
+# Offline tests for leases and stage tracking in the message ledger.
+#   python -m unittest test_ledger
+import os
+import tempfile
+import unittest
+
+from ledger import MessageLedger
+
+class LedgerTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.ledger = MessageLedger(os.path.join(self.tmp.name, "ledger.sqlite3"))
+
+    def tearDown(self):
+        self.ledger._conn.close()
+        self.tmp.cleanup()
+
+    def test_claim_is_exclusive_until_released(self):
+        self.assertTrue(self.ledger.claim("m1", "run-a"))
+        self.assertFalse(self.ledger.claim("m1", "run-b"))
+        # Re-claiming your own message renews the lease
+        self.assertTrue(self.ledger.claim("m1", "run-a"))
+        self.ledger.release("run-a")
+        self.assertTrue(self.ledger.claim("m1", "run-b"))
+        self.assertEqual(self.ledger.get("m1")["stage"], "fetched")
+
+    def test_expired_lease_can_be_taken_over(self):
+        self.assertTrue(self.ledger.claim("m1", "run-a", lease_seconds=-1))
+        self.assertTrue(self.ledger.claim("m1", "run-b"))
+        self.assertFalse(self.ledger.claim("m1", "run-a"))
+
+    def test_claim_keeps_progress(self):
+        self.ledger.claim("m1", "run-a")
+        self.ledger.record("m1", "drafted", email={"id": "m1"}, draft="Hi")
+        self.ledger.release("run-a")
+        self.assertTrue(self.ledger.claim("m1", "run-b"))
+        entry = self.ledger.get("m1")
+        self.assertEqual((entry["stage"], entry["draft"], entry["email"]), ("drafted", "Hi", {"id": "m1"}))
+
+    def test_stages_never_move_back(self):
+        self.ledger.record("m1", "validated", draft="Hi")
+        self.ledger.record("m1", "fetched")
+        self.assertEqual(self.ledger.get("m1")["stage"], "validated")
+        self.ledger.record("m1", "sent")
+        self.ledger.record("m1", "send_failed")
+        self.assertEqual(self.ledger.get("m1")["stage"], "sent")
+        self.assertEqual(self.ledger.incomplete(), [])
+
+    def test_send_attempts_are_counted_until_sent(self):
+        self.ledger.record("m1", "validated")
+        self.assertEqual(self.ledger.start_send("m1"), 1)
+        self.ledger.record("m1", "send_failed")
+        self.assertEqual(self.ledger.start_send("m1"), 2)
+        self.assertEqual(self.ledger.incomplete(), [{"message_id": "m1", "stage": "sending"}])
+        self.ledger.record("m1", "sent")
+        # A sent message is never handed to Gmail again
+        self.assertEqual(self.ledger.start_send("m1"), 2)
+        self.assertEqual(self.ledger.get("m1")["stage"], "sent")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,46 @@
+# test_semantic_cache.py
+# Offline tests for templating and caching approved replies in semantic_cache.
+#   python -m unittest test_semantic_cache
+import unittest
+
+from semantic_cache import SemanticResponseCache, customer_data, make_template
+
+def _email(subject, sender="Jane Doe <jane.doe@example.com>", body="Can I get an invoice for my flight?"):
+    return {"id": "1", "subject": subject, "from": sender, "body": body}
+
+class TemplateTest(unittest.TestCase):
+    def test_quoted_subject_and_first_name_are_templated(self):
+        email = _email("Invoice request")
+        reply = "Hi Jane, I've received your email regarding 'Invoice request'. Invoices are sent within a day."
+        template = make_template(reply, email)
+        self.assertIsNone(customer_data(template, email))
+        cache = SemanticResponseCache(threshold=0.9)
+        self.assertTrue(cache.put("1", [1.0, 0.0], reply, email))
+        hit = cache.lookup([1.0, 0.0], _email("Need an invoice", sender="Bob Stone <bob@example.com>"))
+        self.assertEqual(hit["reply"], "Hi Bob, I've received your email regarding 'Need an invoice'. Invoices are sent within a day.")
+
+    def test_subject_used_as_a_word_is_not_cached(self):
+        email = _email("Refund")
+        reply = "Hi, regarding 'Refund': Refund requests are processed within 7 days."
+        self.assertEqual(customer_data(make_template(reply, email), email), "the subject outside a quote")
+        cache = SemanticResponseCache()
+        self.assertFalse(cache.put("1", [1.0, 0.0], reply, email))
+        self.assertEqual(cache.stats()["rejected"], 1)
+
+    def test_subject_matching_the_greeting_is_not_cached(self):
+        email = _email("Hi")
+        reply = "Hi, I've received your email regarding 'Hi'. I am working on a solution."
+        template = make_template(reply, email)
+        self.assertTrue(template.startswith("Hi, "))
+        self.assertEqual(customer_data(template, email), "the subject outside a quote")
+        self.assertFalse(SemanticResponseCache().put("1", [1.0, 0.0], reply, email))
+
+    def test_customer_specific_replies_are_not_cached(self):
+        email = _email("Change fee", body="My booking XKQBPL costs too much to change.")
+        self.assertEqual(customer_data(make_template("Your booking XKQBPL was changed.", email), email), "reference codes")
+        self.assertEqual(customer_data(make_template("The fee is $50.", email), email), "amounts or long numbers")
+        self.assertEqual(customer_data(make_template("We wrote to jane.doe@example.com.", email), email), "email addresses")
+        self.assertEqual(customer_data(make_template("Dear Ms Doe, fees apply.", email), email), "the sender's name")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,76 @@
+# test_send_queue.py
+# Offline tests for how the send queue classifies and retries Gmail send failures.
+#   python -m unittest test_send_queue
+import unittest
+
+from fake_gmail import _http_error
+from send_queue import DeliveryUnknown, SendQueue, _SendJob, is_retriable, is_throttled
+
+class ScriptedSendQueue(SendQueue):
+    """Send queue without workers whose sends fail with the scripted errors, one per attempt."""
+
+    def __init__(self, errors, **kwargs):
+        super().__init__(workers=0, base_delay=0.0, quota_per_sec=10000, **kwargs)
+        self.errors = list(errors)
+        self.attempts = 0
+
+    def _execute(self, jobs):
+        self.attempts += 1
+        failures = []
+        for job in jobs:
+            if self.errors:
+                failures.append((job, self.errors.pop(0)))
+            else:
+                self._finish(job, response={"id": "sent"})
+        return failures
+
+def _send(send_queue):
+    job = _SendJob("jane@example.com", "Re: Refund", "Hi", key="m1")
+    send_queue._send_with_retries([job])
+    return job.future
+
+class ClassificationTest(unittest.TestCase):
+    def test_quota_errors_are_throttling(self):
+        self.assertTrue(is_throttled(_http_error(429, "Too many requests")))
+        self.assertTrue(is_throttled(_http_error(403, "Rate limit", reason="userRateLimitExceeded")))
+        self.assertFalse(is_throttled(_http_error(403, "Forbidden", reason="forbidden")))
+        self.assertFalse(is_throttled(_http_error(503, "Backend error")))
+        self.assertFalse(is_throttled(ConnectionResetError()))
+
+    def test_server_and_connection_errors_are_retriable(self):
+        self.assertTrue(is_retriable(_http_error(503, "Backend error")))
+        self.assertTrue(is_retriable(ConnectionResetError()))
+        self.assertTrue(is_retriable(_http_error(429, "Too many requests")))
+        self.assertFalse(is_retriable(_http_error(400, "Invalid to header")))
+        self.assertFalse(is_retriable(_http_error(403, "Forbidden", reason="forbidden")))
+
+class SendWithRetriesTest(unittest.TestCase):
+    def test_throttled_send_is_retried(self):
+        send_queue = ScriptedSendQueue([_http_error(429, "Too many requests"),
+                                        _http_error(403, "Rate limit", reason="rateLimitExceeded")])
+        self.assertEqual(_send(send_queue).result(timeout=1), {"id": "sent"})
+        self.assertEqual(send_queue.attempts, 3)
+        self.assertEqual(send_queue.stats()["retries"], 2)
+
+    def test_throttling_gives_up_after_max_retries(self):
+        send_queue = ScriptedSendQueue([_http_error(429, "Too many requests")] * 3, max_retries=2)
+        self.assertEqual(_send(send_queue).exception(timeout=1).resp.status, 429)
+        self.assertEqual(send_queue.attempts, 3)
+
+    def test_server_error_is_delivery_unknown_and_not_retried(self):
+        for error in (_http_error(503, "Backend error"), ConnectionResetError("reset")):
+            send_queue = ScriptedSendQueue([error])
+            exc = _send(send_queue).exception(timeout=1)
+            self.assertIsInstance(exc, DeliveryUnknown)
+            self.assertIs(exc.__cause__, error)
+            self.assertEqual(send_queue.attempts, 1)
+            self.assertEqual(send_queue.stats()["delivery_unknown"], 1)
+
+    def test_rejected_send_fails_as_is(self):
+        error = _http_error(400, "Invalid to header")
+        send_queue = ScriptedSendQueue([error])
+        self.assertIs(_send(send_queue).exception(timeout=1), error)
+        self.assertEqual(send_queue.attempts, 1)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,210 @@
+# watch_service.py
+# Continuous reindexing: watches files or whole directory trees, debounces the bursts of events
+# editors emit per save, coalesces them per file, and hands one "index" or "delete" task per file
+# to a background worker through a bounded queue.
+import os
+import queue
+import threading
+import time
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+from watchdog.events import FileSystemEventHandler
+from watchdog.observers import Observer
+
+from document_loader import SUPPORTED_EXTENSIONS
+
+WATCH_DEBOUNCE_SECONDS = 1.0
+WATCH_MAX_QUEUE = 1000
+
+# Editor swap/backup files and partial downloads
+_IGNORED_SUFFIXES = ("~", ".swp", ".swx", ".tmp", ".part", ".crdownload")
+
+def normalize_path(path: str) -> str:
+    """Canonical form for comparing paths from watchdog events and from the command line. Only a
+    key: on Windows it is lowercased, so callbacks get the path as the event reported it."""
+    return os.path.normcase(os.path.abspath(path))
+
+class _EventHandler(FileSystemEventHandler):
+    def __init__(self, service: "WatchService", files: Optional[set] = None):
+        self.service = service
+        self.files = files  # for single-file watches: only these paths get through
+
+    def _schedule(self, path: str, action: str, is_directory: bool = False):
+        if self.files is not None and (is_directory or normalize_path(path) not in self.files):
+            return
+        self.service.schedule(path, action, is_directory=is_directory)
+
+    def on_created(self, event):
+        if not event.is_directory:
+            self._schedule(event.src_path, "index")
+
+    def on_modified(self, event):
+        if not event.is_directory:
+            self._schedule(event.src_path, "index")
+
+    def on_deleted(self, event):
+        # A deleted directory does not report its files, so the service resolves them itself
+        self._schedule(event.src_path, "delete", is_directory=event.is_directory)
+
+    def on_moved(self, event):
+        self._schedule(event.src_path, "delete", is_directory=event.is_directory)
+        if event.is_directory:
+            if self.files is None:
+                self.service.schedule_tree(event.dest_path)
+        else:
+            self._schedule(event.dest_path, "index")
+
+class WatchService:
+    """Debounced, coalescing file watcher with a single background reindex worker.
+
+    on_index(path) and on_delete(path) run on the worker thread, one file at a time. Any number
+    of events for the same file within `debounce` seconds of each other become one task, and a
+    file that is already waiting in the queue is not queued twice.
+    """
+
+    def __init__(self, on_index: Callable[[str], None], on_delete: Callable[[str], None],
+                 debounce: float = WATCH_DEBOUNCE_SECONDS, max_queue: int = WATCH_MAX_QUEUE,
+                 extensions: Iterable[str] = SUPPORTED_EXTENSIONS):
+        self.on_index = on_index
+        self.on_delete = on_delete
+        self.debounce = debounce
+        self.extensions = tuple(e.lower() for e in extensions)
+        self._roots = []                   # watched directory trees
+        self._file_handlers: Dict[str, _EventHandler] = {}  # directory -> handler of single-file watches there
+        self._known: Dict[str, str] = {}   # files seen so far (key -> path), to expand directory deletes
+        self._pending: Dict[str, Tuple[str, float, str]] = {}  # key -> (action, due time, path)
+        self._queued = set()
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._observer = Observer()
+        self._threads = []
+        self.counts = {"events": 0, "coalesced": 0, "indexed": 0, "deleted": 0, "failed": 0}
+
+    # --- Registration ---
+    # Register directories before files: a file inside a watched tree needs no watch of its own
+    def watch_directory(self, root: str):
+        for dirpath, _, filenames in os.walk(root):
+            for name in filenames:
+                path = os.path.abspath(os.path.join(dirpath, name))
+                self._known[normalize_path(path)] = path
+        self._roots.append(normalize_path(root))
+        self._observer.schedule(_EventHandler(self), root, recursive=True)
+
+    def watch_file(self, path: str):
+        """Watches a single file. Outside the watched trees, its directory is watched non-recursively
+        with only the watched files let through; directory watches stay unfiltered."""
+        key = normalize_path(path)
+        self._known[key] = os.path.abspath(path)
+        if any(key.startswith(root + os.sep) for root in self._roots):
+            return
+        directory = os.path.dirname(key)
+        handler = self._file_handlers.get(directory)
+        if handler is None:
+            handler = self._file_handlers[directory] = _EventHandler(self, files=set())
+            self._observer.schedule(handler, directory, recursive=False)
+        handler.files.add(key)
+
+    # --- Event intake (watchdog thread) ---
+    def _wanted(self, path: str) -> bool:
+        name = os.path.basename(path).lower()
+        if name.startswith(".#") or name.endswith(_IGNORED_SUFFIXES):
+            return False
+        return name.endswith(self.extensions)
+
+    def schedule(self, path: str, action: str, is_directory: bool = False):
+        # Deduplicated and filtered by the normalized key; the callbacks get the path itself
+        path = os.path.abspath(path)
+        key = normalize_path(path)
+        if is_directory:
+            prefix = key + os.sep
+            for known in [p for k, p in self._known.items() if k.startswith(prefix)]:
+                self.schedule(known, action)
+            return
+        if not self._wanted(path):
+            return
+        with self._lock:
+            self.counts["events"] += 1
+            if key in self._pending:
+                self.counts["coalesced"] += 1
+            # The latest event decides the action (modify-then-delete is a delete, delete-then-create an index)
+            self._pending[key] = (action, time.monotonic() + self.debounce, path)
+        if action == "delete":
+            self._known.pop(key, None)
+        else:
+            self._known[key] = path
+        self._wakeup.set()
+
+    def schedule_tree(self, root: str):
+        for dirpath, _, filenames in os.walk(root):
+            for name in filenames:
+                self.schedule(os.path.join(dirpath, name), "index")
+
+    # --- Debounce timer ---
+    def _timer_loop(self):
+        while not self._stopped.is_set():
+            self._wakeup.clear()
+            now = time.monotonic()
+            with self._lock:
+                waiting = {k: t for k, (_, t, _) in self._pending.items() if k not in self._queued}
+            due = [k for k, t in waiting.items() if t <= now]
+            next_due = min((t for t in waiting.values() if t > now), default=None)
+            for key in due:
+                with self._lock:
+                    # Re-check: another event may have pushed the deadline back meanwhile
+                    entry = self._pending.get(key)
+                    if entry is None or entry[1] > now:
+                        continue
+                    try:
+                        self._queue.put_nowait(key)
+                    except queue.Full:
+                        # Back-pressure: keep it pending and retry on the next tick
+                        next_due = now + self.debounce
+                        break
+                    self._queued.add(key)
+            wait = self.debounce if next_due is None else max(0.01, next_due - time.monotonic())
+            self._wakeup.wait(timeout=wait)
+
+    # --- Worker ---
+    def _worker_loop(self):
+        while not self._stopped.is_set():
+            try:
+                key = self._queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            with self._lock:
+                action, _, path = self._pending.pop(key, ("index", 0, key))
+                self._queued.discard(key)
+            try:
+                if action == "delete" or not os.path.exists(path):
+                    self.on_delete(path)
+                    outcome = "deleted"
+                else:
+                    self.on_index(path)
+                    outcome = "indexed"
+            except Exception as e:
+                outcome = "failed"
+                print(f"❌ Reindex of {path} failed: {e}")
+            with self._lock:
+                self.counts[outcome] += 1
+            self._queue.task_done()
+
+    def start(self):
+        self._threads = [threading.Thread(target=self._timer_loop, name="watch-debounce", daemon=True),
+                         threading.Thread(target=self._worker_loop, name="watch-reindex", daemon=True)]
+        for thread in self._threads:
+            thread.start()
+        self._observer.start()
+
+    def stop(self):
+        self._observer.stop()
+        self._observer.join()
+        self._stopped.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self.counts, "pending": len(self._pending), "queued": self._queue.qsize()}